@@ -0,0 +1,148 @@
+# Copyright 2017 Google Inc. and Skytruth Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+""" Freeze a checkpoint into a single optimized inference graph.
+
+The graph is built exactly as `Inferer` builds it, the checkpoint restored
+and the variables converted to constants. Constants are then folded, along
+with the batch norm layers, which become part of the convolution weights.
+Dropout is already an identity in the inference net. The result can be
+passed to `Inferer` (or `sharded_inference`) in place of the checkpoint:
+
+    python -m classification.export_graph prod.fishing_detection \\
+        --feature_dimensions 14 \\
+        --model_checkpoint_path path/to/model.ckpt-200000 \\
+        --output_path path/to/fishing_detection.pb
+"""
+from __future__ import absolute_import
+import argparse
+import logging
+import tensorflow as tf
+
+from . import run_inference
+from .sharded_inference import load_model
+
+try:
+    from tensorflow.tools.graph_transforms import TransformGraph
+except ImportError:
+    TransformGraph = None
+
+TRANSFORMS = [
+    'remove_nodes(op=Identity, op=CheckNumerics)',
+    'fold_constants(ignore_errors=true)',
+    'fold_batch_norms',
+    'fold_old_batch_norms',
+    'fold_constants(ignore_errors=true)',
+    'sort_by_execution_order',
+]
+
+
+def freeze_inferer(inferer, optimize=True):
+    """ Freeze the restored graph of an `Inferer`.
+
+    Returns:
+        A GraphDef with `run_inference.PREDICTION_NAME` outputs.
+    """
+    inputs = [
+        run_inference.FEATURES_NAME, run_inference.TIMESTAMPS_NAME,
+        run_inference.TIME_RANGES_NAME, run_inference.MMSIS_NAME
+    ]
+    with inferer.sess.graph.as_default():
+        outputs = [
+            tf.identity(
+                o.prediction, name=run_inference.PREDICTION_NAME % i).op.name
+            for (i, o) in enumerate(inferer.objectives)
+        ]
+    # Inferer feeds and fetches all the inputs, so keep them even if the
+    # predictions don't use them.
+    graph_def = tf.graph_util.convert_variables_to_constants(
+        inferer.sess, inferer.sess.graph.as_graph_def(), outputs + inputs)
+    if not optimize:
+        return graph_def
+    if TransformGraph is None:
+        logging.warning('Graph transforms are unavailable; writing the '
+                        'frozen graph without optimizing it.')
+        return graph_def
+    # The inputs are listed as outputs too so they aren't removed.
+    return TransformGraph(graph_def, inputs, outputs + inputs, TRANSFORMS)
+
+
+def export_inference_graph(model, model_checkpoint_path, output_path,
+                           stitch_width=None, optimize=True):
+    """ Freeze `model_checkpoint_path` and write it to `output_path`."""
+    with tf.Graph().as_default():
+        inferer = run_inference.Inferer(
+            model,
+            model_checkpoint_path,
+            None,
+            prefetch_workers=0,
+            stitch_width=stitch_width)
+        try:
+            graph_def = freeze_inferer(inferer, optimize)
+        finally:
+            inferer.close()
+    with tf.gfile.GFile(output_path, 'wb') as f:
+        f.write(graph_def.SerializeToString())
+    logging.info('Wrote %d node graph to %s', len(graph_def.node),
+                 output_path)
+
+
+def main(args):
+    logging.getLogger().setLevel(logging.INFO)
+    tf.logging.set_verbosity(tf.logging.INFO)
+    model = load_model(args.model_name, args.feature_dimensions)
+    export_inference_graph(model, args.model_checkpoint_path,
+                           args.output_path, args.stitch_width,
+                           not args.no_optimize)
+
+
+def parse_args():
+    """ Parses command-line arguments for graph export."""
+    argparser = argparse.ArgumentParser(
+        'Freeze a checkpoint into an inference graph.')
+
+    argparser.add_argument(
+        'model_name', help='Model module, e.g. prod.fishing_detection.')
+
+    argparser.add_argument(
+        '--feature_dimensions',
+        required=True,
+        type=int,
+        help='The number of dimensions of a classification feature.')
+
+    argparser.add_argument(
+        '--model_checkpoint_path',
+        required=True,
+        help='Path (local or gs://) of the checkpoint to freeze.')
+
+    argparser.add_argument(
+        '--output_path',
+        required=True,
+        help='Path (local or gs://) to write the `.pb` graph to.')
+
+    argparser.add_argument(
+        '--stitch_width',
+        type=int,
+        help='Export fishing models for inputs this wide.')
+
+    argparser.add_argument(
+        '--no_optimize',
+        action='store_true',
+        help='Only freeze the graph; skip constant and batch norm folding.')
+
+    return argparser.parse_args()
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    main(args)
@@ -0,0 +1,61 @@
+# Copyright 2017 Google Inc. and Skytruth Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import os
+import numpy as np
+import tensorflow as tf
+from classification import export_graph
+from classification.model_fixtures import load_model, write_initial_checkpoint
+from classification.run_inference import Inferer
+
+
+class ExportGraphTest(tf.test.TestCase):
+    model_name = 'prod.fishing_detection'
+    num_feature_dimensions = 11
+
+    def _predictions(self, checkpoint_path, batch):
+        with tf.Graph().as_default():
+            model = load_model(self.model_name, self.num_feature_dimensions)
+            inferer = Inferer(model, checkpoint_path, None, prefetch_workers=0)
+            try:
+                return inferer._run_batch(batch)[3:]
+            finally:
+                inferer.close()
+
+    def test_frozen_graph_matches_checkpoint(self):
+        checkpoint_path = write_initial_checkpoint(
+            self.model_name, self.num_feature_dimensions,
+            os.path.join(self.get_temp_dir(), 'model.ckpt'))
+        graph_path = os.path.join(self.get_temp_dir(), 'model.pb')
+        export_graph.export_inference_graph(
+            load_model(self.model_name, self.num_feature_dimensions),
+            checkpoint_path, graph_path)
+
+        random_state = np.random.RandomState(42)
+        width = 1024
+        batch = (random_state.randn(2, 1, width, self.num_feature_dimensions)
+                 .astype(np.float32),
+                 np.tile(np.arange(width, dtype=np.int32), [2, 1]),
+                 np.array([[0, width]] * 2, dtype=np.int32),
+                 np.array([1, 2], dtype=np.int64))
+
+        expected = self._predictions(checkpoint_path, batch)
+        actual = self._predictions(graph_path, batch)
+
+        self.assertEqual(len(expected), len(actual))
+        for e, a in zip(expected, actual):
+            self.assertAllClose(e, a, atol=1e-5)
+
+
+if __name__ == '__main__':
+    tf.test.main()
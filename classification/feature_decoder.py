@@ -0,0 +1,287 @@
+# Copyright 2017 Google Inc. and Skytruth Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+""" Decoding of vessel feature tfrecords without Tensorflow.
+
+The feature files hold one `tf.train.SequenceExample` per vessel with an int64
+`mmsi` context feature and a `movement_features` feature list of fixed length
+float lists. This module decodes that wire format directly into NumPy arrays so
+that readers do not need a session round trip per record, and so that they can
+run in worker processes that never import Tensorflow.
+"""
+from __future__ import absolute_import
+import os
+import shutil
+import struct
+import subprocess
+import tempfile
+import numpy as np
+
+# Protobuf wire types.
+_VARINT = 0
+_FIXED64 = 1
+_LENGTH_DELIMITED = 2
+_FIXED32 = 5
+
+
+def _read_varint(buf, pos):
+    result = 0
+    shift = 0
+    while True:
+        b = buf[pos]
+        pos += 1
+        result |= (b & 0x7f) << shift
+        if not b & 0x80:
+            return result, pos
+        shift += 7
+
+
+def _iter_fields(buf, start, end):
+    """Iterate over the fields of a serialized message in buf[start:end].
+
+    Yields:
+        (field_number, wire_type, value) tuples. Value is the decoded integer
+        for varints, and the (start, end) span of the payload otherwise.
+    """
+    pos = start
+    while pos < end:
+        key, pos = _read_varint(buf, pos)
+        field_number = key >> 3
+        wire_type = key & 0x7
+        if wire_type == _VARINT:
+            value, pos = _read_varint(buf, pos)
+        elif wire_type == _LENGTH_DELIMITED:
+            length, pos = _read_varint(buf, pos)
+            value = (pos, pos + length)
+            pos += length
+        elif wire_type == _FIXED64:
+            value = (pos, pos + 8)
+            pos += 8
+        elif wire_type == _FIXED32:
+            value = (pos, pos + 4)
+            pos += 4
+        else:
+            raise ValueError('Unsupported wire type %s' % wire_type)
+        yield field_number, wire_type, value
+    if pos != end:
+        raise ValueError('Truncated message')
+
+
+def _find_map_value(buf, span, key):
+    """Find the span of `key` in a map<string, Message> field (number 1)."""
+    value_span = None
+    for field, wire_type, entry in _iter_fields(buf, *span):
+        if field != 1 or wire_type != _LENGTH_DELIMITED:
+            continue
+        entry_key = None
+        entry_value = None
+        for f, wt, v in _iter_fields(buf, *entry):
+            if f == 1 and wt == _LENGTH_DELIMITED:
+                entry_key = bytes(buf[v[0]:v[1]])
+            elif f == 2 and wt == _LENGTH_DELIMITED:
+                entry_value = v
+        if entry_key == key:
+            # Later entries win, as for protobuf maps.
+            value_span = entry_value if (entry_value is not None) else (0, 0)
+    return value_span
+
+
+def _to_int64(value):
+    if value >= 1 << 63:
+        value -= 1 << 64
+    return value
+
+
+def _decode_int64_list(buf, feature_span):
+    """Decode the int64_list (field 3) of a tf.train.Feature."""
+    values = []
+    for field, wire_type, value in _iter_fields(buf, *feature_span):
+        if field != 3 or wire_type != _LENGTH_DELIMITED:
+            continue
+        for f, wt, v in _iter_fields(buf, *value):
+            if f != 1:
+                continue
+            if wt == _VARINT:
+                values.append(_to_int64(v))
+            elif wt == _LENGTH_DELIMITED:
+                # Packed encoding.
+                pos, end = v
+                while pos < end:
+                    x, pos = _read_varint(buf, pos)
+                    values.append(_to_int64(x))
+    return values
+
+
+def _float_list_spans(buf, feature_span):
+    """Return the spans of the float values in the float_list of a Feature.
+
+    Packed values are returned as a single span; unpacked values one span
+    per float.
+    """
+    spans = []
+    for field, wire_type, value in _iter_fields(buf, *feature_span):
+        if field != 2 or wire_type != _LENGTH_DELIMITED:
+            continue
+        for f, wt, v in _iter_fields(buf, *value):
+            if f == 1 and wt in (_LENGTH_DELIMITED, _FIXED32):
+                spans.append(v)
+    return spans
+
+
+class NumpyDeserializer(object):
+    """ Drop in replacement for `file_iterator.Deserializer`.
+
+    Decodes serialized vessel SequenceExamples into the same
+    `(context_features, sequence_features)` pair that the Tensorflow based
+    deserializer returns, without building a graph or running a session.
+    """
+
+    def __init__(self, num_features):
+        self.num_features = num_features
+        self._point_bytes = 4 * num_features
+
+    def __call__(self, serialized_example):
+        buf = bytearray(serialized_example)
+        context_span = (0, 0)
+        feature_lists_span = (0, 0)
+        for field, wire_type, value in _iter_fields(buf, 0, len(buf)):
+            if wire_type != _LENGTH_DELIMITED:
+                continue
+            if field == 1:
+                context_span = value
+            elif field == 2:
+                feature_lists_span = value
+
+        mmsi_span = _find_map_value(buf, context_span, b'mmsi')
+        if mmsi_span is None:
+            raise ValueError('Missing required context feature "mmsi"')
+        mmsi_values = _decode_int64_list(buf, mmsi_span)
+        if len(mmsi_values) != 1:
+            raise ValueError('Expected exactly one mmsi, found %s' %
+                             len(mmsi_values))
+
+        movement_span = _find_map_value(buf, feature_lists_span,
+                                        b'movement_features')
+        if movement_span is None:
+            raise ValueError(
+                'Missing required feature list "movement_features"')
+
+        context_features = {'mmsi': np.int64(mmsi_values[0])}
+        sequence_features = {
+            'movement_features': self._decode_movement_features(buf,
+                                                                movement_span)
+        }
+        return context_features, sequence_features
+
+    def deserialize_many(self, serialized_examples):
+        """Decode several serialized examples in one call.
+
+        Returns:
+            A list of `(context_features, sequence_features)` pairs, one
+            per example, in order.
+        """
+        return [self(x) for x in serialized_examples]
+
+    def _decode_movement_features(self, buf, span):
+        data = np.frombuffer(buf, dtype=np.uint8)
+        points = self._fast_point_bytes(buf, data, span)
+        if points is None:
+            return self._decode_points(buf, span)
+        # Copy each point's packed float bytes out of the records, then
+        # reinterpret them as floats.
+        features = np.ascontiguousarray(points).view('<f4')
+        return features.astype(np.float32, copy=False)
+
+    def _fast_point_bytes(self, buf, data, span):
+        """Find the point bytes assuming every point is framed identically.
+
+        Serialized feature lists almost always repeat the same header bytes
+        before each point's packed floats, so view the list as a
+        `[count, stride]` array of records and check the headers across it
+        rather than walking every point.
+
+        Returns:
+            A `[count, 4 * num_features]` uint8 view of the points' float
+            bytes, or None if the assumption fails.
+        """
+        start, end = span
+        if start == end:
+            return np.zeros([0, self._point_bytes], dtype=np.uint8)
+        try:
+            field, wire_type, feature = next(_iter_fields(buf, start, end))
+            spans = _float_list_spans(buf, feature)
+        except (ValueError, IndexError, StopIteration):
+            return None
+        if (field != 1 or wire_type != _LENGTH_DELIMITED or len(spans) != 1 or
+                spans[0][1] - spans[0][0] != self._point_bytes or
+                spans[0][1] != feature[1]):
+            return None
+        header_size = spans[0][0] - start
+        stride = feature[1] - start
+        if (end - start) % stride:
+            return None
+        count = (end - start) // stride
+        records = data[start:end].reshape([count, stride])
+        if not (records[:, :header_size] == records[0, :header_size]).all():
+            return None
+        return records[:, header_size:]
+
+    def _decode_points(self, buf, span):
+        """Decode points one at a time; handles any valid framing."""
+        points = []
+        for field, wire_type, feature in _iter_fields(buf, *span):
+            if field != 1 or wire_type != _LENGTH_DELIMITED:
+                continue
+            spans = _float_list_spans(buf, feature)
+            sizes = [e - s for (s, e) in spans]
+            if sum(sizes) != self._point_bytes:
+                raise ValueError(
+                    'Key: movement_features, Index: %s. Number of float values '
+                    '!= expected (%s)' % (len(points), self.num_features))
+            raw = b''.join(bytes(buf[s:e]) for (s, e) in spans)
+            points.append(np.frombuffer(raw, dtype='<f4'))
+        features = np.empty([len(points), self.num_features], dtype=np.float32)
+        for i, p in enumerate(points):
+            features[i] = p
+        return features
+
+
+def iter_tf_records(path):
+    """Iterate over the serialized records of a local TFRecord file.
+
+    This reads the TFRecord framing directly (CRCs are not checked). Files
+    on GCS are first copied to a temporary directory using `gsutil`.
+    """
+    if path.startswith('gs://'):
+        temp_dir = tempfile.mkdtemp()
+        try:
+            local_path = os.path.join(temp_dir, os.path.basename(path))
+            subprocess.check_call(['gsutil', '-q', 'cp', path, local_path])
+            for record in iter_tf_records(local_path):
+                yield record
+        finally:
+            shutil.rmtree(temp_dir)
+        return
+    with open(path, 'rb') as f:
+        while True:
+            header = f.read(12)
+            if not header:
+                return
+            if len(header) != 12:
+                raise IOError('Truncated record header in %s' % path)
+            length, = struct.unpack('<Q', header[:8])
+            record = f.read(length)
+            footer = f.read(4)
+            if len(record) != length or len(footer) != 4:
+                raise IOError('Truncated record in %s' % path)
+            yield record
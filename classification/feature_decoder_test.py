@@ -0,0 +1,83 @@
+# Copyright 2017 Google Inc. and Skytruth Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import numpy as np
+import tensorflow as tf
+from classification import feature_decoder
+from classification import file_iterator
+
+
+def _serialize(mmsi, movement_features):
+    example = tf.train.SequenceExample()
+    example.context.feature['mmsi'].int64_list.value.append(mmsi)
+    feature_list = example.feature_lists.feature_list['movement_features']
+    for point in movement_features:
+        feature_list.feature.add().float_list.value.extend(point)
+    return example.SerializeToString()
+
+
+class NumpyDeserializerTest(tf.test.TestCase):
+    num_features = 13
+
+    def _check_matches_tensorflow(self, mmsi, movement_features):
+        serialized = _serialize(mmsi, movement_features)
+        with self.test_session() as sess:
+            expected_context, expected_sequence = file_iterator.Deserializer(
+                self.num_features, sess)(serialized)
+        context, sequence = feature_decoder.NumpyDeserializer(
+            self.num_features)(serialized)
+
+        self.assertEqual(expected_context['mmsi'], context['mmsi'])
+        self.assertEqual(expected_sequence['movement_features'].dtype,
+                         sequence['movement_features'].dtype)
+        self.assertAllEqual(expected_sequence['movement_features'],
+                            sequence['movement_features'])
+
+    def test_matches_tensorflow(self):
+        features = np.random.RandomState(42).randn(
+            257, self.num_features).astype(np.float32)
+        self._check_matches_tensorflow(251822362, features)
+
+    def test_single_point(self):
+        features = np.arange(self.num_features, dtype=np.float32)[np.newaxis]
+        self._check_matches_tensorflow(1, features)
+
+    def test_deserialize_many(self):
+        deserializer = feature_decoder.NumpyDeserializer(self.num_features)
+        features = np.ones([10, self.num_features], dtype=np.float32)
+        results = deserializer.deserialize_many(
+            [_serialize(i, features * i) for i in range(3)])
+        for i, (context, sequence) in enumerate(results):
+            self.assertEqual(i, context['mmsi'])
+            self.assertAllEqual(features * i, sequence['movement_features'])
+
+    def test_wrong_feature_count(self):
+        deserializer = feature_decoder.NumpyDeserializer(self.num_features)
+        features = np.zeros([3, self.num_features - 1], dtype=np.float32)
+        with self.assertRaises(ValueError):
+            deserializer(_serialize(1, features))
+
+    def test_iter_tf_records(self):
+        path = os.path.join(self.get_temp_dir(), 'records.tfrecord')
+        features = np.ones([4, self.num_features], dtype=np.float32)
+        records = [_serialize(i, features) for i in range(3)]
+        with tf.python_io.TFRecordWriter(path) as writer:
+            for x in records:
+                writer.write(x)
+        self.assertEqual(records, list(feature_decoder.iter_tf_records(path)))
+
+
+if __name__ == '__main__':
+    tf.test.main()
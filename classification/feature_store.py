@@ -0,0 +1,217 @@
+# Copyright 2017 Google Inc. and Skytruth Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+""" Packed, memory mapped alternative to per-vessel feature tfrecords.
+
+A feature store is a directory holding:
+
+    points.bin: the movement features of every vessel as one contiguous
+        little-endian float32 array of shape [total_points, num_features].
+    index.npz: the mmsis, point offsets and point counts of each vessel, plus
+        `num_features`.
+
+`FeatureStore` maps `points.bin` read only, so reading a vessel is a slice of
+the (page cached) mapping rather than a file open and protobuf decode.
+
+To convert a directory of `<mmsi>.tfrecord` feature files:
+
+    python -m classification.feature_store \\
+        --root_feature_path gs://bucket/pipeline/output/features \\
+        --feature_dimensions 14 \\
+        --output_path /mnt/data/feature_store
+"""
+from __future__ import absolute_import
+import argparse
+import logging
+import os
+import subprocess
+import numpy as np
+
+from . import feature_decoder
+
+POINTS_FILE = 'points.bin'
+INDEX_FILE = 'index.npz'
+
+
+def write_feature_store(feature_paths, store_path, num_features):
+    """ Pack the vessels in `feature_paths` into a feature store.
+
+    Args:
+        feature_paths: iterable of tfrecord feature file paths (local or gs://).
+        store_path: local directory to write the store to.
+        num_features: number of features per point, including the timestamp.
+
+    Returns:
+        The number of vessels written.
+    """
+    if not os.path.exists(store_path):
+        os.makedirs(store_path)
+    deserializer = feature_decoder.NumpyDeserializer(num_features)
+    mmsis = []
+    offsets = []
+    lengths = []
+    offset = 0
+    with open(os.path.join(store_path, POINTS_FILE), 'wb') as f:
+        for i, path in enumerate(feature_paths):
+            if i % 1000 == 0:
+                logging.info('Packing file %s: %s', i, path)
+            for record in feature_decoder.iter_tf_records(path):
+                context_features, sequence_features = deserializer(record)
+                features = sequence_features['movement_features']
+                features.astype('<f4').tofile(f)
+                mmsis.append(context_features['mmsi'])
+                offsets.append(offset)
+                lengths.append(len(features))
+                offset += len(features)
+    np.savez(
+        os.path.join(store_path, INDEX_FILE),
+        mmsis=np.array(mmsis, dtype=np.int64),
+        offsets=np.array(offsets, dtype=np.int64),
+        lengths=np.array(lengths, dtype=np.int64),
+        num_features=np.int64(num_features))
+    return len(mmsis)
+
+
+class FeatureStore(object):
+    """ Read only view of a feature store.
+
+    Vessels are returned in the same `(context_features, sequence_features)`
+    form as the tfrecord deserializers, with the movement features being a
+    zero copy slice of the memory mapped points.
+    """
+
+    def __init__(self, store_path):
+        self.store_path = store_path
+        with np.load(os.path.join(store_path, INDEX_FILE)) as index:
+            self.num_features = int(index['num_features'])
+            mmsis = index['mmsis']
+            offsets = index['offsets']
+            lengths = index['lengths']
+        total_points = int((offsets + lengths).max()) if len(offsets) else 0
+        if total_points:
+            self.points = np.memmap(
+                os.path.join(store_path, POINTS_FILE),
+                dtype='<f4',
+                mode='r',
+                shape=(total_points, self.num_features))
+        else:
+            self.points = np.zeros([0, self.num_features], dtype=np.float32)
+        # Later entries win if an mmsi was packed more than once. Keys are
+        # normalised to ints, as are the mmsis looked up in `_key`.
+        self._index = dict(
+            zip([int(x) for x in mmsis.tolist()],
+                zip(offsets.tolist(), lengths.tolist())))
+
+    # Memory maps would be pickled as a full copy of the data, so only send
+    # the path to other processes and reopen the store there.
+    def __getstate__(self):
+        return {'store_path': self.store_path}
+
+    def __setstate__(self, state):
+        self.__init__(state['store_path'])
+
+    @property
+    def mmsis(self):
+        return sorted(self._index)
+
+    def __len__(self):
+        return len(self._index)
+
+    @staticmethod
+    def _key(mmsi):
+        """ The int index key for `mmsi`, or None if it has none."""
+        try:
+            return int(mmsi)
+        except (TypeError, ValueError):
+            return None
+
+    def __contains__(self, mmsi):
+        return self._key(mmsi) in self._index
+
+    def get(self, mmsi):
+        """ Return `(context_features, sequence_features)` for `mmsi`.
+
+        Raises:
+            KeyError: if `mmsi` is not in the store.
+        """
+        key = self._key(mmsi)
+        if key not in self._index:
+            raise KeyError(mmsi)
+        mmsi = key
+        offset, length = self._index[mmsi]
+        context_features = {'mmsi': np.int64(mmsi)}
+        sequence_features = {
+            'movement_features': self.points[offset:offset + length]
+        }
+        return context_features, sequence_features
+
+    def read_vessels(self, mmsi):
+        """ Yield the vessel for `mmsi`, if present, like a feature file."""
+        if mmsi in self:
+            yield self.get(mmsi)
+
+
+def _read_mmsi_list(path):
+    if path.startswith('gs://'):
+        text = subprocess.check_output(['gsutil', 'cat', path])
+    else:
+        with open(path) as f:
+            text = f.read()
+    return [x.strip() for x in text.split() if x.strip()]
+
+
+def parse_args():
+    """ Parses command-line arguments for feature store conversion."""
+    argparser = argparse.ArgumentParser(
+        'Pack vessel feature tfrecords into a feature store.')
+
+    argparser.add_argument(
+        '--root_feature_path',
+        required=True,
+        help='The root path to the vessel movement feature files.')
+
+    argparser.add_argument(
+        '--feature_dimensions',
+        required=True,
+        type=int,
+        help='The number of dimensions of a classification feature.')
+
+    argparser.add_argument(
+        '--output_path',
+        required=True,
+        help='Local directory to write the feature store to.')
+
+    argparser.add_argument(
+        '--mmsi_file',
+        help='File listing the mmsis to pack. Defaults to the mmsi list '
+        'written by the feature pipeline next to the features.')
+
+    return argparser.parse_args()
+
+
+def main(args):
+    logging.getLogger().setLevel(logging.INFO)
+    mmsi_file = args.mmsi_file
+    if mmsi_file is None:
+        root_output_path, _ = os.path.split(args.root_feature_path)
+        mmsi_file = root_output_path + '/mmsis/part-00000-of-00001.txt'
+    mmsis = _read_mmsi_list(mmsi_file)
+    paths = ['%s/%s.tfrecord' % (args.root_feature_path, mmsi)
+             for mmsi in mmsis]
+    count = write_feature_store(paths, args.output_path,
+                                args.feature_dimensions + 1)
+    logging.info('Packed %s vessels into %s', count, args.output_path)
+
+
+if __name__ == '__main__':
+    main(parse_args())
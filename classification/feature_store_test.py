@@ -0,0 +1,91 @@
+# Copyright 2017 Google Inc. and Skytruth Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import pickle
+import numpy as np
+import tensorflow as tf
+from classification import feature_store
+from classification import file_iterator
+from classification.feature_decoder_test import _serialize
+
+
+class FeatureStoreTest(tf.test.TestCase):
+    num_features = 5
+
+    def _write_store(self, vessels):
+        paths = []
+        for mmsi, features in vessels:
+            path = os.path.join(self.get_temp_dir(), '%s.tfrecord' % mmsi)
+            with tf.python_io.TFRecordWriter(path) as writer:
+                writer.write(_serialize(mmsi, features))
+            paths.append(path)
+        store_path = os.path.join(self.get_temp_dir(), 'store')
+        feature_store.write_feature_store(paths, store_path,
+                                          self.num_features)
+        return feature_store.FeatureStore(store_path)
+
+    def _vessels(self):
+        random_state = np.random.RandomState(42)
+        vessels = []
+        for mmsi, count in [(3, 10), (1, 1), (2, 300)]:
+            features = random_state.randn(count, self.num_features)
+            features[:, 0] = np.arange(count)
+            vessels.append((mmsi, features.astype(np.float32)))
+        return vessels
+
+    def test_round_trip(self):
+        vessels = self._vessels()
+        store = self._write_store(vessels)
+
+        self.assertEqual([1, 2, 3], store.mmsis)
+        self.assertEqual(self.num_features, store.num_features)
+        for mmsi, features in vessels:
+            context, sequence = store.get(str(mmsi))
+            self.assertEqual(mmsi, context['mmsi'])
+            self.assertAllEqual(features, sequence['movement_features'])
+        self.assertNotIn(4, store)
+        with self.assertRaises(KeyError):
+            store.get(4)
+
+    def test_unconvertible_keys(self):
+        store = self._write_store(self._vessels())
+
+        self.assertIn(' 3 ', store)
+        self.assertNotIn('not-an-mmsi', store)
+        self.assertNotIn(None, store)
+        for mmsi in ['not-an-mmsi', '', None]:
+            with self.assertRaises(KeyError):
+                store.get(mmsi)
+        self.assertEqual([], list(store.read_vessels('not-an-mmsi')))
+
+    def test_pickle_reopens(self):
+        vessels = self._vessels()
+        store = pickle.loads(pickle.dumps(self._write_store(vessels)))
+        _, sequence = store.get(2)
+        self.assertAllEqual(vessels[2][1], sequence['movement_features'])
+
+    def test_all_slice_iterator(self):
+        vessels = self._vessels()
+        store = self._write_store(vessels)
+        time_ranges = [(0, 1000)]
+
+        windows = list(file_iterator.cropping_all_slice_feature_file_iterator(
+            [3, 4, 2], store, time_ranges, 8, 1))
+
+        self.assertEqual([3, 2], [x[3] for x in windows])
+
+
+if __name__ == '__main__':
+    tf.test.main()
@@ -1,5 +1,9 @@
 import datetime
+import functools
 import logging
+import multiprocessing
+from multiprocessing.pool import ThreadPool
+from collections import deque
 import numpy as np
 import tempfile
 import subprocess
@@ -13,6 +17,9 @@ import tensorflow as tf
 from .utility import np_array_extract_all_fixed_slices
 from .utility import np_array_extract_slices_for_time_ranges
 from .utility import np_pad_repeat_slice
+from . import feature_decoder
+from . import feature_store
+from . import inference_stats
 
 
 class GCSFile(object):
@@ -79,7 +86,22 @@ class Deserializer(object):
 # Can we unify this with the version in utility?
 
 def process_fixed_window_features(context_features, sequence_features, 
-        num_features, window_size, shift, start_date, end_date, win_start, win_end):
+        num_features, window_size, shift, start_date, end_date, win_start, win_end,
+        anchor_start=False, short_window=None):
+    """ Extract the fixed length windows of one vessel.
+
+    By default the windows end at the last point (or the padded end date), so
+    appending points to a track moves every window. With `anchor_start` the
+    first window still ends at the last point, but the rest lie on a grid of
+    `shift` points from the first point of the track, so appending points
+    only changes the first window and adds windows at the end of the grid.
+    A grid window ending at the last point is left out, since it would
+    repeat the first window.
+
+    Tracks too short to fill one window are padded by replicating their first
+    point, unless `short_window`, a `(window_size, shift, win_start, win_end)`
+    tuple, gives narrower windows to extract from them instead.
+    """
     
     features = sequence_features['movement_features']
     mmsi = context_features['mmsi']
@@ -114,6 +136,12 @@ def process_fixed_window_features(context_features, sequence_features,
     else:
         raw_start_i = 0
 
+    if end_i < window_size and short_window is not None:
+        short_size, short_shift, short_start, short_end = short_window
+        return process_fixed_window_features(context_features,
+                sequence_features, num_features, short_size, short_shift,
+                start_date, end_date, short_start, short_end, anchor_start)
+
     if end_i < window_size:
         # There aren't enough points to classify, so pad by replicating the first point.
         # Do this here so raw_start_i is calculated on actual features
@@ -123,6 +151,22 @@ def process_fixed_window_features(context_features, sequence_features,
         end_i += count
         raw_start_i += count
 
+    if anchor_start:
+        last = np_array_extract_all_fixed_slices(
+            features[end_i - window_size:end_i], num_features, mmsi,
+            window_size, shift)
+        # Round down to the grid, then keep the grid windows ending before
+        # the last point.
+        start_i = max(raw_start_i, 0) // shift * shift
+        while end_i - start_i < window_size and start_i >= shift:
+            start_i -= shift
+        grid_end_i = start_i + window_size + (
+            (end_i - start_i - window_size - 1) // shift) * shift
+        grid = np_array_extract_all_fixed_slices(
+            features[start_i:max(grid_end_i, start_i)], num_features, mmsi,
+            window_size, shift)
+        return tuple(np.concatenate([x, y]) for (x, y) in zip(last, grid))
+
     # Now clean up raw_start. 
     #   First add enough points that we are at the beginning of a shift.
     delta = ((end_i - window_size) - raw_start_i) % shift
@@ -148,17 +192,179 @@ def process_fixed_window_features(context_features, sequence_features,
 
 
 
+def _read_vessels(item, deserializer, use_tf, times):
+    """ Yield `(context_features, sequence_features)` for the vessels in item.
+
+    Item is a feature file path or, if deserializer is a
+    `feature_store.FeatureStore`, an mmsi. Time spent reading and decoding
+    is added to the `times` dict.
+    """
+    t0 = time.time()
+    if isinstance(deserializer, feature_store.FeatureStore):
+        vessels = list(deserializer.read_vessels(item))
+        times[inference_stats.READ] += time.time() - t0
+        for vessel in vessels:
+            yield vessel
+        return
+    if use_tf:
+        with GCSExampleIter(item) as exmpliter:
+            records = list(exmpliter)
+    else:
+        records = list(feature_decoder.iter_tf_records(item))
+    times[inference_stats.READ] += time.time() - t0
+    for exmp in records:
+        t0 = time.time()
+        vessel = deserializer(exmp)
+        times[inference_stats.DECODE] += time.time() - t0
+        yield vessel
+
+
+def _read_windows(path, deserializer, use_tf, process):
+    """ Window each vessel in path with `process`.
+
+    Returns:
+        A list of windows and the `inference_stats.new_file_stats` for path.
+    """
+    stats = inference_stats.new_file_stats()
+    times = stats['times']
+    windows = []
+    for context_features, sequence_features in _read_vessels(
+            path, deserializer, use_tf, times):
+        t0 = time.time()
+        vessel_windows = list(zip(*process(context_features,
+                                           sequence_features)))
+        times[inference_stats.WINDOW] += time.time() - t0
+        stats['points_per_vessel'].append(
+            len(sequence_features['movement_features']))
+        stats['windows_per_vessel'].append(len(vessel_windows))
+        windows.extend(vessel_windows)
+    return windows, stats
+
+
+def _read_fixed_window_file(path, deserializer, window_size, shift, start_date,
+                            end_date, win_start, win_end, anchor_start=False,
+                            short_window=None, use_tf=True):
+    def process(context_features, sequence_features):
+        return process_fixed_window_features(context_features,
+                sequence_features, deserializer.num_features,
+                window_size, shift, start_date, end_date, win_start, win_end,
+                anchor_start, short_window)
+
+    return _read_windows(path, deserializer, use_tf, process)
+
+
+def _windows_nbytes(windows):
+    # Windows are often overlapping strided views of one track, so the
+    # memory they span is counted once rather than summing their sizes.
+    spans = sorted(
+        np.byte_bounds(x) for w in windows for x in w
+        if isinstance(x, np.ndarray) and x.size)
+    total = 0
+    end = None
+    for low, high in spans:
+        if end is None or low >= end:
+            total += high - low
+            end = high
+        elif high > end:
+            total += high - end
+            end = high
+    return total
+
+
+def prefetch_map(func, items, num_workers, max_pending, max_bytes=None,
+                 use_processes=False, nbytes=_windows_nbytes):
+    """ Apply func to items in a bounded pool, yielding results in order.
+
+    Args:
+        func: function of one item returning a list of windows. Must be
+            picklable if `use_processes` is set.
+        items: iterable of items to process.
+        num_workers: number of pool workers.
+        max_pending: maximum number of items submitted but not yet consumed.
+        max_bytes: if not None, approximate cap on the memory held by
+            pending results, estimated from the average size of the results
+            seen so far. At least one item is always in flight.
+        use_processes: use a process pool rather than a thread pool.
+        nbytes: function giving the size of a result of func.
+
+    """
+    pool = (multiprocessing.Pool if use_processes else ThreadPool)(num_workers)
+    try:
+        items = iter(items)
+        pending = deque()
+        exhausted = False
+        total_bytes = 0
+        completed = 0
+        while True:
+            while not exhausted and len(pending) < max_pending:
+                if pending and max_bytes is not None and completed:
+                    average_bytes = total_bytes / float(completed)
+                    if (len(pending) + 1) * average_bytes > max_bytes:
+                        break
+                try:
+                    item = next(items)
+                except StopIteration:
+                    exhausted = True
+                    break
+                pending.append(pool.apply_async(func, (item,)))
+            if not pending:
+                return
+            result = pending.popleft().get()
+            total_bytes += nbytes(result)
+            completed += 1
+            yield result
+    finally:
+        pool.terminate()
+
+
+def _iterate_files(read_file, filenames, prefetch, stats):
+    if prefetch is None:
+        results = (read_file(path, use_tf=True) for path in filenames)
+    else:
+        # Process workers read with the pure python TFRecord reader so that
+        # they never touch Tensorflow, which is not fork safe.
+        read_file = functools.partial(
+            read_file, use_tf=not prefetch.get('use_processes', False))
+        results = prefetch_map(read_file, filenames,
+                               nbytes=lambda x: _windows_nbytes(x[0]),
+                               **prefetch)
+    for windows, file_stats in results:
+        if stats is not None:
+            stats.add_file(file_stats)
+        for values in windows:
+            yield values
+
+
 def all_fixed_window_feature_file_iterator(filenames, deserializer,
                                          window_size, shift, start_date, end_date,
-                                         win_start, win_end):
+                                         win_start, win_end, prefetch=None,
+                                         stats=None, anchor_start=False,
+                                         short_window=None):
     """ Set up a file reader and inference feature extractor for the specified files
 
     An inference feature extractor, pulling all sequential fixed-length slices
     from a vessel movement series.
 
     Args:
-        filename_queue: a queue of filenames for feature files to read.
-        num_features: the dimensionality of the features.
+        filenames: the feature files to read or, if deserializer is a
+            `feature_store.FeatureStore`, the mmsis to read from it.
+        deserializer: deserializer for the feature file records, or a
+            `feature_store.FeatureStore`.
+        prefetch: if not None, a dict of keyword arguments for `prefetch_map`
+            (`num_workers`, `max_pending`, `max_bytes`, `use_processes`).
+            Upcoming files are then read and windowed in the background, so
+            the deserializer must be usable off the main thread, for example
+            `feature_decoder.NumpyDeserializer`.
+        stats: if not None, an `inference_stats.InferenceStats` to record the
+            time spent reading, decoding and windowing each file in, and the
+            points and windows per vessel.
+        anchor_start: place all but the first window of each track on a grid
+            starting at its first point rather than ending at its last, so
+            that they don't change as points are appended. See
+            `process_fixed_window_features`.
+        short_window: if not None, `(window_size, shift, win_start, win_end)`
+            of narrower windows to use for tracks too short to fill a
+            `window_size` window, rather than padding them.
 
     Returns:
         A tuple comprising, for the n slices comprising each vessel:
@@ -170,14 +376,14 @@ def all_fixed_window_feature_file_iterator(filenames, deserializer,
           4. A tensor of the mmsis of each vessel of dimension [n].
 
     """
-    for path in filenames:
-        with GCSExampleIter(path) as exmpliter:
-            for exmp in exmpliter:
-                context_features, sequence_features = deserializer(exmp) 
-                for values in zip(*process_fixed_window_features(context_features, 
-                                        sequence_features, deserializer.num_features, 
-                                        window_size, shift, start_date, end_date, win_start, win_end)):
-                    yield values
+    read_file = functools.partial(_read_fixed_window_file,
+                                  deserializer=deserializer,
+                                  window_size=window_size, shift=shift,
+                                  start_date=start_date, end_date=end_date,
+                                  win_start=win_start, win_end=win_end,
+                                  anchor_start=anchor_start,
+                                  short_window=short_window)
+    return _iterate_files(read_file, filenames, prefetch, stats)
 
 
 
@@ -198,9 +404,20 @@ def process_all_slice_features(context_features, sequence_features,
 
 
 
+def _read_all_slice_file(path, deserializer, time_ranges, window_size,
+                         min_points_for_classification, use_tf=True):
+    def process(context_features, sequence_features):
+        return process_all_slice_features(
+                context_features, sequence_features, time_ranges,
+                window_size, min_points_for_classification, deserializer.num_features)
+
+    return _read_windows(path, deserializer, use_tf, process)
+
+
 def cropping_all_slice_feature_file_iterator(filenames, deserializer,
                                            time_ranges, window_size,
-                                           min_points_for_classification):
+                                           min_points_for_classification,
+                                           prefetch=None, stats=None):
     """ Set up a file reader and inference feature extractor for the files in a
         queue.
 
@@ -208,8 +425,10 @@ def cropping_all_slice_feature_file_iterator(filenames, deserializer,
     from a vessel movement series.
 
     Args:
-        filename_queue: a queue of filenames for feature files to read.
-        num_features: the dimensionality of the features.
+        filenames: as for `all_fixed_window_feature_file_iterator`.
+        deserializer: as for `all_fixed_window_feature_file_iterator`.
+        prefetch: as for `all_fixed_window_feature_file_iterator`.
+        stats: as for `all_fixed_window_feature_file_iterator`.
 
     Returns:
         A tuple comprising, for the n slices comprising each vessel:
@@ -221,13 +440,9 @@ def cropping_all_slice_feature_file_iterator(filenames, deserializer,
           4. A tensor of the mmsis of each vessel of dimension [n].
 
     """
-    for path in filenames:
-        with GCSExampleIter(path) as exmpliter:
-            for exmp in exmpliter:
-                context_features, sequence_features = deserializer(exmp) 
-                for values in zip(*process_all_slice_features(
-                        context_features, sequence_features, time_ranges, 
-                        window_size, min_points_for_classification, deserializer.num_features)):
-                    yield values
-
-
+    read_file = functools.partial(_read_all_slice_file,
+                                  deserializer=deserializer,
+                                  time_ranges=time_ranges,
+                                  window_size=window_size,
+                                  min_points_for_classification=min_points_for_classification)
+    return _iterate_files(read_file, filenames, prefetch, stats)
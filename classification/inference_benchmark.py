@@ -0,0 +1,278 @@
+# Copyright 2017 Google Inc. and Skytruth Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+""" Benchmark the stages of `Inferer` on synthetic data.
+
+Writes a freshly initialized checkpoint and synthetic feature files to a
+temporary directory, then times each inference stage separately over all
+the vessels: reading and deserializing the feature files, window
+extraction, `sess.run` and `build_json_results`. Runs offline on CPU, e.g.
+
+    python -m classification.inference_benchmark prod.fishing_detection \\
+        --feature_dimensions 14 \\
+        --num_vessels 50 \\
+        --output_path inference_benchmark.json
+"""
+from __future__ import absolute_import, division
+import argparse
+import dateutil.parser
+import json
+import logging
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import tensorflow as tf
+
+from . import feature_decoder
+from . import file_iterator
+from . import synthetic_features
+from .model_fixtures import load_model, write_initial_checkpoint
+from .run_inference import Inferer, batch_windows
+
+NUMPY_DESERIALIZER = 'numpy'
+TF_DESERIALIZER = 'tf'
+
+
+class _Stage(object):
+    def __init__(self):
+        self.seconds = 0.0
+        self.items = 0
+
+    def report(self):
+        return {
+            'seconds': self.seconds,
+            'items': self.items,
+            'items_per_sec': (self.items / self.seconds
+                              if self.seconds else None),
+        }
+
+
+def _git_revision():
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', 'HEAD'],
+            cwd=os.path.dirname(os.path.abspath(__file__))).strip().decode()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def benchmark_inferer(inferer, paths, deserializer, interval_months,
+                      start_date, end_date):
+    """ Time the stages of inference over the feature files in `paths`.
+
+    Stages are run one after the other over all the data, so each can be
+    timed without the others running.
+
+    Returns:
+        A dict, keyed by stage, of the time taken and items processed.
+    """
+    num_features = inferer.model.num_feature_dimensions + 1
+    if inferer.model.max_window_duration_seconds != 0:
+        time_ranges = inferer._build_time_ranges(interval_months)
+
+        def extract(context_features, sequence_features):
+            return file_iterator.process_all_slice_features(
+                context_features, sequence_features, time_ranges,
+                inferer.model.window_max_points,
+                inferer.min_points_for_classification, num_features)
+    else:
+        shift, b, e = inferer._fixed_window()
+
+        def extract(context_features, sequence_features):
+            return file_iterator.process_fixed_window_features(
+                context_features, sequence_features, num_features,
+                inferer.width, shift, start_date, end_date, b, e,
+                short_window=inferer._short_window())
+
+    stages = {}
+
+    stage = stages['read'] = _Stage()
+    t0 = time.time()
+    records = [x for path in paths for x in feature_decoder.iter_tf_records(path)]
+    stage.seconds = time.time() - t0
+    stage.items = len(records)
+
+    stage = stages['deserialize'] = _Stage()
+    t0 = time.time()
+    vessels = [deserializer(x) for x in records]
+    stage.seconds = time.time() - t0
+    stage.items = len(vessels)
+
+    stage = stages['extract_windows'] = _Stage()
+    t0 = time.time()
+    windows = []
+    for context_features, sequence_features in vessels:
+        windows.extend(zip(*extract(context_features, sequence_features)))
+    stage.seconds = time.time() - t0
+    stage.items = len(windows)
+
+    batches = list(batch_windows(windows, inferer.batch_size))
+    if batches:
+        # The first run sets up the session; don't count it.
+        inferer._run_batch(batches[0])
+
+    stage = stages['session_run'] = _Stage()
+    t0 = time.time()
+    batch_results = [inferer._run_batch(x) for x in batches]
+    stage.seconds = time.time() - t0
+    stage.items = len(windows)
+
+    stage = stages['build_json_results'] = _Stage()
+    t0 = time.time()
+    for batch, batch_result in zip(batches, batch_results):
+        for _ in inferer._build_results(batch_result, len(batch[3])):
+            stage.items += 1
+    stage.seconds = time.time() - t0
+
+    return {k: v.report() for (k, v) in stages.items()}
+
+
+def main(args):
+    logging.getLogger().setLevel(logging.INFO)
+    tf.logging.set_verbosity(tf.logging.WARN)
+
+    num_features = args.feature_dimensions + 1
+    temp_dir = tempfile.mkdtemp()
+    try:
+        feature_path = os.path.join(temp_dir, 'features')
+        logging.info('Writing %d synthetic vessels', args.num_vessels)
+        vessels = synthetic_features.write_synthetic_features(
+            feature_path,
+            args.num_vessels,
+            num_features,
+            mean_points=args.mean_points,
+            seed=args.seed)
+        mmsis = [mmsi for (mmsi, _, _) in vessels]
+        checkpoint_path = write_initial_checkpoint(
+            args.model_name, args.feature_dimensions,
+            os.path.join(temp_dir, 'model.ckpt'))
+
+        if args.deserializer == NUMPY_DESERIALIZER:
+            deserializer = feature_decoder.NumpyDeserializer(num_features)
+            deserializer_sess = None
+        else:
+            with tf.Graph().as_default():
+                deserializer_sess = tf.Session()
+                deserializer = file_iterator.Deserializer(num_features,
+                                                          deserializer_sess)
+
+        with tf.Graph().as_default():
+            model = load_model(args.model_name, args.feature_dimensions)
+            inferer = Inferer(
+                model,
+                checkpoint_path,
+                feature_path,
+                batch_size=args.batch_size,
+                stitch_width=args.stitch_width)
+            try:
+                stages = benchmark_inferer(
+                    inferer, inferer._feature_files(mmsis), deserializer,
+                    args.interval_months, args.start_date, args.end_date)
+            finally:
+                inferer.close()
+                if deserializer_sess is not None:
+                    deserializer_sess.close()
+    finally:
+        shutil.rmtree(temp_dir)
+
+    report = {
+        'git_revision': _git_revision(),
+        'tensorflow_version': tf.__version__,
+        'model_name': args.model_name,
+        'deserializer': args.deserializer,
+        'num_vessels': args.num_vessels,
+        'mean_points': args.mean_points,
+        'seed': args.seed,
+        'batch_size': inferer.batch_size,
+        'width': inferer.width,
+        'stages': stages,
+    }
+    if args.output_path is None:
+        json.dump(report, sys.stdout, indent=2, sort_keys=True)
+    else:
+        with open(args.output_path, 'w') as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+
+
+def parse_args():
+    """ Parses command-line arguments for the inference benchmark."""
+    argparser = argparse.ArgumentParser('Benchmark inference stages.')
+
+    argparser.add_argument(
+        'model_name', help='Model module, e.g. prod.fishing_detection.')
+
+    argparser.add_argument(
+        '--feature_dimensions',
+        required=True,
+        type=int,
+        help='The number of dimensions of a classification feature.')
+
+    argparser.add_argument(
+        '--num_vessels',
+        default=50,
+        type=int,
+        help='Number of synthetic vessels.')
+
+    argparser.add_argument(
+        '--mean_points',
+        default=5000,
+        type=int,
+        help='Median number of points per synthetic vessel.')
+
+    argparser.add_argument(
+        '--seed', default=0, type=int, help='Random seed for the features.')
+
+    argparser.add_argument(
+        '--deserializer',
+        default=NUMPY_DESERIALIZER,
+        choices=[NUMPY_DESERIALIZER, TF_DESERIALIZER],
+        help='Deserialize with numpy, as Inferer does, or with Tensorflow.')
+
+    argparser.add_argument(
+        '--batch_size',
+        type=int,
+        help='Windows per sess.run (default: the Inferer default).')
+
+    argparser.add_argument(
+        '--stitch_width',
+        type=int,
+        help='Run fishing models over inputs this wide.')
+
+    argparser.add_argument(
+        '--interval_months',
+        default=6,
+        type=int,
+        help='Interval between successive classifications')
+
+    argparser.add_argument(
+        '--start_date',
+        type=dateutil.parser.parse,
+        help='Start date for fixed window models.')
+
+    argparser.add_argument(
+        '--end_date',
+        type=dateutil.parser.parse,
+        help='End date for fixed window models.')
+
+    argparser.add_argument(
+        '--output_path', help='Where to write the JSON report (default: stdout).')
+
+    return argparser.parse_args()
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    main(args)
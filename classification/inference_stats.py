@@ -0,0 +1,148 @@
+# Copyright 2017 Google Inc. and Skytruth Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+""" Timing and size statistics for inference runs."""
+from __future__ import absolute_import, division
+from collections import defaultdict
+import contextlib
+import json
+import logging
+import time
+
+# Stages of inference, in order.
+READ = 'read'
+DECODE = 'decode'
+WINDOW = 'window'
+MODEL = 'model'
+FORMAT = 'format'
+STAGES = [READ, DECODE, WINDOW, MODEL, FORMAT]
+
+
+def new_file_stats():
+    """ Statistics for reading one feature file, as returned by the readers.
+
+    Plain dicts, so they can be returned from prefetch worker processes.
+    """
+    return {
+        'times': defaultdict(float),
+        'points_per_vessel': [],
+        'windows_per_vessel': [],
+    }
+
+
+class Histogram(object):
+    """ Count, mean and extremes of a value, with power of two buckets."""
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0
+        self.min = None
+        self.max = None
+        self.buckets = defaultdict(int)
+
+    def add(self, value):
+        self.count += 1
+        self.total += value
+        self.min = value if self.min is None else min(self.min, value)
+        self.max = value if self.max is None else max(self.max, value)
+        bound = 1
+        while bound < value:
+            bound *= 2
+        self.buckets[bound] += 1
+
+    def summary(self):
+        return {
+            'count': self.count,
+            'mean': (self.total / self.count) if self.count else None,
+            'min': self.min,
+            'max': self.max,
+            'buckets': {'<=%d' % k: v
+                        for (k, v) in sorted(self.buckets.items())},
+        }
+
+
+class InferenceStats(object):
+    """ Accumulates per-stage times and vessel sizes during inference.
+
+    Args:
+        report_interval: seconds between summaries logged by `maybe_report`.
+        export_path: if not None, each summary is also written here as JSON,
+            replacing the previous one.
+    """
+
+    def __init__(self, report_interval=60, export_path=None):
+        self.report_interval = report_interval
+        self.export_path = export_path
+        self.times = defaultdict(float)
+        self.points_per_vessel = Histogram()
+        self.windows_per_vessel = Histogram()
+        self.files = 0
+        self.batches = 0
+        self.windows = 0
+        self.start_time = time.time()
+        self.last_report = self.start_time
+
+    @contextlib.contextmanager
+    def timed(self, stage):
+        t0 = time.time()
+        try:
+            yield
+        finally:
+            self.times[stage] += time.time() - t0
+
+    def add_file(self, file_stats):
+        self.files += 1
+        for stage, seconds in file_stats['times'].items():
+            self.times[stage] += seconds
+        for x in file_stats['points_per_vessel']:
+            self.points_per_vessel.add(x)
+        for x in file_stats['windows_per_vessel']:
+            self.windows_per_vessel.add(x)
+
+    def add_batch(self, num_windows):
+        self.batches += 1
+        self.windows += num_windows
+
+    def summary(self):
+        elapsed = time.time() - self.start_time
+        return {
+            'elapsed_seconds': elapsed,
+            'stage_seconds': {k: self.times[k] for k in STAGES},
+            'files': self.files,
+            'vessels': self.points_per_vessel.count,
+            'batches': self.batches,
+            'windows': self.windows,
+            'windows_per_sec': (self.windows / elapsed) if elapsed else None,
+            'vessels_per_sec': ((self.points_per_vessel.count / elapsed)
+                                if elapsed else None),
+            'points_per_vessel': self.points_per_vessel.summary(),
+            'windows_per_vessel': self.windows_per_vessel.summary(),
+        }
+
+    def report(self):
+        """ Log a summary and, if there is an export path, write it."""
+        summary = self.summary()
+        self.last_report = time.time()
+        logging.info(
+            'Inference: %d vessels, %d windows in %.1fs (%.1f windows/s); '
+            'seconds in %s', summary['vessels'], summary['windows'],
+            summary['elapsed_seconds'], summary['windows_per_sec'] or 0,
+            ', '.join('%s %.1f' % (k, self.times[k]) for k in STAGES))
+        if self.export_path is not None:
+            with open(self.export_path, 'w') as f:
+                json.dump(summary, f, indent=2, sort_keys=True)
+        return summary
+
+    def maybe_report(self):
+        if time.time() - self.last_report >= self.report_interval:
+            self.report()
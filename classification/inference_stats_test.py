@@ -0,0 +1,78 @@
+# Copyright 2017 Google Inc. and Skytruth Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import json
+import os
+import numpy as np
+import tensorflow as tf
+from classification import feature_decoder
+from classification import file_iterator
+from classification import inference_stats
+from classification.feature_decoder_test import _serialize
+
+
+class InferenceStatsTest(tf.test.TestCase):
+    def test_histogram(self):
+        histogram = inference_stats.Histogram()
+        for x in [1, 3, 4, 5, 100]:
+            histogram.add(x)
+        summary = histogram.summary()
+        self.assertEqual(5, summary['count'])
+        self.assertAlmostEqual(22.6, summary['mean'])
+        self.assertEqual(1, summary['min'])
+        self.assertEqual(100, summary['max'])
+        self.assertEqual({'<=1': 1, '<=4': 2, '<=8': 1, '<=128': 1},
+                         summary['buckets'])
+
+    def test_file_iterator_stats(self):
+        num_features = 3
+        paths = []
+        for mmsi, count in [(1, 10), (2, 25)]:
+            features = np.zeros([count, num_features], dtype=np.float32)
+            features[:, 0] = np.arange(count)
+            path = os.path.join(self.get_temp_dir(), '%d.tfrecord' % mmsi)
+            with tf.python_io.TFRecordWriter(path) as writer:
+                writer.write(_serialize(mmsi, features))
+            paths.append(path)
+        export_path = os.path.join(self.get_temp_dir(), 'stats.json')
+        stats = inference_stats.InferenceStats(export_path=export_path)
+
+        windows = list(
+            file_iterator.all_fixed_window_feature_file_iterator(
+                paths,
+                feature_decoder.NumpyDeserializer(num_features),
+                window_size=8,
+                shift=4,
+                start_date=None,
+                end_date=None,
+                win_start=2,
+                win_end=6,
+                stats=stats))
+        stats.add_batch(len(windows))
+        summary = stats.report()
+
+        self.assertEqual(2, summary['files'])
+        self.assertEqual(2, summary['vessels'])
+        self.assertEqual(len(windows), summary['windows'])
+        self.assertEqual(35, summary['points_per_vessel']['count'] *
+                         summary['points_per_vessel']['mean'])
+        self.assertEqual(len(windows),
+                         summary['windows_per_vessel']['count'] *
+                         summary['windows_per_vessel']['mean'])
+        self.assertGreater(summary['stage_seconds'][inference_stats.READ], 0)
+        with open(export_path) as f:
+            self.assertEqual(summary['windows'], json.load(f)['windows'])
+
+
+if __name__ == '__main__':
+    tf.test.main()
@@ -0,0 +1,250 @@
+# Copyright 2017 Google Inc. and Skytruth Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+""" Benchmark the training input pipeline independently of the model.
+
+Writes synthetic feature files, builds `Trainer._feature_data_reader` for a
+model and times how fast it produces batches, sweeping the reader settings.
+For example:
+
+    python -m classification.input_benchmark prod.fishing_detection \\
+        --feature_dimensions 14 \\
+        --num_vessels 200 \\
+        --parallel_readers 8,32 \\
+        --queue_capacities 1000,4000 \\
+        --slices_per_mmsi 4,8 \\
+        --output_path input_benchmark.json
+"""
+from __future__ import absolute_import, division
+import argparse
+import itertools
+import json
+import logging
+import os
+import shutil
+import sys
+import tempfile
+import time
+import numpy as np
+import tensorflow as tf
+
+from . import synthetic_features
+from . import utility
+from .sharded_inference import load_model
+from .trainer import Trainer, QUEUE_PIPELINE, DATASET_PIPELINE
+
+
+def benchmark_reader(trainer, num_batches, warmup_batches):
+    """ Time `num_batches` training batches from `trainer`.
+
+    Returns:
+        A dict of examples/sec, batch latency percentiles (in milliseconds)
+        and CPU utilization (in cores) over the timed batches.
+    """
+    with tf.Graph().as_default():
+        features, timestamps, time_bounds, mmsis, _ = (
+            trainer._feature_data_reader(utility.TRAINING_SPLIT, True))
+        batch = [features, timestamps, time_bounds, mmsis]
+        with tf.Session() as sess:
+            coord = tf.train.Coordinator()
+            threads = tf.train.start_queue_runners(sess=sess, coord=coord)
+            try:
+                for _ in range(warmup_batches):
+                    sess.run(batch)
+                latencies = []
+                cpu_start = os.times()
+                wall_start = time.time()
+                for _ in range(num_batches):
+                    t0 = time.time()
+                    sess.run(batch)
+                    latencies.append(time.time() - t0)
+                wall = time.time() - wall_start
+                cpu_end = os.times()
+            finally:
+                coord.request_stop()
+                coord.join(threads)
+
+    cpu = sum(cpu_end[:2]) - sum(cpu_start[:2])
+    latencies = np.array(latencies) * 1000.0
+    return {
+        'examples_per_sec': num_batches * trainer.model.batch_size / wall,
+        'latency_ms': {
+            'mean': float(latencies.mean()),
+            'p50': float(np.percentile(latencies, 50)),
+            'p90': float(np.percentile(latencies, 90)),
+            'p99': float(np.percentile(latencies, 99)),
+        },
+        'cpu_utilization': cpu / wall,
+    }
+
+
+def run_sweep(args, feature_path, vessel_metadata):
+    model = load_model(args.model_name, args.feature_dimensions,
+                       vessel_metadata=vessel_metadata)
+    results = []
+    for (readers, capacity, slices) in itertools.product(
+            args.parallel_readers, args.queue_capacities,
+            args.slices_per_mmsi):
+        if capacity <= model.batch_size * 4:
+            logging.warning('Skipping queue capacity %d: must be more than '
+                            '4 batches (%d)', capacity, model.batch_size * 4)
+            continue
+        trainer = Trainer(
+            model,
+            feature_path,
+            tempfile.gettempdir(),
+            input_pipeline=args.input_pipeline)
+        trainer.num_parallel_readers = readers
+        trainer.queue_capacity = capacity
+        trainer.num_slices_per_mmsi = slices
+        result = {
+            'parallel_readers': readers,
+            'slices_per_mmsi': slices,
+        }
+        if args.input_pipeline == DATASET_PIPELINE:
+            # The dataset pipeline has no queue; the capacity only sets its
+            # shuffle buffer, which is what's reported.
+            result['shuffle_buffer_size'] = capacity - model.batch_size * 4
+        else:
+            result['queue_capacity'] = capacity
+        result.update(
+            benchmark_reader(trainer, args.num_batches, args.warmup_batches))
+        logging.info('%s', json.dumps(result, sort_keys=True))
+        results.append(result)
+    return results
+
+
+def main(args):
+    logging.getLogger().setLevel(logging.INFO)
+    tf.logging.set_verbosity(tf.logging.WARN)
+
+    temp_dir = None
+    feature_path = args.feature_path
+    if feature_path is None:
+        temp_dir = tempfile.mkdtemp()
+        feature_path = os.path.join(temp_dir, 'features')
+    try:
+        logging.info('Writing %d synthetic vessels to %s', args.num_vessels,
+                     feature_path)
+        vessels = synthetic_features.write_synthetic_features(
+            feature_path,
+            args.num_vessels,
+            args.feature_dimensions + 1,
+            mean_points=args.mean_points,
+            seed=args.seed)
+        vessel_metadata = synthetic_features.synthetic_vessel_metadata(
+            vessels, seed=args.seed)
+        report = {
+            'model_name': args.model_name,
+            'input_pipeline': args.input_pipeline,
+            'num_vessels': args.num_vessels,
+            'mean_points': args.mean_points,
+            'num_batches': args.num_batches,
+            'results': run_sweep(args, feature_path, vessel_metadata),
+        }
+    finally:
+        if temp_dir is not None:
+            shutil.rmtree(temp_dir)
+
+    if args.output_path is None:
+        json.dump(report, sys.stdout, indent=2, sort_keys=True)
+    else:
+        with open(args.output_path, 'w') as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+
+
+def _int_list(text):
+    return [int(x) for x in text.split(',')]
+
+
+def parse_args():
+    """ Parses command-line arguments for the input benchmark."""
+    argparser = argparse.ArgumentParser(
+        'Benchmark the training input pipeline.')
+
+    argparser.add_argument(
+        'model_name', help='Model module, e.g. prod.fishing_detection.')
+
+    argparser.add_argument(
+        '--feature_dimensions',
+        required=True,
+        type=int,
+        help='The number of dimensions of a classification feature.')
+
+    argparser.add_argument(
+        '--feature_path',
+        help='Directory to write the synthetic features to (default: a '
+        'temporary directory, removed afterwards).')
+
+    argparser.add_argument(
+        '--num_vessels',
+        default=200,
+        type=int,
+        help='Number of synthetic vessels.')
+
+    argparser.add_argument(
+        '--mean_points',
+        default=5000,
+        type=int,
+        help='Median number of points per synthetic vessel.')
+
+    argparser.add_argument(
+        '--seed', default=0, type=int, help='Random seed for the features.')
+
+    argparser.add_argument(
+        '--input_pipeline',
+        default=QUEUE_PIPELINE,
+        choices=[QUEUE_PIPELINE, DATASET_PIPELINE],
+        help='Training input pipeline to benchmark.')
+
+    argparser.add_argument(
+        '--parallel_readers',
+        default=[Trainer.num_parallel_readers],
+        type=_int_list,
+        help='Comma separated numbers of parallel readers to try.')
+
+    argparser.add_argument(
+        '--queue_capacities',
+        default=[Trainer.queue_capacity],
+        type=_int_list,
+        help='Comma separated shuffle queue capacities to try. With the '
+        'dataset pipeline these only set the shuffle buffer, to the capacity '
+        'less four batches.')
+
+    argparser.add_argument(
+        '--slices_per_mmsi',
+        default=[Trainer.num_slices_per_mmsi],
+        type=_int_list,
+        help='Comma separated numbers of windows per vessel read to try.')
+
+    argparser.add_argument(
+        '--num_batches',
+        default=100,
+        type=int,
+        help='Number of batches to time for each setting.')
+
+    argparser.add_argument(
+        '--warmup_batches',
+        default=10,
+        type=int,
+        help='Number of batches to read before timing each setting.')
+
+    argparser.add_argument(
+        '--output_path', help='Where to write the JSON report (default: stdout).')
+
+    return argparser.parse_args()
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    main(args)
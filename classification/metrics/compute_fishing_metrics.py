@@ -252,6 +252,19 @@ def datetime_to_minute(dt):
     return int(timestamp // 60)
 
 
+def fill_minutes(minutes, ranges, start_min):
+    """Set `minutes[m]` to `value` for each `(value, start, end)` range.
+
+    `m` is minutes since `start_min`. Ranges are inclusive of both ends,
+    clipped to `minutes`, and later ranges overwrite earlier ones.
+    """
+    for (value, s, e) in ranges:
+        lo = max(datetime_to_minute(s) - start_min, 0)
+        hi = datetime_to_minute(e) - start_min + 1
+        if lo < hi:
+            minutes[lo:hi] = value
+
+
 def compare_fishing_localisation(inferred_ranges, fishing_range_path,
                                  label_map, split_map):
 
@@ -284,20 +297,11 @@ def compare_fishing_localisation(inferred_ranges, fishing_range_path,
 
         # Fill in minutes[:, 0] with known true / false values
         logging.debug('filling 0s')
-        for (is_fishing, s, e) in true_ranges:
-            s_min = datetime_to_minute(s)
-            e_min = datetime_to_minute(e)
-            for m in range(s_min - start_min, e_min - start_min + 1):
-                minutes[m, 0] = is_fishing
+        fill_minutes(minutes[:, 0], true_ranges, start_min)
 
         # fill in minutes[:, 1] with inferred true / false values
         logging.debug('filling 1s')
-        for (is_fishing, s, e) in inferred_ranges[str(mmsi)]:
-            s_min = datetime_to_minute(s)
-            e_min = datetime_to_minute(e)
-            for m in range(s_min - start_min, e_min - start_min + 1):
-                if 0 <= m < len(minutes):
-                    minutes[m, 1] = is_fishing
+        fill_minutes(minutes[:, 1], inferred_ranges[str(mmsi)], start_min)
 
         mask = ((minutes[:, 0] != -1) & (minutes[:, 1] != -1))
 
@@ -70,17 +70,19 @@ class ModelBase(object):
             self.fishing_ranges_map = None
         self.training_objectives = None
 
-    def build_training_file_list(self, base_feature_path, split):
+    def build_training_mmsi_list(self, split):
         boundary = 1 if (split == utility.TRAINING_SPLIT) else self.batch_size
         random_state = np.random.RandomState()
-        training_mmsis = self.vessel_metadata.weighted_training_list(
+        return self.vessel_metadata.weighted_training_list(
             random_state,
             split,
             self.max_replication_factor,
             boundary=boundary)
+
+    def build_training_file_list(self, base_feature_path, split):
         return [
             '%s/%s.tfrecord' % (base_feature_path, mmsi)
-            for mmsi in training_mmsis
+            for mmsi in self.build_training_mmsi_list(split)
         ]
 
     @staticmethod
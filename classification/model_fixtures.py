@@ -0,0 +1,37 @@
+# Copyright 2017 Google Inc. and Skytruth Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+""" Untrained models and checkpoints for tests and benchmarks."""
+from __future__ import absolute_import
+import tensorflow as tf
+
+from .sharded_inference import load_model
+
+
+def write_initial_checkpoint(model_name, num_feature_dimensions, path,
+                             seed=None):
+    """ Save the freshly initialized variables of a model's inference net."""
+    with tf.Graph().as_default():
+        if seed is not None:
+            tf.set_random_seed(seed)
+        model = load_model(model_name, num_feature_dimensions)
+        features = tf.placeholder(
+            tf.float32,
+            shape=[None, 1, model.window_max_points, num_feature_dimensions])
+        timestamps = tf.placeholder(
+            tf.int32, shape=[None, model.window_max_points])
+        time_ranges = tf.placeholder(tf.int32, shape=[None, 2])
+        model.build_inference_net(features, timestamps, time_ranges)
+        with tf.Session() as sess:
+            sess.run(tf.global_variables_initializer())
+            return tf.train.Saver().save(sess, path)
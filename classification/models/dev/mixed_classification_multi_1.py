@@ -68,7 +68,8 @@ class Model(ModelBase):
             'Vessel-length',
             length_or_none,
             loss_weight=0.1,
-            metrics=metrics)
+            metrics=metrics,
+            vessel_metadata=vessel_metadata)
 
         self.fishing_localisation_objective = FishingLocalizationObjectiveCrossEntropy(
             'fishing_localisation',
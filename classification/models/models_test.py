@@ -12,10 +12,14 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import os
 import numpy as np
 import tensorflow as tf
 
+from classification import synthetic_features
 from classification import utility
+from classification.model_fixtures import load_model, write_initial_checkpoint
+from classification.run_inference import Inferer, batch_windows
 from prod import vessel_characterization, fishing_detection as fishing_detection
 
 # TODO(alexwilson): Feed some data in. Also check evaluation.build_json_results
@@ -68,6 +72,122 @@ class ModelsTest(tf.test.TestCase):
                     for e in evaluations:
                         e.build_test_metrics()
 
+    def test_stitched_fishing_inference_net(self):
+        vmd = utility.VesselMetadata({}, {})
+        model = fishing_detection.Model(
+            self.num_feature_dimensions, vmd, metrics='all')
+        width = 4 * model.window_max_points
+        b, e = model.window
+        self.assertEqual(model.window,
+                         model.stitched_window(model.window_max_points))
+        self.assertEqual((b, width - (model.window_max_points - e)),
+                         model.stitched_window(width))
+        with self.test_session() as sess:
+            features = tf.zeros(
+                [2, 1, width, model.num_feature_dimensions], tf.float32)
+            timestamps = tf.zeros([2, width], tf.int32)
+            mmsis = tf.zeros([2], tf.int32)
+            evaluations = model.build_inference_net(features, timestamps,
+                                                    mmsis)
+            sess.run(tf.global_variables_initializer())
+            prediction = sess.run(evaluations[0].prediction)
+            self.assertEqual((2, width), prediction.shape)
+            timestamps_array = np.arange(width, dtype=np.int32)
+            ranges = evaluations[0].build_json_results(prediction[0],
+                                                       timestamps_array)
+            # Constant input gives constant predictions, so one range
+            # covering the stitched window.
+            self.assertEqual(1, len(ranges))
+            self.assertEqual('1970-01-01T00:04:16Z', ranges[0]['start_time'])
+            self.assertEqual('1970-01-01T01:08:15Z', ranges[0]['end_time'])
+
+
+class StitchedInferenceTest(tf.test.TestCase):
+    model_name = 'prod.fishing_detection'
+    num_feature_dimensions = 11
+    stitch_width = 4096
+
+    def setUp(self):
+        temp_dir = self.get_temp_dir()
+        self.checkpoint_path = write_initial_checkpoint(
+            self.model_name, self.num_feature_dimensions,
+            os.path.join(temp_dir, 'stitched.ckpt'), seed=0)
+        self.feature_path = os.path.join(temp_dir, 'stitched_features')
+        if not os.path.exists(self.feature_path):
+            os.makedirs(self.feature_path)
+        self.random_state = np.random.RandomState(0)
+
+    def _write_track(self, mmsi, num_points):
+        features = synthetic_features.synthetic_vessel_features(
+            self.random_state, num_points, self.num_feature_dimensions + 1)
+        # Float32 timestamps round to 128s, so space points further apart
+        # to keep them distinct.
+        features[:, 0] = (synthetic_features.START_TIME +
+                          synthetic_features.MEAN_POINT_INTERVAL *
+                          np.arange(num_points))
+        path = os.path.join(self.feature_path, '%d.tfrecord' % mmsi)
+        with tf.python_io.TFRecordWriter(path) as writer:
+            writer.write(synthetic_features.serialize_vessel(mmsi, features))
+
+    def _inferer(self, stitch_width):
+        model = load_model(self.model_name, self.num_feature_dimensions)
+        return Inferer(model, self.checkpoint_path, self.feature_path,
+                       prefetch_workers=0, stitch_width=stitch_width)
+
+    def _logits(self, mmsi, stitch_width, context):
+        """ Fishing logits by timestamp, for the kept points of each window
+        that have at least `context` points after them in the window."""
+        with tf.Graph().as_default():
+            inferer = self._inferer(stitch_width)
+            try:
+                _, b, e = inferer._fixed_window()
+                logits = {}
+                for batch in batch_windows(
+                        inferer._window_iter([mmsi], 6, None, None),
+                        inferer.batch_size):
+                    result = inferer._run_batch(batch)
+                    for timestamps, prediction in zip(result[2], result[3]):
+                        end = min(e, len(timestamps) - context)
+                        p = np.clip(prediction[b:end].astype(np.float64),
+                                    1e-30, 1 - 1e-7)
+                        logits.update(zip(timestamps[b:end],
+                                          np.log(p) - np.log1p(-p)))
+            finally:
+                inferer.close()
+        return logits
+
+    def _results(self, mmsi, stitch_width):
+        with tf.Graph().as_default():
+            inferer = self._inferer(stitch_width)
+            try:
+                return list(inferer.run_inference([mmsi], 6, None, None))
+            finally:
+                inferer.close()
+
+    def test_stitched_matches_windowed(self):
+        mmsi = synthetic_features.FIRST_MMSI
+        self._write_track(mmsi, 3 * self.stitch_width)
+        # The deepest layers see about half a training window either side,
+        # so windowed scores near a window's end lack context stitched
+        # inputs have; compare the points that don't.
+        context = load_model(self.model_name,
+                             self.num_feature_dimensions).window_max_points // 2
+        windowed = self._logits(mmsi, None, context)
+        stitched = self._logits(mmsi, self.stitch_width, 0)
+        common = sorted(set(windowed) & set(stitched))
+        self.assertGreater(len(common), self.stitch_width // 2)
+        expected = np.array([windowed[t] for t in common])
+        actual = np.array([stitched[t] for t in common])
+        self.assertAllClose(expected, actual, atol=0.5)
+        self.assertGreater(np.corrcoef(expected, actual)[0, 1], 0.95)
+
+    def test_short_track_uses_training_window(self):
+        mmsi = synthetic_features.FIRST_MMSI + 1
+        self._write_track(mmsi, self.stitch_width // 2)
+        self.assertEqual(
+            self._results(mmsi, None),
+            self._results(mmsi, self.stitch_width))
+
 
 if __name__ == '__main__':
     tf.test.main()
@@ -43,6 +43,16 @@ class MisconceptionWithFishingRangesModel(MisconceptionModel):
         super(MisconceptionWithFishingRangesModel, self).__init__(
             num_feature_dimensions, vessel_metadata)
 
+    def stitched_window(self, width):
+        """ The window of points to keep from a `width` point input.
+
+        Inputs wider than `window_max_points` keep the same amount of context
+        either side as the training window, so stitching wide inputs
+        recomputes far fewer overlapping points than the training windows.
+        """
+        b, e = self.window
+        return (b, width - (self.window_max_points - e))
+
     def misconception_with_fishing_ranges(self, input, mmsis, is_training):
         """ A misconception tower with additional fishing range classification.
 
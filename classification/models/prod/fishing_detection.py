@@ -89,14 +89,10 @@ class Model(abstract_models.MisconceptionWithFishingRangesModel):
         self.classification_training_objectives = []
         self.training_objectives = [self.fishing_localisation_objective]
 
-    def build_training_file_list(self, base_feature_path, split):
+    def build_training_mmsi_list(self, split):
         random_state = np.random.RandomState()
-        training_mmsis = self.vessel_metadata.fishing_range_only_list(
+        return self.vessel_metadata.fishing_range_only_list(
             random_state, split, self.max_replication_factor)
-        return [
-            '%s/%s.tfrecord' % (base_feature_path, mmsi)
-            for mmsi in training_mmsis
-        ]
 
     def _build_net(self, features, timestamps, mmsis, is_training):
         layers.misconception_fishing(
@@ -129,9 +125,12 @@ class Model(abstract_models.MisconceptionWithFishingRangesModel):
     def build_inference_net(self, features, timestamps, mmsis):
         self._build_net(features, timestamps, mmsis, False)
 
+        # The net is fully convolutional, so it can be run on inputs wider
+        # than window_max_points and stitched together.
+        width = int(features.get_shape()[2])
         evaluations = [
-            self.fishing_localisation_objective.build_evaluation(timestamps,
-                                                                 mmsis)
+            self.fishing_localisation_objective.build_evaluation(
+                timestamps, mmsis, window=self.stitched_window(width))
         ]
 
         return evaluations
@@ -82,19 +82,22 @@ class Model(abstract_models.MisconceptionModel):
                 'Vessel-length',
                 XOrNone('length'),
                 metrics=metrics,
-                loss_weight=0.1),
+                loss_weight=0.1,
+                vessel_metadata=vessel_metadata),
             LogRegressionObjectiveMAE(
                 'tonnage',
                 'Vessel-tonnage',
                 XOrNone('tonnage'),
                 metrics=metrics,
-                loss_weight=0.1),
+                loss_weight=0.1,
+                vessel_metadata=vessel_metadata),
             LogRegressionObjectiveMAE(
                 'engine_power',
                 'Vessel-engine-Power',
                 XOrNone('engine_power'),
                 metrics=metrics,
-                loss_weight=0.1),
+                loss_weight=0.1,
+                vessel_metadata=vessel_metadata),
             # LogRegressionObjectiveMAE(
             #     'crew_size',
             #     'Vessel-Crew-Size',
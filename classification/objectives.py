@@ -13,7 +13,6 @@
 # limitations under the License.
 
 import abc
-import calendar
 from collections import namedtuple, OrderedDict
 import datetime
 import logging
@@ -149,16 +148,64 @@ class SummaryObjective(ObjectiveBase):
                           self.metrics)
 
 
+def _expected_and_mask_py_func(value_from_mmsi, mmsis):
+    def impl(mmsis_array):
+        expected = []
+        mask = []
+        for mmsi in mmsis_array:
+            e = value_from_mmsi(mmsi)
+            if e != None:
+                expected.append(e)
+                mask.append(1.0)
+            else:
+                expected.append(0.0)
+                mask.append(0.0)
+        return (np.array(
+            expected, dtype=np.float32), np.array(
+                mask, dtype=np.float32))
+
+    expected, mask = tf.py_func(impl, [mmsis], [tf.float32, tf.float32])
+
+    return expected, mask
+
+
+def _regression_targets(value_from_mmsi, vessel_metadata):
+    """ Evaluate `value_from_mmsi` once for every vessel in `vessel_metadata`.
+
+    Returns:
+        float32 (expected, mask) arrays indexed by `vessel_metadata.mmsi_rows`;
+        row 0, for unknown vessels, is masked out.
+    """
+    expected = np.zeros([len(vessel_metadata.mmsi_rows) + 1], dtype=np.float32)
+    mask = np.zeros_like(expected)
+    for mmsi, row in vessel_metadata.mmsi_rows.items():
+        e = value_from_mmsi(mmsi)
+        if e is not None:
+            expected[row] = e
+            mask[row] = 1.0
+    return expected, mask
+
+
+def _gather_targets(targets, vessel_metadata, mmsis):
+    expected, mask = targets
+    rows = vessel_metadata.mmsi_row_lookup(mmsis)
+    return tf.gather(tf.constant(expected), rows), tf.gather(
+        tf.constant(mask), rows)
+
+
 class RegressionObjective(ObjectiveBase):
     def __init__(self,
                  metadata_label,
                  name,
                  value_from_mmsi,
                  loss_weight=1.0,
-                 metrics='all'):
+                 metrics='all',
+                 vessel_metadata=None):
         super(RegressionObjective, self).__init__(metadata_label, name,
                                                   loss_weight, metrics)
         self.value_from_mmsi = value_from_mmsi
+        self.vessel_metadata = vessel_metadata
+        self._targets = None
 
     def build(self, net):
         self.prediction = tf.squeeze(
@@ -166,24 +213,12 @@ class RegressionObjective(ObjectiveBase):
                 net, 1, activation_fn=None))
 
     def _expected_and_mask(self, mmsis):
-        def impl(mmsis_array):
-            expected = []
-            mask = []
-            for mmsi in mmsis_array:
-                e = self.value_from_mmsi(mmsi)
-                if e != None:
-                    expected.append(e)
-                    mask.append(1.0)
-                else:
-                    expected.append(0.0)
-                    mask.append(0.0)
-            return (np.array(
-                expected, dtype=np.float32), np.array(
-                    mask, dtype=np.float32))
-
-        expected, mask = tf.py_func(impl, [mmsis], [tf.float32, tf.float32])
-
-        return expected, mask
+        if self.vessel_metadata is None:
+            return _expected_and_mask_py_func(self.value_from_mmsi, mmsis)
+        if self._targets is None:
+            self._targets = _regression_targets(self.value_from_mmsi,
+                                                self.vessel_metadata)
+        return _gather_targets(self._targets, self.vessel_metadata, mmsis)
 
     def _masked_mean_error(self, predictions, mmsis):
         expected, mask = self._expected_and_mask(mmsis)
@@ -238,10 +273,13 @@ class LogRegressionObjective(ObjectiveBase):
                  name,
                  value_from_mmsi,
                  loss_weight=1.0,
-                 metrics='all'):
+                 metrics='all',
+                 vessel_metadata=None):
         super(LogRegressionObjective, self).__init__(metadata_label, name,
                                                      loss_weight, metrics)
         self.value_from_mmsi = value_from_mmsi
+        self.vessel_metadata = vessel_metadata
+        self._targets = None
 
     def build(self, net):
         self.prediction = tf.squeeze(
@@ -249,24 +287,12 @@ class LogRegressionObjective(ObjectiveBase):
                 net, 1, activation_fn=None))
 
     def _expected_and_mask(self, mmsis):
-        def impl(mmsis_array):
-            expected = []
-            mask = []
-            for mmsi in mmsis_array:
-                e = self.value_from_mmsi(mmsi)
-                if e != None:
-                    expected.append(e)
-                    mask.append(1.0)
-                else:
-                    expected.append(0.0)
-                    mask.append(0.0)
-            return (np.array(
-                expected, dtype=np.float32), np.array(
-                    mask, dtype=np.float32))
-
-        expected, mask = tf.py_func(impl, [mmsis], [tf.float32, tf.float32])
-
-        return expected, mask
+        if self.vessel_metadata is None:
+            return _expected_and_mask_py_func(self.value_from_mmsi, mmsis)
+        if self._targets is None:
+            self._targets = _regression_targets(self.value_from_mmsi,
+                                                self.vessel_metadata)
+        return _gather_targets(self._targets, self.vessel_metadata, mmsis)
 
     def _masked_mean_loss(self, predictions, mmsis):
         expected, mask = self._expected_and_mask(mmsis)
@@ -370,29 +396,10 @@ class MultiClassificationObjective(ObjectiveBase):
         return self.vessel_metadata.vessel_label(label, mmsi) or -1
 
     def multihot_labels(self, mmsis):
-
-        class_count = len(utility.VESSEL_CLASS_DETAILED_NAMES)
-
-        def labels_from_mmsis(seq, class_indices):
-            encoded = np.zeros([len(seq), class_count], dtype=np.int32)
-            for i, m in enumerate(seq):
-                lbl_str = self.vessel_metadata.vessel_label('label', m).strip()
-                if lbl_str:
-                    for lbl in lbl_str.split('|'):
-                        j = class_indices[lbl]
-                        # Use '|' rather than '+' since classes might not be disjoint
-                        encoded[i] |= utility.multihot_lookup_table[j]
-            return encoded
-
-        indices = {k[0]: i for (i, k) in enumerate(utility.VESSEL_CATEGORIES)}
-
-        labels = tf.py_func(lambda x: labels_from_mmsis(x, indices), [mmsis],
-                            [tf.int32])
-
-        labels = tf.reshape(
-            labels, shape=tf.concat([tf.shape(mmsis), [class_count]], 0))
-
-        return labels
+        # Labels are encoded once by vessel_metadata, so this is a lookup.
+        rows = self.vessel_metadata.mmsi_row_lookup(mmsis)
+        return tf.gather(
+            tf.constant(self.vessel_metadata.multihot_labels), rows)
 
     def build_trainer(self, timestamps, mmsis):
 
@@ -536,6 +543,67 @@ class MultiClassificationObjectiveSmoothed(MultiClassificationObjective):
 
 
 
+SECONDS_PER_DAY = 24 * 60 * 60
+
+
+def _iso_time(timestamp):
+    return datetime.datetime.utcfromtimestamp(int(timestamp)).isoformat() + 'Z'
+
+
+def fishing_ranges_from_predictions(prediction, timestamps, window=None):
+    """ Run-length encode per-point fishing predictions into ranges.
+
+    Consecutive points with the same thresholded prediction are merged into
+    one range, and ranges are split at UTC day boundaries. Points after the
+    first non-increasing timestamp are dropped.
+
+    Args:
+        prediction: per-point fishing scores.
+        timestamps: per-point integer timestamps.
+        window: optional (start, end) slice of the points to encode.
+
+    Returns:
+        A list of {'start_time', 'end_time', 'value'} dicts.
+    """
+    assert (len(prediction) == len(timestamps))
+    is_fishing = np.asarray(prediction) > 0.5
+    timestamps = np.asarray(timestamps).astype(np.int64)
+    if window:
+        b, e = window
+        is_fishing = is_fishing[b:e]
+        timestamps = timestamps[b:e]
+
+    non_increasing = np.flatnonzero(timestamps[1:] <= timestamps[:-1])
+    if len(non_increasing):
+        logging.warning("last.timestamp >= timestamp")
+        count = non_increasing[0] + 1
+        is_fishing = is_fishing[:count]
+        timestamps = timestamps[:count]
+    if not len(timestamps):
+        return []
+
+    days = timestamps // SECONDS_PER_DAY
+    # A range starts wherever the prediction changes, or where it stays the
+    # same but a day boundary is crossed.
+    changes = np.concatenate([[True], is_fishing[1:] != is_fishing[:-1]])
+    day_splits = np.concatenate([[False], days[1:] > days[:-1]]) & ~changes
+    starts = np.flatnonzero(changes | day_splits)
+    ends = np.append(starts[1:], len(timestamps)) - 1
+
+    start_times = np.where(day_splits[starts], days[starts] * SECONDS_PER_DAY,
+                           timestamps[starts])
+    # Ranges followed by a day split end at the end of their last day.
+    split_next = np.append(day_splits[starts[1:]], False)
+    end_times = np.where(split_next,
+                         (days[ends] + 1) * SECONDS_PER_DAY - 1,
+                         timestamps[ends])
+
+    return [{'start_time': _iso_time(s),
+             'end_time': _iso_time(e),
+             'value': float(v)}
+            for (s, e, v) in zip(start_times, end_times, is_fishing[starts])]
+
+
 class AbstractFishingLocalizationObjective(ObjectiveBase):
     def __init__(self,
                  metadata_label,
@@ -550,23 +618,11 @@ class AbstractFishingLocalizationObjective(ObjectiveBase):
         self.window = window
 
     def dense_labels(self, template_shape, timestamps, mmsis):
-        # Convert fishing range labels to per-point labels.
+        # Convert fishing range labels to per-point labels, using ranges
+        # compiled once into `vessel_metadata.fishing_range_index`.
         def dense_fishing_labels(mmsis_array, timestamps_array):
-            dense_labels_list = []
-            for mmsi, timestamps in zip(mmsis_array, timestamps_array):
-                dense_labels = np.zeros_like(timestamps, dtype=np.float32)
-                dense_labels.fill(-1.0)
-                if mmsi in self.vessel_metadata.fishing_ranges_map:
-                    for (start_time, end_time, is_fishing
-                         ) in self.vessel_metadata.fishing_ranges_map[mmsi]:
-                        start_range = calendar.timegm(start_time.utctimetuple(
-                        ))
-                        end_range = calendar.timegm(end_time.utctimetuple())
-                        mask = (timestamps >= start_range) & (
-                            timestamps <= end_range)
-                        dense_labels[mask] = is_fishing
-                dense_labels_list.append(dense_labels)
-            return np.array(dense_labels_list)
+            return self.vessel_metadata.fishing_range_index.dense_labels(
+                mmsis_array, timestamps_array)
 
         return tf.reshape(
             tf.py_func(dense_fishing_labels, [mmsis, timestamps],
@@ -613,10 +669,15 @@ class AbstractFishingLocalizationObjective(ObjectiveBase):
 
         return Trainer(loss, update_ops)
 
-    def build_evaluation(self, timestamps, mmsis):
+    def build_evaluation(self, timestamps, mmsis, window=None):
+        """ Build the evaluation, optionally overriding the kept window.
+
+        A different window is needed when evaluating on inputs wider than
+        the training windows.
+        """
 
         dense_labels_fn = self.dense_labels
-        eval_window = self.window
+        eval_window = self.window if (window is None) else window
         loss_fn = self.loss_function
 
         class Evaluation(EvaluationBase):
@@ -680,46 +741,8 @@ class AbstractFishingLocalizationObjective(ObjectiveBase):
                      for (k, v) in raw_metrics.items()})
 
             def build_json_results(self, prediction, timestamps):
-                InferencePoint = namedtuple('InferencePoint', ['timestamp', 'is_fishing'])
-                InferenceRange = namedtuple('InferenceRange', ['start_time', 'end_time', 'score'])
-
-                assert (len(prediction) == len(timestamps))
-                thresholded_prediction = prediction > 0.5
-                combined = zip(timestamps, thresholded_prediction)
-                if eval_window:
-                    b, e = eval_window
-                    combined = combined[b:e]
-
-                last = None
-                fishing_ranges = []
-                for ts_raw, is_fishing in combined:
-                    ts = datetime.datetime.utcfromtimestamp(int(ts_raw))
-                    if last and last.timestamp >= ts:
-                        logging.warning("last.timestamp >= timestamp")
-                        break
-                    if last and last.is_fishing == is_fishing:
-                        if ts.date() > last.timestamp.date():
-                            # We are crossing a day boundary here, so break into two ranges
-                            end_of_day = datetime.datetime.combine(last.timestamp.date(), 
-                                datetime.time(hour=23, minute=59, second=59))
-                            # TODO: are we skipping a day here if gaps is multi day? Check
-                            start_of_day = datetime.datetime.combine(ts.date(), 
-                                datetime.time(hour=0, minute=0, second=0))
-                            fishing_ranges[-1] = fishing_ranges[-1]._replace(
-                                                    end_time=end_of_day.isoformat())
-                            fishing_ranges.append(
-                                InferenceRange(start_of_day.isoformat(), None, is_fishing))
-                        fishing_ranges[-1] =  fishing_ranges[-1]._replace(end_time=ts.isoformat())
-                    else:
-                        # TODO, append min(half the distance to previous / next point)
-                        # TODO, but maybe we should drop long ranges with no points
-                        fishing_ranges.append(
-                            InferenceRange(ts.isoformat(), ts.isoformat(), is_fishing))
-                    last = InferencePoint(timestamp=ts, is_fishing=is_fishing)
-
-                return [{'start_time': x.start_time + 'Z',
-                         'end_time': x.end_time + 'Z', 'value': float(x.score)}
-                        for x in fishing_ranges]
+                return fishing_ranges_from_predictions(prediction, timestamps,
+                                                       eval_window)
 
         return Evaluation(self.metadata_label, self.name, self.prediction,
                           timestamps, mmsis, self.metrics)
@@ -55,6 +55,33 @@ class RegressionLossTest(tf.test.TestCase):
 
             self.assertAlmostEqual(1.0, loss.eval())
 
+    def test_precomputed_targets(self):
+        with self.test_session() as sess:
+            prediction = np.array([1.0, 4.0, 5.0, 6.0, 3.0])
+            mmsis = tf.constant(['1', '2', '3', '4', '5'])
+
+            vmd = utility.VesselMetadata({
+                'Training': {
+                    '1': ({'length': '2.0'}, 1.0),
+                    '2': ({'length': '2.5'}, 1.0),
+                    '3': ({'length': '4.5'}, 1.0),
+                    '4': ({'length': ''}, 1.0),
+                }
+            }, {})
+
+            def length_or_none(mmsi):
+                length = vmd.vessel_label('length', mmsi)
+                return None if length == '' else np.float32(length)
+
+            objective = objectives.RegressionObjective(
+                'a label', 'A name', length_or_none, vessel_metadata=vmd)
+            objective.prediction = prediction
+
+            loss, _ = objective.build_trainer(None, mmsis)
+            sess.run(tf.tables_initializer())
+
+            self.assertAlmostEqual(1.0, loss.eval())
+
 
 class FishingLocalisationLossTest(tf.test.TestCase):
     def test_simple_loss(self):
@@ -96,6 +123,46 @@ class FishingLocalisationLossTest(tf.test.TestCase):
             self.assertAlmostEqual(0.0, loss.eval())
 
 
+class FishingRangesFromPredictionsTest(tf.test.TestCase):
+    def _ts(self, s):
+        return calendar.timegm(_dt(s).utctimetuple())
+
+    def test_runs_and_day_splits(self):
+        timestamps = [self._ts(x) for x in [
+            '2015-01-01T10:00:00', '2015-01-01T11:00:00',
+            '2015-01-01T12:00:00', '2015-01-02T01:00:00',
+            '2015-01-04T02:00:00', '2015-01-04T03:00:00'
+        ]]
+        prediction = np.array([0.1, 0.2, 0.9, 0.8, 0.7, 0.3])
+
+        ranges = objectives.fishing_ranges_from_predictions(prediction,
+                                                            timestamps)
+
+        self.assertEqual([
+            {'start_time': '2015-01-01T10:00:00Z',
+             'end_time': '2015-01-01T11:00:00Z', 'value': 0.0},
+            {'start_time': '2015-01-01T12:00:00Z',
+             'end_time': '2015-01-01T23:59:59Z', 'value': 1.0},
+            {'start_time': '2015-01-02T00:00:00Z',
+             'end_time': '2015-01-02T23:59:59Z', 'value': 1.0},
+            {'start_time': '2015-01-04T00:00:00Z',
+             'end_time': '2015-01-04T02:00:00Z', 'value': 1.0},
+            {'start_time': '2015-01-04T03:00:00Z',
+             'end_time': '2015-01-04T03:00:00Z', 'value': 0.0},
+        ], ranges)
+
+    def test_window_and_non_increasing_timestamps(self):
+        timestamps = [100, 200, 300, 250, 400]
+        prediction = np.array([0.9, 0.9, 0.9, 0.9, 0.9])
+
+        ranges = objectives.fishing_ranges_from_predictions(
+            prediction, timestamps, window=(1, 5))
+
+        self.assertEqual([{'start_time': '1970-01-01T00:03:20Z',
+                           'end_time': '1970-01-01T00:05:00Z',
+                           'value': 1.0}], ranges)
+
+
 # Check we are actually getting vessels with fishing
 # localisation info (check loading the metadata, and choosing the
 # segments).
@@ -0,0 +1,356 @@
+# Copyright 2017 Google Inc. and Skytruth Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+""" Post-training quantization of frozen inference graphs.
+
+Takes a float32 graph written by `export_graph` and produces a reduced
+precision one that `Inferer` can load in the same way:
+
+    weights: weights are stored as eight bit and expanded to float32 when
+        the graph is loaded. Shrinks the graph; arithmetic is unchanged.
+    eightbit: the convolutions and matrix multiplies run in eight bit. The
+        ranges of their intermediate results are calibrated by running the
+        graph on a sample of feature files.
+
+Float16 is not offered, since Tensorflow's CPU kernels don't support it
+for these layers.
+
+The quantized graph is then checked against the float32 one on a second
+sample of vessels, writing a JSON report of the drift in each objective's
+predictions. Optionally the inference results of both graphs are written,
+so the change in accuracy can be reported by `train/compute_metrics.py`
+with `--baseline-inference-path`. For example:
+
+    python -m classification.quantize_graph prod.fishing_detection \\
+        --feature_dimensions 14 \\
+        --float_graph_path fishing_detection.pb \\
+        --output_path fishing_detection_8bit.pb \\
+        --mode eightbit \\
+        --root_feature_path path/to/features \\
+        --calibration_mmsi_file calibration_mmsis.txt \\
+        --validation_mmsi_file test_mmsis.txt \\
+        --drift_report_path drift.json
+"""
+from __future__ import absolute_import, division
+import argparse
+import json
+import logging
+import os
+import tempfile
+import numpy as np
+import tensorflow as tf
+
+from . import run_inference
+from .run_inference import Inferer, batch_windows
+from .sharded_inference import load_model
+
+try:
+    from tensorflow.tools.graph_transforms import TransformGraph
+except ImportError:
+    TransformGraph = None
+
+WEIGHTS = 'weights'
+EIGHTBIT = 'eightbit'
+
+TRANSFORMS = {
+    WEIGHTS: ['quantize_weights', 'sort_by_execution_order'],
+    EIGHTBIT: [
+        'add_default_attributes',
+        'fold_constants(ignore_errors=true)',
+        'quantize_weights',
+        'quantize_nodes',
+        'sort_by_execution_order',
+    ],
+}
+
+# The format `freeze_requantization_ranges` expects, as written by the
+# `insert_logging` transform.
+_RANGE_LOG_FORMAT = ';%s__print__;__requant_min_max:[%.9g][%.9g]\n'
+
+
+def _inputs_and_outputs(graph_def):
+    names = set(node.name for node in graph_def.node)
+    inputs = [
+        run_inference.FEATURES_NAME, run_inference.TIMESTAMPS_NAME,
+        run_inference.TIME_RANGES_NAME, run_inference.MMSIS_NAME
+    ]
+    outputs = []
+    while run_inference.PREDICTION_NAME % len(outputs) in names:
+        outputs.append(run_inference.PREDICTION_NAME % len(outputs))
+    # Inferer feeds and fetches the inputs, so they must be kept.
+    return inputs, outputs + inputs
+
+
+def quantize_graph_def(graph_def, mode):
+    """ Apply the `mode` quantization transforms to a frozen graph.
+
+    For `EIGHTBIT` the result must still be calibrated.
+    """
+    if TransformGraph is None:
+        raise ImportError('Quantization needs tensorflow.tools.graph_transforms')
+    inputs, outputs = _inputs_and_outputs(graph_def)
+    return TransformGraph(graph_def, inputs, outputs, TRANSFORMS[mode])
+
+
+def calibrate(graph_def, batches):
+    """ Freeze the requantization ranges of an eight bit graph.
+
+    Args:
+        graph_def: a graph from `quantize_graph_def(..., EIGHTBIT)`.
+        batches: iterable of `batch_windows` batches to calibrate on.
+
+    Returns:
+        The calibrated GraphDef.
+    """
+    range_names = [node.name for node in graph_def.node
+                   if node.op == 'RequantizationRange']
+    ranges = {}
+    with tf.Graph().as_default() as graph:
+        tf.import_graph_def(graph_def, name='')
+        fetches = [(graph.get_tensor_by_name(name + ':0'),
+                    graph.get_tensor_by_name(name + ':1'))
+                   for name in range_names]
+        feeds = [graph.get_tensor_by_name(name + ':0')
+                 for name in _inputs_and_outputs(graph_def)[0]]
+        with tf.Session() as sess:
+            for batch in batches:
+                values = sess.run(fetches, feed_dict=dict(zip(feeds, batch)))
+                for name, (lo, hi) in zip(range_names, values):
+                    if name in ranges:
+                        lo = min(lo, ranges[name][0])
+                        hi = max(hi, ranges[name][1])
+                    ranges[name] = (lo, hi)
+    if len(ranges) != len(range_names):
+        raise ValueError('No calibration data')
+
+    fd, log_path = tempfile.mkstemp(suffix='.log')
+    try:
+        with os.fdopen(fd, 'w') as f:
+            for name, (lo, hi) in sorted(ranges.items()):
+                f.write(_RANGE_LOG_FORMAT % (name, lo, hi))
+        inputs, outputs = _inputs_and_outputs(graph_def)
+        return TransformGraph(graph_def, inputs, outputs, [
+            'freeze_requantization_ranges(min_max_log_file="%s")' % log_path,
+            'fold_constants(ignore_errors=true)',
+            'sort_by_execution_order',
+        ])
+    finally:
+        os.unlink(log_path)
+
+
+def prediction_drift(objectives, expected, actual):
+    """ Compare predictions of the float32 and quantized graphs.
+
+    Args:
+        objectives: the `Inferer` objectives.
+        expected, actual: for each objective, a list of batched predictions.
+
+    Returns:
+        A dict, keyed by objective name, of drift statistics. Vessel class
+        objectives include how often the top class agrees, fishing
+        objectives how often the scores agree at a 0.5 threshold, and
+        regression objectives the mean relative difference. Statistics are
+        None if there are no predictions.
+    """
+    report = {}
+    for o, e, a in zip(objectives, expected, actual):
+        if not len(e):
+            report[o.name] = {'count': 0, 'max_abs_diff': None,
+                              'mean_abs_diff': None}
+            continue
+        e = np.concatenate([np.atleast_1d(x) for x in e])
+        a = np.concatenate([np.atleast_1d(x) for x in a])
+        diff = np.abs(e - a)
+        empty = not diff.size
+        drift = {
+            'count': len(e),
+            'max_abs_diff': None if empty else float(diff.max()),
+            'mean_abs_diff': None if empty else float(diff.mean()),
+        }
+        if e.ndim == 1:
+            drift['mean_relative_diff'] = None if empty else float(
+                (diff / np.maximum(np.abs(e), 1e-7)).mean())
+        elif hasattr(o, 'classes'):
+            drift['argmax_agreement'] = None if empty else float(
+                (e.argmax(axis=1) == a.argmax(axis=1)).mean())
+        else:
+            drift['threshold_agreement'] = None if empty else float(
+                ((e > 0.5) == (a > 0.5)).mean())
+        report[o.name] = drift
+    return report
+
+
+def _read_mmsis(path):
+    with tf.gfile.GFile(path) as f:
+        return [x.strip() for x in f if x.strip()]
+
+
+def main(args):
+    logging.getLogger().setLevel(logging.INFO)
+    tf.logging.set_verbosity(tf.logging.INFO)
+
+    def make_inferer(graph_path):
+        with tf.Graph().as_default():
+            model = load_model(args.model_name, args.feature_dimensions)
+            return Inferer(model, graph_path, args.root_feature_path,
+                           prefetch_workers=args.prefetch_workers,
+                           stitch_width=args.stitch_width)
+
+    def batches(inferer, mmsis):
+        return batch_windows(
+            inferer._window_iter(mmsis, args.interval_months,
+                                 args.start_date, args.end_date),
+            inferer.batch_size)
+
+    float_inferer = make_inferer(args.float_graph_path)
+    graph_def = tf.GraphDef()
+    with tf.gfile.GFile(args.float_graph_path, 'rb') as f:
+        graph_def.ParseFromString(f.read())
+
+    graph_def = quantize_graph_def(graph_def, args.mode)
+    if args.mode == EIGHTBIT:
+        mmsis = _read_mmsis(args.calibration_mmsi_file)
+        logging.info('Calibrating on %d vessels', len(mmsis))
+        graph_def = calibrate(graph_def, batches(float_inferer, mmsis))
+    with tf.gfile.GFile(args.output_path, 'wb') as f:
+        f.write(graph_def.SerializeToString())
+    logging.info('Wrote %s graph to %s', args.mode, args.output_path)
+
+    if args.validation_mmsi_file is None:
+        return
+    quantized_inferer = make_inferer(args.output_path)
+    mmsis = _read_mmsis(args.validation_mmsi_file)
+    logging.info('Validating on %d vessels', len(mmsis))
+    expected = [[] for _ in float_inferer.objectives]
+    actual = [[] for _ in float_inferer.objectives]
+    for batch in batches(float_inferer, mmsis):
+        for predictions, inferer in [(expected, float_inferer),
+                                     (actual, quantized_inferer)]:
+            for p, x in zip(predictions, inferer._run_batch(batch)[3:]):
+                p.append(x)
+    report = {
+        'mode': args.mode,
+        'float_graph_path': args.float_graph_path,
+        'quantized_graph_path': args.output_path,
+        'float_graph_bytes': tf.gfile.Stat(args.float_graph_path).length,
+        'quantized_graph_bytes': tf.gfile.Stat(args.output_path).length,
+        'objectives': prediction_drift(float_inferer.objectives, expected,
+                                       actual),
+    }
+    logging.info('Drift: %s', json.dumps(report, sort_keys=True))
+    if args.drift_report_path is not None:
+        with tf.gfile.GFile(args.drift_report_path, 'w') as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+
+    for inferer, path in [(float_inferer, args.float_results_path),
+                          (quantized_inferer, args.quantized_results_path)]:
+        if path is not None:
+            inferer.write_inference(path, mmsis, args.interval_months,
+                                    args.start_date, args.end_date)
+
+
+def parse_args():
+    """ Parses command-line arguments for quantization."""
+    import dateutil.parser
+
+    argparser = argparse.ArgumentParser(
+        'Quantize a frozen inference graph.')
+
+    argparser.add_argument(
+        'model_name', help='Model module, e.g. prod.fishing_detection.')
+
+    argparser.add_argument(
+        '--feature_dimensions',
+        required=True,
+        type=int,
+        help='The number of dimensions of a classification feature.')
+
+    argparser.add_argument(
+        '--float_graph_path',
+        required=True,
+        help='Float32 graph written by export_graph.')
+
+    argparser.add_argument(
+        '--output_path',
+        required=True,
+        help='Path to write the quantized `.pb` graph to.')
+
+    argparser.add_argument(
+        '--mode',
+        default=EIGHTBIT,
+        choices=[WEIGHTS, EIGHTBIT],
+        help='Quantize only the stored weights, or the arithmetic too.')
+
+    argparser.add_argument(
+        '--root_feature_path',
+        required=True,
+        help='The root path to the vessel movement feature directories.')
+
+    argparser.add_argument(
+        '--calibration_mmsi_file',
+        help='File of mmsis, one per line, to calibrate eightbit ranges on.')
+
+    argparser.add_argument(
+        '--validation_mmsi_file',
+        help='File of mmsis, one per line, to measure drift on.')
+
+    argparser.add_argument(
+        '--drift_report_path', help='Where to write the JSON drift report.')
+
+    argparser.add_argument(
+        '--float_results_path',
+        help='Where to write float32 inference results for the validation '
+        'vessels, for compute_metrics --baseline-inference-path.')
+
+    argparser.add_argument(
+        '--quantized_results_path',
+        help='Where to write quantized inference results for the '
+        'validation vessels, for compute_metrics --inference-path.')
+
+    argparser.add_argument(
+        '--stitch_width',
+        type=int,
+        help='Width the graph was exported for, if stitched.')
+
+    argparser.add_argument(
+        '--prefetch_workers',
+        type=int,
+        default=1,
+        help='Threads reading and windowing feature files ahead of '
+        'inference.')
+
+    argparser.add_argument(
+        '--interval_months',
+        type=int,
+        default=6,
+        help='Spacing between windows for time based models.')
+
+    argparser.add_argument(
+        '--start_date',
+        type=dateutil.parser.parse,
+        help='Start date for fixed window models.')
+
+    argparser.add_argument(
+        '--end_date',
+        type=dateutil.parser.parse,
+        help='End date for fixed window models.')
+
+    args = argparser.parse_args()
+    if args.mode == EIGHTBIT and args.calibration_mmsi_file is None:
+        argparser.error('--calibration_mmsi_file is required for eightbit')
+    return args
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    main(args)
@@ -0,0 +1,140 @@
+# Copyright 2017 Google Inc. and Skytruth Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from collections import namedtuple
+import os
+import unittest
+import numpy as np
+import tensorflow as tf
+from classification import export_graph
+from classification import quantize_graph
+from classification.model_fixtures import load_model, write_initial_checkpoint
+from classification.run_inference import Inferer
+
+Objective = namedtuple('Objective', ['name'])
+ClassObjective = namedtuple('ClassObjective', ['name', 'classes'])
+
+
+class PredictionDriftTest(tf.test.TestCase):
+    def test_classification(self):
+        objective = ClassObjective('Multiclass', ['a', 'b', 'c'])
+        expected = [np.array([[0.7, 0.2, 0.1], [0.2, 0.5, 0.3]])]
+        actual = [np.array([[0.6, 0.3, 0.1], [0.2, 0.3, 0.5]])]
+        drift = quantize_graph.prediction_drift([objective], [expected],
+                                                [actual])['Multiclass']
+        self.assertEqual(2, drift['count'])
+        self.assertAllClose(0.2, drift['max_abs_diff'])
+        self.assertAllClose(0.1, drift['mean_abs_diff'])
+        self.assertAllClose(0.5, drift['argmax_agreement'])
+
+    def test_fishing(self):
+        objective = Objective('Fishing-localisation')
+        # Batches are concatenated.
+        expected = [np.array([[0.1, 0.6, 0.9]]), np.array([[0.4, 0.2, 0.8]])]
+        actual = [np.array([[0.1, 0.4, 0.9]]), np.array([[0.4, 0.2, 0.8]])]
+        drift = quantize_graph.prediction_drift([objective], [expected],
+                                                [actual])['Fishing-localisation']
+        self.assertEqual(2, drift['count'])
+        self.assertAllClose(0.2, drift['max_abs_diff'])
+        self.assertAllClose(0.2 / 6, drift['mean_abs_diff'])
+        self.assertAllClose(5 / 6., drift['threshold_agreement'])
+        self.assertNotIn('argmax_agreement', drift)
+
+    def test_regression(self):
+        objective = Objective('length')
+        # Batches of one are squeezed to scalars.
+        expected = [np.array([10., 20.]), np.float32(40.)]
+        actual = [np.array([11., 20.]), np.float32(38.)]
+        drift = quantize_graph.prediction_drift([objective], [expected],
+                                                [actual])['length']
+        self.assertEqual(3, drift['count'])
+        self.assertAllClose(2., drift['max_abs_diff'])
+        self.assertAllClose(1., drift['mean_abs_diff'])
+        self.assertAllClose((0.1 + 0.05) / 3, drift['mean_relative_diff'])
+
+    def test_empty(self):
+        objectives = [ClassObjective('Multiclass', ['a', 'b']),
+                      Objective('length')]
+        report = quantize_graph.prediction_drift(objectives, [[], []],
+                                                 [[], []])
+        self.assertEqual(['Multiclass', 'length'], sorted(report))
+        for drift in report.values():
+            self.assertEqual(0, drift['count'])
+            self.assertIsNone(drift['max_abs_diff'])
+            self.assertIsNone(drift['mean_abs_diff'])
+
+
+@unittest.skipIf(quantize_graph.TransformGraph is None,
+                 'tensorflow.tools.graph_transforms is unavailable')
+class QuantizeGraphTest(tf.test.TestCase):
+    model_name = 'prod.fishing_detection'
+    num_feature_dimensions = 11
+
+    def _inferer(self, graph_path):
+        with tf.Graph().as_default():
+            model = load_model(self.model_name, self.num_feature_dimensions)
+            return Inferer(model, graph_path, None, prefetch_workers=0)
+
+    def test_weights_round_trip(self):
+        temp_dir = self.get_temp_dir()
+        checkpoint_path = write_initial_checkpoint(
+            self.model_name, self.num_feature_dimensions,
+            os.path.join(temp_dir, 'model.ckpt'))
+        float_path = os.path.join(temp_dir, 'model.pb')
+        export_graph.export_inference_graph(
+            load_model(self.model_name, self.num_feature_dimensions),
+            checkpoint_path, float_path)
+
+        graph_def = tf.GraphDef()
+        with tf.gfile.GFile(float_path, 'rb') as f:
+            graph_def.ParseFromString(f.read())
+        quantized_path = os.path.join(temp_dir, 'model_weights.pb')
+        with tf.gfile.GFile(quantized_path, 'wb') as f:
+            f.write(quantize_graph.quantize_graph_def(
+                graph_def, quantize_graph.WEIGHTS).SerializeToString())
+        self.assertLess(os.path.getsize(quantized_path),
+                        os.path.getsize(float_path))
+
+        random_state = np.random.RandomState(42)
+        width = 1024
+        batch = (random_state.randn(2, 1, width, self.num_feature_dimensions)
+                 .astype(np.float32),
+                 np.tile(np.arange(width, dtype=np.int32), [2, 1]),
+                 np.array([[0, width]] * 2, dtype=np.int32),
+                 np.array([1, 2], dtype=np.int64))
+        float_inferer = self._inferer(float_path)
+        quantized_inferer = self._inferer(quantized_path)
+        try:
+            expected = float_inferer._run_batch(batch)[3:]
+            actual = quantized_inferer._run_batch(batch)[3:]
+            report = quantize_graph.prediction_drift(
+                float_inferer.objectives, [[x] for x in expected],
+                [[x] for x in actual])
+        finally:
+            float_inferer.close()
+            quantized_inferer.close()
+
+        self.assertEqual(sorted(o.name for o in float_inferer.objectives),
+                         sorted(report))
+        # Only the shape of the report is checked: the drift of an untrained
+        # model says little about that of a trained one, so no tolerance is
+        # asserted here.
+        for drift in report.values():
+            self.assertEqual(2, drift['count'])
+            self.assertTrue(np.isfinite(drift['max_abs_diff']))
+            self.assertTrue(np.isfinite(drift['mean_abs_diff']))
+
+
+if __name__ == '__main__':
+    tf.test.main()
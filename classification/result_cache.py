@@ -0,0 +1,188 @@
+# Copyright 2017 Google Inc. and Skytruth Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+""" On-disk cache of per-window inference predictions.
+
+Daily inference reruns every window of every vessel, though only the newest
+windows have new data. The cache stores the raw predictions of each window
+keyed by a hash of the window's inputs (time range, timestamps and
+features), so `Inferer` only runs the net on windows that changed.
+
+The cache is a local directory holding one subdirectory per model, named by
+`model_key`, of per-vessel files:
+
+    <cache_path>/<model_key>/<mmsi>.npz: `keys`, the window hashes, and
+        `prediction_<i>`, the stacked predictions of objective i.
+
+Vessel files are rewritten with only the windows of the latest run, so stale
+windows drop out. Whole files are evicted by age and total size, once per
+run by `sharded_inference`.
+"""
+from __future__ import absolute_import
+import hashlib
+import logging
+import os
+import time
+import numpy as np
+import tensorflow as tf
+
+
+def model_key(model, model_checkpoint_path, width,
+              window_checkpoint_path=None):
+    """ Key identifying the predictions of a model checkpoint.
+
+    Checkpoint files are identified by name, size and modification time
+    rather than by content, since hashing them from GCS would be slow.
+    `window_checkpoint_path` is the checkpoint short stitched tracks are
+    run with, if any.
+    """
+    h = hashlib.sha1()
+    h.update(('%s.%s:%s' % (type(model).__module__, type(model).__name__,
+                            width)).encode('utf-8'))
+
+    def add_checkpoint(checkpoint_path):
+        for path in sorted(tf.gfile.Glob(checkpoint_path + '*')):
+            stat = tf.gfile.Stat(path)
+            h.update(('%s:%s:%s' % (os.path.basename(path), stat.length,
+                                    stat.mtime_nsec)).encode('utf-8'))
+
+    add_checkpoint(model_checkpoint_path)
+    if window_checkpoint_path is not None:
+        h.update(b'window:')
+        add_checkpoint(window_checkpoint_path)
+    return h.hexdigest()
+
+
+def window_key(window):
+    """ Hash of the inputs of a (features, timestamps, time_bounds, mmsi)
+    window."""
+    h = hashlib.sha1()
+    for x in window:
+        h.update(np.ascontiguousarray(x).tobytes())
+    return h.hexdigest()
+
+
+class ResultCache(object):
+    """ Per-vessel window predictions for one model.
+
+    Args:
+        cache_path: local cache directory, shared between models.
+        model_key: result of `model_key` for the model whose predictions are
+            cached.
+        max_age_days: vessel files not used for this long are evicted.
+        max_bytes: once the cache is larger than this the least recently
+            used vessel files are evicted.
+    """
+
+    def __init__(self, cache_path, model_key, max_age_days=30, max_bytes=None):
+        self.cache_path = cache_path
+        self.model_path = os.path.join(cache_path, model_key)
+        self.max_age_days = max_age_days
+        self.max_bytes = max_bytes
+        if not os.path.exists(self.model_path):
+            try:
+                os.makedirs(self.model_path)
+            except OSError:
+                # Created concurrently by another shard.
+                if not os.path.isdir(self.model_path):
+                    raise
+        self.hits = 0
+        self.misses = 0
+
+    def _path(self, mmsi):
+        return os.path.join(self.model_path, '%s.npz' % mmsi)
+
+    def load(self, mmsi):
+        """ Returns a dict of window key to list of objective predictions."""
+        path = self._path(mmsi)
+        if not os.path.exists(path):
+            return {}
+        try:
+            with np.load(path) as data:
+                keys = data['keys'].tolist()
+                predictions = []
+                while 'prediction_%d' % len(predictions) in data.files:
+                    predictions.append(data['prediction_%d' % len(predictions)])
+        except (IOError, ValueError) as err:
+            logging.warning('Ignoring unreadable cache file %s: %s', path, err)
+            return {}
+        return {k: [x[i] for x in predictions] for (i, k) in enumerate(keys)}
+
+    def store(self, mmsi, entries, unchanged=False):
+        """ Replace the cached windows of `mmsi` with `entries`.
+
+        Args:
+            entries: dict of window key to list of objective predictions.
+            unchanged: entries are exactly what `load` returned, so the file
+                only needs marking as used.
+        """
+        path = self._path(mmsi)
+        if unchanged:
+            if os.path.exists(path):
+                os.utime(path, None)
+            return
+        if not entries:
+            if os.path.exists(path):
+                os.unlink(path)
+            return
+        keys = sorted(entries)
+        arrays = {'keys': np.array(keys)}
+        for i in range(len(entries[keys[0]])):
+            arrays['prediction_%d' % i] = np.stack(
+                [entries[k][i] for k in keys])
+        temp_path = path + '.tmp'
+        with open(temp_path, 'wb') as f:
+            np.savez(f, **arrays)
+        os.rename(temp_path, path)
+
+    def evict(self):
+        """ Remove vessel files that are too old, then the least recently
+        used ones until this model's files fit in `max_bytes`.
+
+        Only this model's directory is touched. Files still being written
+        are skipped, but this should run once no shards are storing.
+
+        Returns:
+            The number of files removed.
+        """
+        files = []
+        for name in os.listdir(self.model_path):
+            if name.endswith('.tmp'):
+                continue
+            path = os.path.join(self.model_path, name)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            files.append((stat.st_mtime, stat.st_size, path))
+        files.sort()
+        removed = []
+        if self.max_age_days is not None:
+            cutoff = time.time() - self.max_age_days * 24 * 60 * 60
+            while files and files[0][0] < cutoff:
+                removed.append(files.pop(0)[2])
+        if self.max_bytes is not None:
+            total = sum(size for (_, size, _) in files)
+            while files and total > self.max_bytes:
+                _, size, path = files.pop(0)
+                total -= size
+                removed.append(path)
+        for path in removed:
+            try:
+                os.unlink(path)
+            except OSError:
+                pass
+        if removed:
+            logging.info('Evicted %d files from result cache %s',
+                         len(removed), self.model_path)
+        return len(removed)
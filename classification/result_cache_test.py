@@ -0,0 +1,238 @@
+# Copyright 2017 Google Inc. and Skytruth Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import itertools
+import os
+import time
+import numpy as np
+import tensorflow as tf
+from classification import result_cache
+from classification import synthetic_features
+from classification.model_fixtures import load_model, write_initial_checkpoint
+from classification.run_inference import Inferer
+
+
+class ResultCacheTest(tf.test.TestCase):
+    def test_store_and_load(self):
+        cache = result_cache.ResultCache(self.get_temp_dir(), 'model')
+        self.assertEqual({}, cache.load(123))
+        entries = {
+            'a': [np.float32(1.5), np.arange(3, dtype=np.float32)],
+            'b': [np.float32(2.5), np.ones(3, dtype=np.float32)],
+        }
+        cache.store(123, entries)
+        loaded = cache.load(123)
+        self.assertEqual(sorted(entries), sorted(loaded))
+        for k in entries:
+            for e, a in zip(entries[k], loaded[k]):
+                self.assertAllEqual(e, a)
+        cache.store(123, {})
+        self.assertEqual({}, cache.load(123))
+
+    def test_window_key(self):
+        window = (np.zeros([1, 4, 2], dtype=np.float32),
+                  np.arange(4, dtype=np.int32),
+                  np.array([0, 4], dtype=np.int32), np.int64(7))
+        changed = (window[0] + 1, ) + window[1:]
+        self.assertEqual(
+            result_cache.window_key(window), result_cache.window_key(window))
+        self.assertNotEqual(
+            result_cache.window_key(window), result_cache.window_key(changed))
+
+    def test_model_key_includes_window_checkpoint(self):
+        temp_dir = self.get_temp_dir()
+        paths = [os.path.join(temp_dir, name) for name in ['stitched.pb',
+                                                           'window.ckpt']]
+        for path in paths:
+            with open(path, 'wb') as f:
+                f.write(b'weights')
+        key = result_cache.model_key(self, paths[0], 4096)
+        window_key = result_cache.model_key(self, paths[0], 4096,
+                                            window_checkpoint_path=paths[1])
+        self.assertNotEqual(key, window_key)
+        with open(paths[1], 'ab') as f:
+            f.write(b'retrained')
+        self.assertNotEqual(window_key, result_cache.model_key(
+            self, paths[0], 4096, window_checkpoint_path=paths[1]))
+
+    def test_evict(self):
+        path = os.path.join(self.get_temp_dir(), 'evict')
+        cache = result_cache.ResultCache(path, 'model', max_age_days=1,
+                                         max_bytes=None)
+        entries = {'a': [np.zeros(1000, dtype=np.float32)]}
+        for mmsi in [1, 2, 3]:
+            cache.store(mmsi, entries)
+        old = time.time() - 2 * 24 * 60 * 60
+        os.utime(cache._path(1), (old, old))
+        self.assertEqual(1, cache.evict())
+        self.assertEqual({}, cache.load(1))
+
+        os.utime(cache._path(2), (old + 1, old + 1))
+        os.utime(cache._path(3), (time.time(), time.time()))
+        cache.max_age_days = None
+        cache.max_bytes = os.path.getsize(cache._path(3))
+        self.assertEqual(1, cache.evict())
+        self.assertEqual({}, cache.load(2))
+        self.assertEqual(['a'], list(cache.load(3)))
+
+    def test_evict_only_own_files(self):
+        path = os.path.join(self.get_temp_dir(), 'evict_own')
+        cache = result_cache.ResultCache(path, 'model', max_age_days=1)
+        other = result_cache.ResultCache(path, 'other', max_age_days=1)
+        entries = {'a': [np.zeros(10, dtype=np.float32)]}
+        cache.store(1, entries)
+        other.store(1, entries)
+        temp_path = cache._path(2) + '.tmp'
+        with open(temp_path, 'wb') as f:
+            f.write(b'partial')
+        old = time.time() - 2 * 24 * 60 * 60
+        for p in [cache._path(1), other._path(1), temp_path]:
+            os.utime(p, (old, old))
+        self.assertEqual(1, cache.evict())
+        self.assertEqual({}, cache.load(1))
+        self.assertEqual(['a'], list(other.load(1)))
+        self.assertTrue(os.path.exists(temp_path))
+
+
+class CachedInferenceTest(tf.test.TestCase):
+    model_name = 'prod.fishing_detection'
+    num_feature_dimensions = 11
+
+    def _results(self, checkpoint_path, feature_path, mmsis, cache_path,
+                 batch_size=None):
+        with tf.Graph().as_default():
+            model = load_model(self.model_name, self.num_feature_dimensions)
+            inferer = Inferer(
+                model,
+                checkpoint_path,
+                feature_path,
+                batch_size=batch_size,
+                prefetch_workers=0,
+                result_cache_path=cache_path)
+            try:
+                results = list(inferer.run_inference(mmsis, 6, None, None))
+                cache = inferer.result_cache
+                counts = None if (cache is None) else (cache.hits,
+                                                       cache.misses)
+            finally:
+                inferer.close()
+        return results, counts
+
+    def _write_features(self, name, num_vessels):
+        temp_dir = self.get_temp_dir()
+        checkpoint_path = write_initial_checkpoint(
+            self.model_name, self.num_feature_dimensions,
+            os.path.join(temp_dir, 'model.ckpt'))
+        feature_path = os.path.join(temp_dir, name)
+        vessels = synthetic_features.write_synthetic_features(
+            feature_path, num_vessels, self.num_feature_dimensions + 1,
+            mean_points=2000)
+        mmsis = [mmsi for (mmsi, _, _) in vessels]
+        return checkpoint_path, feature_path, mmsis
+
+    def assertInWindowOrder(self, mmsis, results):
+        """ Each vessel's results are together, latest window first."""
+        self.assertEqual(
+            [mmsi for mmsi in mmsis
+             if any(x['mmsi'] == mmsi for x in results)],
+            [mmsi for (mmsi, _) in itertools.groupby(
+                x['mmsi'] for x in results)])
+        for _, vessel in itertools.groupby(results, lambda x: x['mmsi']):
+            end_times = [x['end_time'] for x in vessel]
+            self.assertEqual(sorted(end_times, reverse=True), end_times)
+
+    def test_cached_results_match(self):
+        checkpoint_path, feature_path, mmsis = self._write_features(
+            'features', 3)
+        cache_path = os.path.join(self.get_temp_dir(), 'cache')
+
+        first, (hits, misses) = self._results(checkpoint_path, feature_path,
+                                              mmsis, cache_path)
+        self.assertEqual(0, hits)
+        self.assertEqual(len(first), misses)
+        second, (hits, misses) = self._results(checkpoint_path, feature_path,
+                                               mmsis, cache_path)
+        # Only the window ending at each track's last point is rerun.
+        self.assertEqual(len(mmsis), misses)
+        self.assertEqual(len(first) - len(mmsis), hits)
+        self.assertEqual(first, second)
+
+    def test_results_in_window_order(self):
+        checkpoint_path, feature_path, mmsis = self._write_features(
+            'ordered_features', 4)
+        cache_path = os.path.join(self.get_temp_dir(), 'ordered_cache')
+        # Small batches mix vessels, and the second run mixes cached and
+        # run windows.
+        for _ in range(2):
+            results, _ = self._results(checkpoint_path, feature_path, mmsis,
+                                       cache_path, batch_size=3)
+            self.assertInWindowOrder(mmsis, results)
+
+    def test_covers_last_point(self):
+        checkpoint_path, feature_path, mmsis = self._write_features(
+            'covered_features', 3)
+        cache_path = os.path.join(self.get_temp_dir(), 'covered_cache')
+        cached, _ = self._results(checkpoint_path, feature_path, mmsis,
+                                  cache_path)
+        uncached, _ = self._results(checkpoint_path, feature_path, mmsis,
+                                    None)
+
+        def last_times(results):
+            return {mmsi: max(x['end_time'] for x in vessel)
+                    for mmsi, vessel in itertools.groupby(
+                        results, lambda x: x['mmsi'])}
+
+        self.assertEqual(last_times(uncached), last_times(cached))
+        # The windows ending at the last point are the same too.
+        self.assertEqual(
+            [x for x in uncached if x['end_time'] == last_times(uncached)[
+                x['mmsi']]],
+            [x for x in cached if x['end_time'] == last_times(cached)[
+                x['mmsi']]])
+
+    def test_appended_points_hit(self):
+        temp_dir = self.get_temp_dir()
+        checkpoint_path = write_initial_checkpoint(
+            self.model_name, self.num_feature_dimensions,
+            os.path.join(temp_dir, 'model.ckpt'))
+        feature_path = os.path.join(temp_dir, 'appended_features')
+        os.makedirs(feature_path)
+        cache_path = os.path.join(temp_dir, 'appended_cache')
+        mmsi = synthetic_features.FIRST_MMSI
+        features = synthetic_features.synthetic_vessel_features(
+            np.random.RandomState(0), 6000, self.num_feature_dimensions + 1)
+
+        def write(num_points):
+            path = os.path.join(feature_path, '%d.tfrecord' % mmsi)
+            with tf.python_io.TFRecordWriter(path) as writer:
+                writer.write(synthetic_features.serialize_vessel(
+                    mmsi, features[:num_points]))
+
+        write(5000)
+        first, (hits, misses) = self._results(checkpoint_path, feature_path,
+                                              [mmsi], cache_path)
+        self.assertEqual(0, hits)
+        self.assertTrue(misses > 2)
+        write(6000)
+        second, (hits, misses) = self._results(checkpoint_path, feature_path,
+                                               [mmsi], cache_path)
+        # All but the window ending at the old last point are reused.
+        self.assertEqual(len(first) - 1, hits)
+        self.assertEqual(len(second) - hits, misses)
+        self.assertNotEqual(first[0], second[0])
+        self.assertEqual(first[1:], second[len(second) - hits:])
+
+
+if __name__ == '__main__':
+    tf.test.main()
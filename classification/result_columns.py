@@ -0,0 +1,223 @@
+# Copyright 2017 Google Inc. and Skytruth Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+""" Columnar representation of inference results.
+
+Inference results are one dict per window. This stores a set of them as a
+directory of `.npy` arrays, which can be memory mapped, plus a
+`manifest.json` describing the fields and the `FORMAT_VERSION`:
+
+    mmsi.npy: one fixed width byte string per row, since mmsis are not
+        always numeric.
+    start_time.npy, end_time.npy: one int64 entry per row, in seconds since
+        the epoch.
+    <field>.rows.npy: the rows that have <field>.
+    For classification fields (those with `label_scores`):
+        <field>.scores.npy: float32 [len(rows), len(classes)] scores, with
+            the classes listed in the manifest.
+        <field>.max_label.npy: int32 [len(rows)] index in classes of the
+            row's `max_label`.
+    For attribute fields (those with a `value`):
+        <field>.value.npy: float64 [len(rows)] values.
+    For range fields (lists of `start_time`, `end_time`, `value` dicts):
+        <field>.range_row.npy, <field>.range_start.npy,
+        <field>.range_end.npy, <field>.range_value.npy: one entry per range.
+"""
+from __future__ import absolute_import
+import calendar
+import datetime
+import json
+import os
+import numpy as np
+
+MANIFEST_FILE = 'manifest.json'
+# Increased when the arrays written change.
+FORMAT_VERSION = 2
+
+CLASSIFICATION = 'classification'
+ATTRIBUTE = 'attribute'
+RANGES = 'ranges'
+
+
+def iso_to_epoch(text):
+    """Seconds since the epoch for an ISO time as written by inference."""
+    dt = datetime.datetime.strptime(text[:19], '%Y-%m-%dT%H:%M:%S')
+    return calendar.timegm(dt.timetuple())
+
+
+class _Column(object):
+    """ A growing array, held as numpy chunks of `chunk_size` rows.
+
+    Only the rows since the last chunk are kept as Python objects, which
+    take many times the memory of the numpy entries.
+    """
+
+    def __init__(self, dtype, chunk_size, shape=()):
+        self.dtype = dtype
+        self.chunk_size = chunk_size
+        self.shape = tuple(shape)
+        self.chunks = []
+        self.pending = []
+
+    def append(self, value):
+        self.pending.append(value)
+        if len(self.pending) >= self.chunk_size:
+            self._flush()
+
+    def _flush(self):
+        if self.pending:
+            self.chunks.append(
+                np.array(self.pending, dtype=self.dtype).reshape(
+                    (-1, ) + self.shape))
+            self.pending = []
+
+    def array(self):
+        self._flush()
+        if not self.chunks:
+            return np.zeros((0, ) + self.shape, dtype=self.dtype)
+        if len(self.chunks) > 1:
+            self.chunks = [np.concatenate(self.chunks)]
+        return self.chunks[0]
+
+
+class _Field(object):
+    def __init__(self, kind, chunk_size, classes=None):
+        self.kind = kind
+        self.classes = classes
+        self.rows = _Column(np.int64, chunk_size)
+        if kind == CLASSIFICATION:
+            self.scores = _Column(np.float32, chunk_size, [len(classes)])
+            self.max_labels = _Column(np.int32, chunk_size)
+        elif kind == ATTRIBUTE:
+            self.values = _Column(np.float64, chunk_size)
+        else:
+            self.range_row = _Column(np.int64, chunk_size)
+            self.range_start = _Column(np.int64, chunk_size)
+            self.range_end = _Column(np.int64, chunk_size)
+            self.range_value = _Column(np.float32, chunk_size)
+
+
+class ColumnBuilder(object):
+    """ Accumulates inference result dicts into columns.
+
+    Args:
+        chunk_size: the number of entries of a column converted to numpy at
+            a time.
+    """
+
+    def __init__(self, chunk_size=4096):
+        self.chunk_size = chunk_size
+        self.num_rows = 0
+        self.mmsi = _Column(np.bytes_, chunk_size)
+        self.start_time = _Column(np.int64, chunk_size)
+        self.end_time = _Column(np.int64, chunk_size)
+        self.fields = {}
+
+    def __len__(self):
+        return self.num_rows
+
+    def append(self, result):
+        row = self.num_rows
+        self.num_rows += 1
+        self.mmsi.append(str(result['mmsi']))
+        self.start_time.append(iso_to_epoch(result['start_time']))
+        self.end_time.append(iso_to_epoch(result['end_time']))
+        for key, value in result.items():
+            if key in ('mmsi', 'start_time', 'end_time'):
+                continue
+            if isinstance(value, dict) and 'label_scores' in value:
+                scores = value['label_scores']
+                if key in self.fields:
+                    field = self._field(key, CLASSIFICATION)
+                else:
+                    field = self._field(key, CLASSIFICATION, sorted(scores))
+                field.scores.append([scores[x] for x in field.classes])
+                field.max_labels.append(
+                    field.classes.index(value['max_label']))
+            elif isinstance(value, dict) and 'value' in value:
+                field = self._field(key, ATTRIBUTE)
+                field.values.append(value['value'])
+            elif isinstance(value, list):
+                field = self._field(key, RANGES)
+                for x in value:
+                    field.range_row.append(row)
+                    field.range_start.append(iso_to_epoch(x['start_time']))
+                    field.range_end.append(iso_to_epoch(x['end_time']))
+                    field.range_value.append(x['value'])
+            else:
+                continue
+            field.rows.append(row)
+
+    def _field(self, key, kind, classes=None):
+        if key not in self.fields:
+            self.fields[key] = _Field(kind, self.chunk_size, classes)
+        field = self.fields[key]
+        if field.kind != kind:
+            raise ValueError('Field %s is both %s and %s' %
+                             (key, field.kind, kind))
+        return field
+
+    def arrays(self):
+        """ Return `(manifest, arrays)` for the accumulated rows."""
+        arrays = {
+            'mmsi': self.mmsi.array(),
+            'start_time': self.start_time.array(),
+            'end_time': self.end_time.array(),
+        }
+        manifest = {'version': FORMAT_VERSION, 'num_rows': self.num_rows,
+                    'fields': {}}
+        for key, field in self.fields.items():
+            manifest['fields'][key] = {'kind': field.kind}
+            arrays[key + '.rows'] = field.rows.array()
+            if field.kind == CLASSIFICATION:
+                manifest['fields'][key]['classes'] = field.classes
+                arrays[key + '.scores'] = field.scores.array()
+                arrays[key + '.max_label'] = field.max_labels.array()
+            elif field.kind == ATTRIBUTE:
+                arrays[key + '.value'] = field.values.array()
+            else:
+                arrays[key + '.range_row'] = field.range_row.array()
+                arrays[key + '.range_start'] = field.range_start.array()
+                arrays[key + '.range_end'] = field.range_end.array()
+                arrays[key + '.range_value'] = field.range_value.array()
+        return manifest, arrays
+
+    def save(self, path):
+        manifest, arrays = self.arrays()
+        save_columns(path, manifest, arrays)
+
+
+def save_columns(path, manifest, arrays):
+    if not os.path.exists(path):
+        os.makedirs(path)
+    for name, array in arrays.items():
+        np.save(os.path.join(path, name + '.npy'), array)
+    # Written last, so a directory with a manifest is complete.
+    with open(os.path.join(path, MANIFEST_FILE), 'w') as f:
+        json.dump(manifest, f)
+
+
+def load_columns(path, mmap=True):
+    """ Load columns saved by `save_columns`.
+
+    Returns:
+        `(manifest, arrays)`, where arrays are memory mapped if `mmap`.
+    """
+    with open(os.path.join(path, MANIFEST_FILE)) as f:
+        manifest = json.load(f)
+    arrays = {}
+    for name in os.listdir(path):
+        if name.endswith('.npy'):
+            arrays[name[:-4]] = np.load(
+                os.path.join(path, name), mmap_mode='r' if mmap else None)
+    return manifest, arrays
@@ -0,0 +1,142 @@
+# Copyright 2017 Google Inc. and Skytruth Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+""" Buffered, compressed newline-JSON writer for inference results."""
+from __future__ import absolute_import
+import gzip
+import logging
+import ujson
+
+from . import result_columns
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+GZIP = 'gzip'
+ZSTD = 'zstd'
+
+_EXTENSIONS = {'.gz': GZIP, '.zst': ZSTD}
+
+
+def _split_extension(path):
+    for ext in _EXTENSIONS:
+        if path.endswith(ext):
+            return path[:-len(ext)], ext
+    return path, ''
+
+
+class ResultWriter(object):
+    """ Writes inference result dicts as newline-JSON.
+
+    Results are encoded with ujson and written in blocks of roughly
+    `block_size` uncompressed bytes. Compression is chosen from the path
+    extension (`.gz` or `.zst`) unless given explicitly.
+
+    Args:
+        path: output path.
+        block_size: number of uncompressed bytes to buffer between writes.
+        max_shard_bytes: if not None, start a new shard once the current one
+            holds at least this many (compressed) bytes. Shards are written to
+            `<base>-00000<ext>`, `<base>-00001<ext>`, ... rather than `path`.
+        columns: if true, also write a `result_columns` sidecar directory,
+            `<shard path>.columns`, for each shard.
+        compression: None to infer from `path`, or 'gzip', 'zstd' or ''.
+    """
+
+    def __init__(self,
+                 path,
+                 block_size=1 << 22,
+                 max_shard_bytes=None,
+                 columns=False,
+                 compression=None):
+        base, ext = _split_extension(path)
+        self.path = path
+        self.base = base
+        self.ext = ext
+        self.compression = (_EXTENSIONS.get(ext, '') if (compression is None)
+                            else compression)
+        if self.compression == ZSTD and zstandard is None:
+            raise ImportError('zstandard is required to write %s' % path)
+        self.block_size = block_size
+        self.max_shard_bytes = max_shard_bytes
+        self.columns = columns
+        self.paths = []
+        self._buffer = []
+        self._buffered_bytes = 0
+        self._open_shard()
+
+    def _open_shard(self):
+        if self.max_shard_bytes is None:
+            path = self.path
+        else:
+            path = '%s-%05d%s' % (self.base, len(self.paths), self.ext)
+        self.paths.append(path)
+        self._raw = open(path, 'wb')
+        if self.compression == GZIP:
+            self._file = gzip.GzipFile(fileobj=self._raw, mode='wb')
+        elif self.compression == ZSTD:
+            self._file = zstandard.ZstdCompressor().stream_writer(self._raw)
+        else:
+            self._file = self._raw
+        self._column_builder = (result_columns.ColumnBuilder()
+                                if self.columns else None)
+
+    def _close_shard(self):
+        self._flush()
+        if self._file is not self._raw:
+            self._file.close()
+        if not self._raw.closed:
+            self._raw.close()
+        if self._column_builder is not None:
+            self._column_builder.save(self.paths[-1] + '.columns')
+
+    def _flush(self):
+        if self._buffer:
+            self._file.write(b''.join(self._buffer))
+            self._buffer = []
+            self._buffered_bytes = 0
+
+    def write(self, result):
+        line = (ujson.dumps(result) + '\n').encode('utf-8')
+        self._buffer.append(line)
+        self._buffered_bytes += len(line)
+        if self._column_builder is not None:
+            self._column_builder.append(result)
+        if self._buffered_bytes >= self.block_size:
+            self._flush()
+            if self.max_shard_bytes is None:
+                return
+            # Push out data held by the compressor so the size is accurate.
+            self._file.flush()
+            if self._raw.tell() >= self.max_shard_bytes:
+                self._close_shard()
+                logging.info('Finished shard %s', self.paths[-1])
+                self._open_shard()
+
+    def write_all(self, results):
+        count = 0
+        for result in results:
+            self.write(result)
+            count += 1
+        return count
+
+    def close(self):
+        self._close_shard()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
@@ -0,0 +1,116 @@
+# Copyright 2017 Google Inc. and Skytruth Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import gzip
+import os
+import ujson
+import tensorflow as tf
+from classification import result_columns
+from classification import result_writer
+
+
+def _result(i):
+    return {
+        'mmsi': i,
+        'start_time': '2015-01-01T00:00:00',
+        'end_time': '2015-07-01T00:00:00',
+        'Multiclass': {
+            'name': 'Multiclass',
+            'max_label': 'trawlers',
+            'max_label_probability': 0.75,
+            'label_scores': {'trawlers': 0.75, 'tug': 0.25}
+        },
+        'length': {'name': 'length', 'value': i * 1.5},
+        'fishing_localisation': [{
+            'start_time': '2015-01-01T00:00:00Z',
+            'end_time': '2015-01-01T00:10:00Z',
+            'value': 1.0
+        }] * (i % 3)
+    }
+
+
+class ResultWriterTest(tf.test.TestCase):
+    def test_round_trip(self):
+        path = os.path.join(self.get_temp_dir(), 'results.json.gz')
+        results = [_result(i) for i in range(100)]
+        with result_writer.ResultWriter(path, block_size=1000) as writer:
+            self.assertEqual(100, writer.write_all(results))
+
+        self.assertEqual([path], writer.paths)
+        with gzip.open(path) as f:
+            self.assertEqual(results, [ujson.loads(x) for x in f])
+
+    def test_shards_and_columns(self):
+        path = os.path.join(self.get_temp_dir(), 'sharded.json')
+        results = [_result(i) for i in range(100)]
+        with result_writer.ResultWriter(
+                path, block_size=1000, max_shard_bytes=5000,
+                columns=True) as writer:
+            writer.write_all(results)
+
+        self.assertGreater(len(writer.paths), 1)
+        lines = []
+        mmsis = []
+        lengths = []
+        range_count = 0
+        for shard_path in writer.paths:
+            with open(shard_path) as f:
+                lines.extend(ujson.loads(x) for x in f)
+            manifest, arrays = result_columns.load_columns(
+                shard_path + '.columns')
+            self.assertEqual(['trawlers', 'tug'],
+                             manifest['fields']['Multiclass']['classes'])
+            self.assertAllClose([[0.75, 0.25]] * manifest['num_rows'],
+                                arrays['Multiclass.scores'])
+            self.assertAllEqual([0] * manifest['num_rows'],
+                                arrays['Multiclass.max_label'])
+            mmsis.extend(arrays['mmsi'])
+            lengths.extend(arrays['length.value'])
+            range_count += len(arrays['fishing_localisation.range_start'])
+        self.assertEqual(results, lines)
+        self.assertEqual([str(x).encode('utf-8') for x in range(100)], mmsis)
+        self.assertAllClose([x * 1.5 for x in range(100)], lengths)
+        self.assertEqual(sum(i % 3 for i in range(100)), range_count)
+
+
+
+class ColumnBuilderTest(tf.test.TestCase):
+    def _arrays(self, chunk_size, results):
+        builder = result_columns.ColumnBuilder(chunk_size=chunk_size)
+        for result in results:
+            builder.append(result)
+        self.assertEqual(len(results), len(builder))
+        return builder.arrays()
+
+    def test_chunks_match_single_chunk(self):
+        # The mmsis widen from one to three characters across chunks.
+        results = [_result(i) for i in range(0, 300, 3)]
+        manifest, arrays = self._arrays(len(results), results)
+        chunked_manifest, chunked_arrays = self._arrays(7, results)
+
+        self.assertEqual(manifest, chunked_manifest)
+        self.assertEqual(sorted(arrays), sorted(chunked_arrays))
+        for name, array in arrays.items():
+            self.assertEqual(array.dtype, chunked_arrays[name].dtype)
+            self.assertAllEqual(array, chunked_arrays[name])
+        self.assertEqual((len(results), 2), arrays['Multiclass.scores'].shape)
+
+    def test_empty(self):
+        manifest, arrays = self._arrays(7, [])
+        self.assertEqual(0, manifest['num_rows'])
+        self.assertEqual((0, ), arrays['mmsi'].shape)
+
+
+if __name__ == '__main__':
+    tf.test.main()
@@ -14,6 +14,8 @@
 
 from __future__ import absolute_import
 
+import collections
+import itertools
 import logging
 import numpy as np
 import os
@@ -26,35 +28,159 @@ import uuid
 from datetime import datetime
 from datetime import timedelta
 
+from . import feature_decoder
+from . import feature_store
 from . import file_iterator
+from . import inference_stats
+from . import result_cache
+from . import result_writer
 
 
-class Inferer(object):
-    def __init__(self, model, model_checkpoint_path, root_feature_path):
+# Names of the inference graph inputs and outputs, used to find them in
+# graphs written by `export_graph`.
+FEATURES_NAME = 'features'
+TIMESTAMPS_NAME = 'timestamps'
+TIME_RANGES_NAME = 'time_ranges'
+MMSIS_NAME = 'mmsis'
+PREDICTION_NAME = 'prediction_%d'
+
 
+class Inferer(object):
+    def __init__(self, model, model_checkpoint_path, root_feature_path,
+                 batch_size=None, prefetch_workers=0, prefetch_depth=32,
+                 prefetch_max_bytes=2**30, prefetch_processes=False,
+                 feature_store_path=None, stitch_width=None,
+                 stats_interval=60, stats_path=None, result_cache_path=None,
+                 result_cache_max_age_days=30, result_cache_max_bytes=None,
+                 window_checkpoint_path=None):
+        """
+        args:
+            model: model instance to run inference with.
+            model_checkpoint_path: path (local or gs://) of checkpoint to restore,
+                or of a frozen `.pb` graph written by `export_graph`.
+            root_feature_path: directory holding the `<mmsi>.tfrecord` feature files.
+            batch_size: number of windows fed to the net per `sess.run`. Windows
+                are grouped across vessels as well as within them. Defaults to
+                the model's batch size, scaled down for stitched inputs.
+            prefetch_workers: number of background workers reading and
+                windowing upcoming feature files. Zero, the default, reads
+                files inline; callers running one Inferer per core should
+                keep this small.
+            prefetch_depth: maximum number of files read ahead.
+            prefetch_max_bytes: approximate cap on memory held by read ahead
+                windows.
+            prefetch_processes: read ahead in processes rather than threads.
+            feature_store_path: if not None, read features from the
+                `feature_store.FeatureStore` at this path instead of from
+                root_feature_path.
+            stitch_width: if not None, run fixed window models over inputs
+                of this many points, a multiple of the model's
+                window_max_points, rather than over overlapping training
+                sized windows. Only models with `stitched_window` support
+                this. Tracks too short to fill a stitched input are run in
+                training sized windows rather than padded.
+            stats_interval: seconds between logged summaries of the
+                `inference_stats.InferenceStats` kept in `self.stats`.
+            stats_path: if not None, also write each summary here as JSON.
+            result_cache_path: if not None, a local directory in which to
+                cache the predictions of each window, so that windows whose
+                inputs are unchanged since the last run aren't rerun. Fixed
+                window models then place all but the last window of each
+                track on a grid from its start, so they don't move as
+                points are appended.
+            result_cache_max_age_days: cached vessels unused for this long
+                are evicted by `self.result_cache.evict()`.
+            result_cache_max_bytes: if not None, `self.result_cache.evict()`
+                also evicts least recently used vessels to keep the model's
+                cache under this size.
+            window_checkpoint_path: with stitch_width, the checkpoint or
+                training width frozen graph to run short tracks with.
+                Defaults to model_checkpoint_path if that is a checkpoint;
+                otherwise short tracks are padded to stitch_width.
+
+        """
         self.model = model
         self.model_checkpoint_path = model_checkpoint_path
         self.root_feature_path = root_feature_path
-        self.batch_size = self.model.batch_size
+        if prefetch_workers:
+            self.prefetch = dict(num_workers=prefetch_workers,
+                                 max_pending=prefetch_depth,
+                                 max_bytes=prefetch_max_bytes,
+                                 use_processes=prefetch_processes)
+        else:
+            self.prefetch = None
         self.min_points_for_classification = model.min_viable_timeslice_length
+        if stitch_width is None:
+            self.width = model.window_max_points
+        elif stitch_width % model.window_max_points:
+            raise ValueError('stitch_width must be a multiple of %s' %
+                             model.window_max_points)
+        else:
+            self.width = stitch_width
+        if batch_size is None:
+            # Keep the points per batch the same for stitched inputs.
+            batch_size = max(1, self.model.batch_size *
+                             model.window_max_points // self.width)
+        self.batch_size = batch_size
+        self.stats = inference_stats.InferenceStats(stats_interval, stats_path)
         self.sess = tf.Session()
-        self.objectives = self._build_objectives()
-        self._restore_graph()
-        self.deserializer = file_iterator.Deserializer(
-                num_features=model.num_feature_dimensions + 1, sess=self.sess)
+        if model_checkpoint_path.endswith('.pb'):
+            self.objectives = self._load_frozen_graph()
+        else:
+            self.objectives = self._build_objectives()
+            self._restore_graph()
+        window_checkpoint_path = short_track_checkpoint_path(
+            model, model_checkpoint_path, window_checkpoint_path, self.width)
+        if self.width == model.window_max_points:
+            self.window_inferer = None
+        elif window_checkpoint_path is None:
+            logging.warning('No window_checkpoint_path for %s, so short tracks '
+                            'will be padded to %s points',
+                            model_checkpoint_path, self.width)
+            self.window_inferer = None
+        else:
+            # Runs tracks too short for a stitched input, in its own graph
+            # so the checkpoint's variable names match.
+            with tf.Graph().as_default():
+                self.window_inferer = Inferer(model, window_checkpoint_path,
+                                              None, prefetch_workers=0)
+        if result_cache_path is None:
+            self.result_cache = None
+        else:
+            self.result_cache = result_cache.ResultCache(
+                result_cache_path,
+                result_cache.model_key(
+                    model, model_checkpoint_path, self.width,
+                    window_checkpoint_path=window_checkpoint_path),
+                result_cache_max_age_days, result_cache_max_bytes)
+        if feature_store_path is None:
+            self.feature_store = None
+            self.deserializer = feature_decoder.NumpyDeserializer(
+                    num_features=model.num_feature_dimensions + 1)
+        else:
+            # The file iterators read mmsis straight from a store passed in
+            # place of the deserializer.
+            self.feature_store = feature_store.FeatureStore(feature_store_path)
+            self.deserializer = self.feature_store
         logging.info('created Inferer with Model, %s, and dims %s', model, 
                     model.num_feature_dimensions)
 
     def close(self):
         self.sess.close()
+        if self.window_inferer is not None:
+            self.window_inferer.close()
 
     def _build_objectives(self):
         # with self.sess.as_default():
             self.features_ph = tf.placeholder(tf.float32, 
-                shape=[None, 1, self.model.window_max_points, self.model.num_feature_dimensions])
-            self.timestamps_ph = tf.placeholder(tf.int32, shape=[None, self.model.window_max_points])
-            self.time_ranges_ph = tf.placeholder(tf.int32, shape=[None, 2])
-            self.mmsis_ph = tf.placeholder(tf.int64, shape=[None])  # TODO: MMSI_CLEANUP -> tf.string
+                shape=[None, 1, self.width, self.model.num_feature_dimensions],
+                name=FEATURES_NAME)
+            self.timestamps_ph = tf.placeholder(tf.int32, shape=[None, self.width],
+                                                name=TIMESTAMPS_NAME)
+            self.time_ranges_ph = tf.placeholder(tf.int32, shape=[None, 2],
+                                                 name=TIME_RANGES_NAME)
+            self.mmsis_ph = tf.placeholder(tf.int64, shape=[None],  # TODO: MMSI_CLEANUP -> tf.string
+                                           name=MMSIS_NAME)
             objectives = self.model.build_inference_net(self.features_ph, self.timestamps_ph,
                                                         self.time_ranges_ph)
             return objectives
@@ -79,9 +205,36 @@ class Inferer(object):
         try:
             saver.restore(self.sess, model_checkpoint_path)
         finally:
-            os.unlink(temppath)
+            if gspath:
+                os.unlink(temppath)
+
+    def _load_frozen_graph(self):
+        # The objectives are still needed to format results, so build them
+        # in a throwaway graph, then point them at the frozen predictions.
+        with tf.Graph().as_default():
+            objectives = self._build_objectives()
+        logging.info("Loading frozen graph: %s", self.model_checkpoint_path)
+        graph_def = tf.GraphDef()
+        with tf.gfile.GFile(self.model_checkpoint_path, 'rb') as f:
+            graph_def.ParseFromString(f.read())
+        graph = self.sess.graph
+        with graph.as_default():
+            tf.import_graph_def(graph_def, name='')
+        self.features_ph = graph.get_tensor_by_name(FEATURES_NAME + ':0')
+        self.timestamps_ph = graph.get_tensor_by_name(TIMESTAMPS_NAME + ':0')
+        self.time_ranges_ph = graph.get_tensor_by_name(TIME_RANGES_NAME + ':0')
+        self.mmsis_ph = graph.get_tensor_by_name(MMSIS_NAME + ':0')
+        width = self.features_ph.get_shape()[2].value
+        if width != self.width:
+            raise ValueError('%s was exported for width %s, not %s' %
+                             (self.model_checkpoint_path, width, self.width))
+        for i, o in enumerate(objectives):
+            o.prediction = graph.get_tensor_by_name(PREDICTION_NAME % i + ':0')
+        return objectives
 
     def _feature_files(self, mmsis):
+        if self.feature_store is not None:
+            return list(mmsis)
         return [
             '%s/%s.tfrecord' % (self.root_feature_path, mmsi)
             for mmsi in mmsis
@@ -109,6 +262,118 @@ class Inferer(object):
 
 
     def run_inference(self, mmsis, interval_months, start_date, end_date):
+        feature_iter = self._window_iter(mmsis, interval_months, start_date,
+                                         end_date)
+
+        # In a loop, calculate logits and predictions for a batch of windows
+        # and write out one result per window. Terminates when the feature
+        # iterator is exhausted.
+        if self.result_cache is None:
+            predictions = self._predict(feature_iter)
+        else:
+            predictions = self._cached_predict(feature_iter)
+        for batch_result, count in predictions:
+            with self.stats.timed(inference_stats.FORMAT):
+                outputs = list(self._build_results(batch_result, count))
+            self.stats.add_batch(count)
+            self.stats.maybe_report()
+            for output in outputs:
+                yield output
+        self.stats.report()
+        if self.result_cache is not None:
+            logging.info('Result cache: %d windows cached, %d run',
+                         self.result_cache.hits, self.result_cache.misses)
+
+    def _predict(self, window_iter):
+        """ Yield `(batch_result, count)` for batches of `window_iter`."""
+        for batch in batch_windows(window_iter, self.batch_size):
+            with self.stats.timed(inference_stats.MODEL):
+                batch_result = self._run_batch(batch)
+            yield batch_result, len(batch[3])
+
+    def _cached_predict(self, window_iter):
+        """ As `_predict`, but only run windows not in the result cache.
+
+        Windows missing from the cache are batched across vessels as usual,
+        but each vessel's results are held until all its windows have been
+        run, then yielded together in window order, vessels in the order
+        read. The vessel's cache file is rewritten at the same time. The
+        first window of a fixed window track ends at its last point, so
+        changes as points are appended, and is never cached.
+        """
+        cache = self.result_cache
+        skip_first = self.model.max_window_duration_seconds == 0
+        # Keyed by window width, which differs for short stitched tracks.
+        pending = collections.defaultdict(list)
+        vessels = collections.deque()
+
+        def run_pending(width):
+            items = pending.pop(width)
+            batch = tuple(np.stack(x) for x in zip(*[w for (w, _, _, _) in items]))
+            with self.stats.timed(inference_stats.MODEL):
+                batch_result = self._run_batch(batch)
+            for (_, key, vessel, i), result in zip(
+                    items, unbatch_results(batch_result, len(items))):
+                vessel['results'][i] = result
+                if key is not None:
+                    vessel['entries'][key] = result[3:]
+                vessel['outstanding'] -= 1
+
+        def finished():
+            while vessels and vessels[0]['outstanding'] == 0:
+                vessel = vessels.popleft()
+                # Without new windows the entries are a subset of those loaded.
+                cache.store(vessel['mmsi'], vessel['entries'],
+                            unchanged=(not vessel['run'] and
+                                       len(vessel['entries']) == vessel['loaded']))
+                results = vessel['results']
+                if results:
+                    yield [np.stack(x) for x in zip(*results)], len(results)
+
+        # The file iterators produce each vessel's windows together.
+        for mmsi, windows in itertools.groupby(window_iter, lambda x: x[3]):
+            loaded = cache.load(mmsi)
+            vessel = {'mmsi': mmsi, 'loaded': len(loaded), 'entries': {},
+                      'run': False, 'results': [], 'outstanding': 0,
+                      'widths': set()}
+            vessels.append(vessel)
+            for i, window in enumerate(windows):
+                _, timestamps, time_bounds, _ = window
+                width = len(timestamps)
+                if skip_first and i == 0:
+                    key = None
+                else:
+                    key = result_cache.window_key(window)
+                if key in loaded:
+                    cache.hits += 1
+                    vessel['entries'][key] = loaded[key]
+                    vessel['results'].append([mmsi, time_bounds, timestamps] +
+                                             loaded[key])
+                    continue
+                cache.misses += 1
+                vessel['run'] = vessel['run'] or key is not None
+                vessel['results'].append(None)
+                vessel['outstanding'] += 1
+                vessel['widths'].add(width)
+                pending[width].append((window, key, vessel, i))
+                if len(pending[width]) >= self.batch_size:
+                    run_pending(width)
+                    for x in finished():
+                        yield x
+            if len(vessels) > self.batch_size and vessels[0]['outstanding']:
+                # Don't hold back many vessels behind one waiting on a
+                # partial batch, as happens for short stitched tracks.
+                for width in sorted(vessels[0]['widths'] & set(pending)):
+                    run_pending(width)
+            for x in finished():
+                yield x
+        for width in sorted(pending):
+            run_pending(width)
+        for x in finished():
+            yield x
+
+    def _window_iter(self, mmsis, interval_months, start_date, end_date):
+        """ Iterate over the windows to run inference on for mmsis."""
         matching_files = self._feature_files(mmsis)
         logging.info("MATCHING:")
         for path in matching_files:
@@ -119,60 +384,79 @@ class Inferer(object):
 
 
         if self.model.max_window_duration_seconds != 0:
-
-            time_starts = self._build_starts(interval_months)
-
-            delta = timedelta(
-                seconds=self.model.max_window_duration_seconds)
-            self.time_ranges = [(int(time.mktime(dt.timetuple())),
-                                 int(time.mktime((dt + delta).timetuple())))
-                                for dt in time_starts]
+            self.time_ranges = self._build_time_ranges(interval_months)
             feature_iter = file_iterator.cropping_all_slice_feature_file_iterator(
                 matching_files, self.deserializer,
                 self.time_ranges, self.model.window_max_points,
-                self.min_points_for_classification)  # TODO: add year
+                self.min_points_for_classification,  # TODO: add year
+                prefetch=self.prefetch, stats=self.stats)
         else:
-            if self.model.window is None:
-                shift = self.model.window_max_points
-            else:
-                b, e = self.model.window
-                shift = e - b
+            shift, b, e = self._fixed_window()
             logging.info("Shift %s %s %s", start_date, end_date, shift)
             feature_iter = file_iterator.all_fixed_window_feature_file_iterator(
                 matching_files, self.deserializer,
-                self.model.window_max_points, shift, start_date, end_date, b, e)
-
-
+                self.width, shift, start_date, end_date, b, e,
+                prefetch=self.prefetch, stats=self.stats,
+                # Cached windows only hit if they don't move as tracks grow.
+                anchor_start=(self.result_cache is not None),
+                short_window=self._short_window())
+        return feature_iter
+
+    def _build_time_ranges(self, interval_months):
+        """ The time ranges to classify for fixed duration models. """
+        time_starts = self._build_starts(interval_months)
+
+        delta = timedelta(
+            seconds=self.model.max_window_duration_seconds)
+        return [(int(time.mktime(dt.timetuple())),
+                 int(time.mktime((dt + delta).timetuple())))
+                for dt in time_starts]
+
+    def _fixed_window(self):
+        """ `(shift, win_start, win_end)` for fixed length window models. """
+        if self.model.window is None:
+            return self.width, 0, self.width
+        if self.width == self.model.window_max_points:
+            b, e = self.model.window
+        else:
+            b, e = self.model.stitched_window(self.width)
+        return e - b, b, e
+
+    def _short_window(self):
+        """ `(window_size, shift, win_start, win_end)` for tracks too short to
+        fill a stitched input, or None to pad them. """
+        if self.window_inferer is None:
+            return None
+        return (self.window_inferer.width, ) + self.window_inferer._fixed_window()
+
+    def _run_batch(self, batch):
+        """ Run the net on a `batch_windows` batch.
+
+        Returns:
+            The mmsis, time ranges and timestamps fed, followed by the
+            prediction of each objective, all batched.
+        """
+        features, timestamps, time_ranges, mmsis = batch
+        if timestamps.shape[1] != self.width:
+            return self.window_inferer._run_batch(batch)
+        feed_dict = {
+            self.features_ph : features,
+            self.timestamps_ph : timestamps,
+            self.time_ranges_ph : time_ranges,
+            self.mmsis_ph : mmsis
+        }
+
+        all_predictions = [o.prediction for o in self.objectives]
+        return self.sess.run([self.mmsis_ph, self.time_ranges_ph, self.timestamps_ph]
+                             + all_predictions,
+                             feed_dict=feed_dict)
+
+    def _build_results(self, batch_result, count):
+        """ Yield one result dict per window of a `_run_batch` result."""
         objectives = self.objectives
-
-        all_predictions = [o.prediction for o in objectives]
-
-        # In a loop, calculate logits and predictions and write out. Will
-        # be terminated when an EOF exception is thrown.
-        for i, queue_vals in enumerate(feature_iter):
-            logging.info("Inference step: %d", i)
-            t0 = time.clock()
-            logging.info("Type of queue_vals: %s", type(queue_vals))
-            for i, qv in enumerate(queue_vals):
-                logging.info("type(QV[%s]) = %s", i, type(qv))
-                logging.info("tf.shape(QV[%s]) = %s", i, np.shape(qv))
-            logging.info("Type of queue_vals: %s", type(queue_vals))
-
-            feed_dict = {
-                self.features_ph : queue_vals[0][np.newaxis],
-                self.timestamps_ph : queue_vals[1][np.newaxis],
-                self.time_ranges_ph : queue_vals[2][np.newaxis],
-                self.mmsis_ph : queue_vals[3][np.newaxis]
-            }
-
-            batch_result = self.sess.run([self.mmsis_ph, self.time_ranges_ph, self.timestamps_ph] 
-                                         + all_predictions, 
-                                         feed_dict=feed_dict)
-
-            # Tensorflow returns some items one would expect to be shape (1,)
-            # as shape (). Compensate for that here by checking for is_scalar
-            result = [(x if np.isscalar(x) else x[0]) for x in batch_result]
-
+        if np.shape(batch_result[2])[-1] != self.width:
+            objectives = self.window_inferer.objectives
+        for result in unbatch_results(batch_result, count):
             mmsi = result[0]
             start_time, end_time = [datetime.utcfromtimestamp(x) for x in result[1]]
             timestamps_array = result[2]
@@ -189,5 +473,88 @@ class Inferer(object):
             yield output
 
 
-
-
+    def write_inference(self, path, mmsis, interval_months, start_date,
+                        end_date, **writer_args):
+        """ Run inference and write the results with a `ResultWriter`.
+
+        Args:
+            path: output path, compressed according to its extension.
+            writer_args: further keyword arguments for `ResultWriter`.
+
+        Returns:
+            The paths written.
+        """
+        with result_writer.ResultWriter(path, **writer_args) as writer:
+            count = writer.write_all(self.run_inference(
+                mmsis, interval_months, start_date, end_date))
+        logging.info('Wrote %s results to %s', count, ', '.join(writer.paths))
+        return writer.paths
+
+
+def short_track_checkpoint_path(model, model_checkpoint_path,
+                                window_checkpoint_path, width):
+    """ The checkpoint `Inferer` runs tracks too short for `width` with.
+
+    Returns:
+        window_checkpoint_path, defaulting to model_checkpoint_path if that
+        is a checkpoint, or None if width is the model's training width or
+        there is no such checkpoint.
+    """
+    if width == model.window_max_points:
+        return None
+    if (window_checkpoint_path is None and
+            not model_checkpoint_path.endswith('.pb')):
+        return model_checkpoint_path
+    return window_checkpoint_path
+
+
+def batch_windows(window_iter, batch_size):
+    """Group single windows into stacked batches.
+
+    Args:
+        window_iter: iterable of (features, timestamps, time_bounds, mmsi)
+            tuples, one per window, as produced by the feature file iterators.
+        batch_size: maximum number of windows per batch.
+
+    Yields:
+        (features, timestamps, time_bounds, mmsis) tuples of arrays, each with
+        a leading batch dimension of at most `batch_size`. Windows of
+        different widths, from stitched inference of short tracks, are
+        batched separately. Windows of the same width keep the order in
+        which they were produced by `window_iter`.
+    """
+    assert batch_size > 0, batch_size
+    pending = {}
+    for window in window_iter:
+        width = len(window[1])
+        batch = pending.setdefault(width, [])
+        batch.append(window)
+        if len(batch) >= batch_size:
+            del pending[width]
+            yield tuple(np.stack(x) for x in zip(*batch))
+    for width in sorted(pending):
+        yield tuple(np.stack(x) for x in zip(*pending[width]))
+
+
+def unbatch_results(batch_result, count):
+    """Split the output of a batched `sess.run` into per-window results.
+
+    Tensorflow returns some items one would expect to be shape (1,) as
+    shape () (e.g. squeezed regression outputs), so reshape scalars back
+    into a batch of one before splitting.
+
+    Args:
+        batch_result: list of arrays with a leading batch dimension.
+        count: number of windows in the batch.
+
+    Returns:
+        A list with one list of per-window values for each window.
+    """
+    arrays = []
+    for x in batch_result:
+        x = np.asarray(x)
+        if x.ndim == 0:
+            x = x.reshape([1])
+        assert len(x) == count, (x.shape, count)
+        arrays.append(x)
+    return [[x[i] for x in arrays] for i in range(count)]
@@ -0,0 +1,179 @@
+# Copyright 2017 Google Inc. and Skytruth Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import numpy as np
+import tensorflow as tf
+from classification import file_iterator
+from classification import synthetic_features
+from classification import utility
+from classification.model_fixtures import load_model, write_initial_checkpoint
+from classification.run_inference import Inferer, batch_windows, unbatch_results
+
+
+def _windows(mmsi, count, width=8, depth=3):
+    """ `count` windows of one vessel, as the file iterators produce them."""
+    random_state = np.random.RandomState(mmsi)
+    windows = []
+    for i in range(count):
+        windows.append((
+            random_state.randn(1, width, depth).astype(np.float32),
+            np.arange(i * width, (i + 1) * width, dtype=np.int32),
+            np.array([i * width, (i + 1) * width - 1], dtype=np.int32),
+            np.int64(mmsi)))
+    return windows
+
+
+def _fake_run_batch(batch):
+    """ Stands in for `Inferer._run_batch`: the inputs fed, then one
+    prediction per window and one per point."""
+    features, timestamps, time_ranges, mmsis = batch
+    return [mmsis, time_ranges, timestamps,
+            features.sum(axis=(1, 2, 3)), features.mean(axis=(1, 3))]
+
+
+class BatchWindowsTest(tf.test.TestCase):
+    def test_batches_span_vessels(self):
+        windows = _windows(1, 3) + _windows(2, 4)
+        batches = list(batch_windows(windows, 5))
+        self.assertEqual([5, 2], [len(b[3]) for b in batches])
+        self.assertAllEqual([1, 1, 1, 2, 2], batches[0][3])
+        self.assertAllEqual([2, 2], batches[1][3])
+        self.assertEqual((5, 1, 8, 3), batches[0][0].shape)
+        self.assertEqual((5, 8), batches[0][1].shape)
+        self.assertEqual((5, 2), batches[0][2].shape)
+        for i, window in enumerate(windows):
+            batch = batches[i // 5]
+            for expected, actual in zip(window, batch):
+                self.assertAllEqual(expected, actual[i % 5])
+
+    def test_partial_final_batch(self):
+        windows = _windows(1, 7)
+        self.assertEqual([3, 3, 1],
+                         [len(b[3]) for b in batch_windows(windows, 3)])
+        self.assertEqual([7], [len(b[3]) for b in batch_windows(windows, 7)])
+        self.assertEqual([], list(batch_windows([], 3)))
+
+    def test_widths_batched_separately(self):
+        windows = [_windows(1, 1, width=8)[0], _windows(2, 1, width=4)[0],
+                   _windows(3, 1, width=8)[0]]
+        batches = list(batch_windows(windows, 4))
+        self.assertEqual([4, 8], sorted(b[1].shape[1] for b in batches))
+        by_width = {b[1].shape[1]: b for b in batches}
+        self.assertAllEqual([1, 3], by_width[8][3])
+        self.assertAllEqual([2], by_width[4][3])
+
+
+class UnbatchResultsTest(tf.test.TestCase):
+    def test_unbatch(self):
+        batch_result = [np.array([1, 2]), np.array([[0.1, 0.9], [0.8, 0.2]]),
+                        np.array([3.5, 4.5])]
+        results = unbatch_results(batch_result, 2)
+        self.assertEqual(2, len(results))
+        self.assertEqual(1, results[0][0])
+        self.assertAllEqual([0.8, 0.2], results[1][1])
+        self.assertEqual(4.5, results[1][2])
+
+    def test_single_window_squeezed(self):
+        # Tensorflow squeezes some batch of one outputs to scalars.
+        batch_result = [np.array([7]), np.float32(2.5),
+                        np.array([[1.0, 2.0]])]
+        results = unbatch_results(batch_result, 1)
+        self.assertEqual(1, len(results))
+        self.assertEqual(7, results[0][0])
+        self.assertEqual(2.5, results[0][1])
+        self.assertAllEqual([1.0, 2.0], results[0][2])
+
+    def test_wrong_count(self):
+        with self.assertRaises(AssertionError):
+            unbatch_results([np.array([1, 2])], 3)
+
+    def test_matches_one_window_at_a_time(self):
+        windows = _windows(1, 3) + _windows(2, 5) + _windows(3, 1)
+        expected = []
+        for window in windows:
+            # The old loop fed each window as a batch of one.
+            single = tuple(np.asarray(x)[np.newaxis] for x in window)
+            expected.extend(unbatch_results(_fake_run_batch(single), 1))
+        actual = []
+        for batch in batch_windows(windows, 4):
+            actual.extend(
+                unbatch_results(_fake_run_batch(batch), len(batch[3])))
+        self.assertEqual(len(expected), len(actual))
+        for e, a in zip(expected, actual):
+            self.assertEqual(len(e), len(a))
+            for x, y in zip(e, a):
+                self.assertAllClose(x, y)
+
+
+class WindowsNbytesTest(tf.test.TestCase):
+    def test_overlapping_views_counted_once(self):
+        track = np.zeros([1000, 5], dtype=np.float32)
+        features, timestamps, time_bounds, mmsis = (
+            utility.np_array_extract_all_fixed_slices(track, 5, 1, 100, 10))
+        self.assertEqual(91, len(features))
+        windows = [(features, timestamps, time_bounds, mmsis)]
+        # The features are views spanning all but the first column of the
+        # track; the rest are copies.
+        self.assertEqual(
+            track.nbytes - 4 + timestamps.nbytes + time_bounds.nbytes +
+            mmsis.nbytes, file_iterator._windows_nbytes(windows))
+
+    def test_separate_arrays(self):
+        arrays = [np.zeros([10, 3], dtype=np.float32) for _ in range(2)]
+        self.assertEqual(120 + 60, file_iterator._windows_nbytes(
+            [(arrays[0], arrays[1][:5])]))
+        self.assertEqual(0, file_iterator._windows_nbytes([(np.zeros([0]),
+                                                            1.0)]))
+
+
+class InfererBatchingTest(tf.test.TestCase):
+    model_name = 'prod.fishing_detection'
+    num_feature_dimensions = 11
+
+    def test_batched_matches_single_windows(self):
+        temp_dir = self.get_temp_dir()
+        checkpoint_path = write_initial_checkpoint(
+            self.model_name, self.num_feature_dimensions,
+            os.path.join(temp_dir, 'model.ckpt'))
+        feature_path = os.path.join(temp_dir, 'features')
+        vessels = synthetic_features.write_synthetic_features(
+            feature_path, 3, self.num_feature_dimensions + 1, mean_points=2000)
+        mmsis = [mmsi for (mmsi, _, _) in vessels]
+        with tf.Graph().as_default():
+            model = load_model(self.model_name, self.num_feature_dimensions)
+            inferer = Inferer(model, checkpoint_path, feature_path,
+                              batch_size=4, prefetch_workers=0)
+            try:
+                windows = list(inferer._window_iter(mmsis, 6, None, None))
+                expected = []
+                for window in windows:
+                    single = tuple(np.asarray(x)[np.newaxis] for x in window)
+                    expected.extend(
+                        unbatch_results(inferer._run_batch(single), 1))
+                actual = []
+                for batch in batch_windows(windows, inferer.batch_size):
+                    actual.extend(unbatch_results(inferer._run_batch(batch),
+                                                  len(batch[3])))
+            finally:
+                inferer.close()
+        self.assertGreater(len(windows), inferer.batch_size)
+        self.assertEqual(len(expected), len(actual))
+        for e, a in zip(expected, actual):
+            for x, y in zip(e, a):
+                self.assertAllClose(x, y, atol=1e-5)
+
+
+if __name__ == '__main__':
+    tf.test.main()
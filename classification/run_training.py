@@ -20,9 +20,10 @@ import math
 import os
 from pkg_resources import resource_filename
 import sys
+from . import feature_store
 from . import model
 from . import utility
-from .trainer import Trainer
+from .trainer import Trainer, QUEUE_PIPELINE, DATASET_PIPELINE
 import importlib
 import tensorflow as tf
 import tensorflow.contrib.slim as slim
@@ -84,7 +85,13 @@ def main(args):
 
     fishing_ranges = utility.read_fishing_ranges(fishing_range_file)
 
-    all_available_mmsis = utility.find_available_mmsis(args.root_feature_path)
+    if args.feature_store_path is None:
+        store = None
+        all_available_mmsis = utility.find_available_mmsis(
+            args.root_feature_path)
+    else:
+        store = feature_store.FeatureStore(args.feature_store_path)
+        all_available_mmsis = set(str(x) for x in store.mmsis)
 
     vessel_metadata = Model.read_metadata(
         all_available_mmsis, metadata_file,
@@ -95,7 +102,8 @@ def main(args):
 
     # TODO: training verbosity --training-verbosity
     trainer = Trainer(chosen_model, args.root_feature_path,
-                      args.training_output_path)
+                      args.training_output_path, feature_store=store,
+                      input_pipeline=args.input_pipeline)
 
     config = json.loads(os.environ.get('TF_CONFIG', '{}'))
     if (config == {}):
@@ -123,6 +131,17 @@ def parse_args():
         required=True,
         help='The root path to the vessel movement feature directories.')
 
+    argparser.add_argument(
+        '--feature_store_path',
+        help='Local feature store to read features from instead of the '
+        'feature files under root_feature_path.')
+
+    argparser.add_argument(
+        '--input_pipeline',
+        default=QUEUE_PIPELINE,
+        choices=[QUEUE_PIPELINE, DATASET_PIPELINE],
+        help='Read training data with queue runners or tf.contrib.data.')
+
     argparser.add_argument(
         '--training_output_path',
         required=True,
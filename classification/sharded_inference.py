@@ -0,0 +1,425 @@
+# Copyright 2017 Google Inc. and Skytruth Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+""" Multi-process driver around `Inferer.run_inference`.
+
+The mmsi list is split into contiguous shards, and each shard is run in its
+own worker process with its own session and restored checkpoint. Workers
+write their results to a temporary newline-JSON shard file that is renamed
+into place only once the shard completes, so a failed shard can simply be
+rerun. Once all shards are done they are either concatenated, in mmsi list
+order, into a single output file or left as separate shard files.
+
+Example:
+
+    python -m classification.sharded_inference prod.vessel_characterization \\
+        --model_checkpoint_path model.ckpt-500001 \\
+        --root_feature_path gs://bucket/features \\
+        --feature_dimensions 14 \\
+        --mmsi_file mmsis.txt \\
+        --output_path results.json.gz \\
+        --num_workers 32 \\
+        --interval_months 6
+
+Tensorflow is only imported in the workers.
+"""
+from __future__ import absolute_import
+import argparse
+from collections import namedtuple
+import importlib
+import logging
+import multiprocessing
+import os
+import shutil
+import time
+import dateutil.parser
+
+try:
+    from Queue import Empty
+except ImportError:
+    from queue import Empty
+
+from . import result_writer
+
+InferenceConfig = namedtuple('InferenceConfig', [
+    'model_name', 'num_feature_dimensions', 'model_checkpoint_path',
+    'root_feature_path', 'batch_size', 'interval_months', 'start_date',
+    'end_date', 'feature_store_path', 'stitch_width', 'result_cache_path',
+    'result_cache_max_age_days', 'result_cache_max_bytes',
+    'window_checkpoint_path', 'prefetch_workers'
+])
+
+ShardProgress = namedtuple('ShardProgress',
+                           ['shard', 'vessels', 'windows', 'done'])
+
+
+def load_model(model_name, num_feature_dimensions, vessel_metadata=None):
+    """Build `model_name`; vessel_metadata is only needed for training."""
+    module = "classification.models.{}".format(model_name)
+    Model = importlib.import_module(module).Model
+    return Model(num_feature_dimensions, vessel_metadata, 'minimal')
+
+
+def shard_path(output_path, shard, num_shards):
+    """Path of `shard` for `output_path`, keeping any `.gz` extension."""
+    base, ext = output_path, ''
+    if output_path.endswith('.gz'):
+        base, ext = output_path[:-3], '.gz'
+    return '{}-{:05d}-of-{:05d}{}'.format(base, shard, num_shards, ext)
+
+
+def split_shards(mmsis, num_shards):
+    """Split mmsis into `num_shards` contiguous, nearly equal shards."""
+    num_shards = max(1, min(num_shards, len(mmsis)))
+    size, extra = divmod(len(mmsis), num_shards)
+    shards = []
+    start = 0
+    for i in range(num_shards):
+        end = start + size + (1 if i < extra else 0)
+        shards.append(mmsis[start:end])
+        start = end
+    return shards
+
+
+def _run_shard(config, shard, mmsis, path, progress_queue, report_interval):
+    """Worker process entry point: run inference for one shard."""
+    from . import run_inference
+    logging.getLogger().setLevel(logging.WARNING)
+    model = load_model(config.model_name, config.num_feature_dimensions)
+    inferer = run_inference.Inferer(
+        model,
+        config.model_checkpoint_path,
+        config.root_feature_path,
+        batch_size=config.batch_size,
+        feature_store_path=config.feature_store_path,
+        stitch_width=config.stitch_width,
+        result_cache_path=config.result_cache_path,
+        result_cache_max_age_days=config.result_cache_max_age_days,
+        result_cache_max_bytes=config.result_cache_max_bytes,
+        window_checkpoint_path=config.window_checkpoint_path,
+        prefetch_workers=config.prefetch_workers)
+    temp_path = path + '.tmp'
+    vessels = windows = 0
+    last_mmsi = None
+    last_report = time.time()
+    compression = result_writer.GZIP if path.endswith('.gz') else ''
+    try:
+        with result_writer.ResultWriter(
+                temp_path, compression=compression) as writer:
+            for output in inferer.run_inference(
+                    mmsis, config.interval_months, config.start_date,
+                    config.end_date):
+                writer.write(output)
+                windows += 1
+                if output['mmsi'] != last_mmsi:
+                    vessels += 1
+                    last_mmsi = output['mmsi']
+                if time.time() - last_report > report_interval:
+                    progress_queue.put(
+                        ShardProgress(shard, vessels, windows, False))
+                    last_report = time.time()
+    finally:
+        inferer.close()
+    os.rename(temp_path, path)
+    progress_queue.put(ShardProgress(shard, vessels, windows, True))
+
+
+def _evict_result_cache(config):
+    """Worker process entry point: evict old result cache entries."""
+    from . import result_cache
+    from . import run_inference
+    model = load_model(config.model_name, config.num_feature_dimensions)
+    # The key must match the one each shard's Inferer caches under.
+    width = config.stitch_width or model.window_max_points
+    window_checkpoint_path = run_inference.short_track_checkpoint_path(
+        model, config.model_checkpoint_path, config.window_checkpoint_path,
+        width)
+    cache = result_cache.ResultCache(
+        config.result_cache_path,
+        result_cache.model_key(model, config.model_checkpoint_path, width,
+                               window_checkpoint_path=window_checkpoint_path),
+        config.result_cache_max_age_days, config.result_cache_max_bytes)
+    cache.evict()
+
+
+class ShardedInference(object):
+    """Run `Inferer.run_inference` over several worker processes.
+
+    Args:
+        config: InferenceConfig describing the model and inference run.
+        num_workers: number of concurrent worker processes.
+        shards_per_worker: number of shards to create per worker. More shards
+            balance load better and make retries cheaper, at the cost of
+            restoring the checkpoint once per shard.
+        max_retries: number of times a failed shard is restarted before
+            giving up.
+        report_interval: seconds between progress reports.
+    """
+
+    def __init__(self,
+                 config,
+                 num_workers,
+                 shards_per_worker=1,
+                 max_retries=2,
+                 report_interval=60):
+        self.config = config
+        self.num_workers = num_workers
+        self.shards_per_worker = shards_per_worker
+        self.max_retries = max_retries
+        self.report_interval = report_interval
+
+    def run(self, mmsis, output_path, merge=True):
+        """Run inference for `mmsis`, writing newline-JSON to `output_path`.
+
+        If `output_path` ends with `.gz` the output is gzipped. If `merge`
+        is true, the shards are concatenated in mmsi list order into
+        `output_path`; otherwise the shard files are left in place and
+        their paths returned.
+        """
+        shards = split_shards(list(mmsis),
+                              self.num_workers * self.shards_per_worker)
+        paths = [shard_path(output_path, i, len(shards))
+                 for i in range(len(shards))]
+        self._run_shards(shards, paths)
+        if self.config.result_cache_path is not None:
+            # Once, with no shards still writing to the cache.
+            process = multiprocessing.Process(target=_evict_result_cache,
+                                              args=(self.config, ))
+            process.start()
+            process.join()
+            if process.exitcode != 0:
+                logging.warning('Result cache eviction failed with exit '
+                                'code %s', process.exitcode)
+        if not merge:
+            return paths
+        logging.info('Merging %s shards into %s', len(paths), output_path)
+        # Concatenated gzip members form a valid gzip file, so shards can be
+        # merged as raw bytes in either case.
+        with open(output_path, 'wb') as dest:
+            for path in paths:
+                with open(path, 'rb') as src:
+                    shutil.copyfileobj(src, dest)
+        for path in paths:
+            os.unlink(path)
+        return [output_path]
+
+    def _start(self, shards, paths, shard, progress_queue):
+        process = multiprocessing.Process(
+            target=_run_shard,
+            args=(self.config, shard, shards[shard], paths[shard],
+                  progress_queue, self.report_interval))
+        process.daemon = True
+        process.start()
+        return process
+
+    def _run_shards(self, shards, paths):
+        progress_queue = multiprocessing.Queue()
+        pending = list(range(len(shards)))
+        running = {}
+        attempts = [0] * len(shards)
+        progress = {}
+        completed = set()
+        start_time = last_report = time.time()
+        while pending or running:
+            while pending and len(running) < self.num_workers:
+                shard = pending.pop(0)
+                attempts[shard] += 1
+                running[shard] = self._start(shards, paths, shard,
+                                             progress_queue)
+            try:
+                while True:
+                    update = progress_queue.get(timeout=1)
+                    progress[update.shard] = update
+                    if update.done:
+                        completed.add(update.shard)
+            except Empty:
+                pass
+            for shard, process in list(running.items()):
+                if process.is_alive():
+                    continue
+                process.join()
+                del running[shard]
+                if process.exitcode == 0 and shard in completed:
+                    continue
+                if process.exitcode == 0:
+                    # The completion message may still be in flight.
+                    running[shard] = process
+                    continue
+                progress.pop(shard, None)
+                if attempts[shard] > self.max_retries:
+                    for p in running.values():
+                        p.terminate()
+                    raise RuntimeError('Shard %s failed %s times' %
+                                       (shard, attempts[shard]))
+                logging.warning('Shard %s failed with exit code %s; '
+                                'restarting', shard, process.exitcode)
+                pending.append(shard)
+            if time.time() - last_report > self.report_interval:
+                self._report(progress, len(shards), len(completed),
+                             time.time() - start_time)
+                last_report = time.time()
+        self._report(progress, len(shards), len(completed),
+                     time.time() - start_time)
+
+    def _report(self, progress, num_shards, num_completed, elapsed):
+        vessels = sum(x.vessels for x in progress.values())
+        windows = sum(x.windows for x in progress.values())
+        logging.info('%s/%s shards complete; %s vessels, %s windows in %.0fs '
+                     '(%.1f windows/s)', num_completed, num_shards, vessels,
+                     windows, elapsed, windows / max(elapsed, 1e-6))
+        for shard in sorted(progress):
+            x = progress[shard]
+            logging.info('    shard %s: %s vessels, %s windows%s', shard,
+                         x.vessels, x.windows, ' (done)' if x.done else '')
+
+
+def parse_args():
+    """ Parses command-line arguments for sharded inference."""
+    argparser = argparse.ArgumentParser(
+        'Run vessel inference over several processes.')
+
+    argparser.add_argument('model_name')
+
+    argparser.add_argument(
+        '--model_checkpoint_path',
+        required=True,
+        help='Path to the checkpoint to restore.')
+
+    argparser.add_argument(
+        '--root_feature_path',
+        required=True,
+        help='The root path to the vessel movement feature files.')
+
+    argparser.add_argument(
+        '--feature_store_path',
+        help='Local feature store to read features from instead of the '
+        'feature files under root_feature_path.')
+
+    argparser.add_argument(
+        '--feature_dimensions',
+        required=True,
+        type=int,
+        help='The number of dimensions of a classification feature.')
+
+    argparser.add_argument(
+        '--mmsi_file',
+        required=True,
+        help='File holding the mmsis to run inference on, one per line.')
+
+    argparser.add_argument(
+        '--output_path',
+        required=True,
+        help='Newline-JSON output path; gzipped if it ends in `.gz`.')
+
+    argparser.add_argument(
+        '--num_workers',
+        type=int,
+        default=multiprocessing.cpu_count(),
+        help='Number of worker processes.')
+
+    argparser.add_argument(
+        '--shards_per_worker',
+        type=int,
+        default=1,
+        help='Number of shards to split the work into per worker.')
+
+    argparser.add_argument(
+        '--max_retries',
+        type=int,
+        default=2,
+        help='Number of times to restart a failed shard.')
+
+    argparser.add_argument(
+        '--no_merge',
+        action='store_true',
+        help='Leave the output as one file per shard.')
+
+    argparser.add_argument(
+        '--batch_size', type=int, help='Windows per inference batch.')
+
+    argparser.add_argument(
+        '--stitch_width',
+        type=int,
+        help='Input width for stitched inference with fishing models.')
+
+    argparser.add_argument(
+        '--window_checkpoint_path',
+        help='With --stitch_width, the checkpoint or training width frozen '
+        'graph to run tracks shorter than the stitched width with. Defaults '
+        'to --model_checkpoint_path if that is a checkpoint.')
+
+    argparser.add_argument(
+        '--prefetch_workers',
+        type=int,
+        default=1,
+        help='Feature reading threads per worker process. Workers already '
+        'run one per core, so more than one or two oversubscribe the CPU.')
+
+    argparser.add_argument(
+        '--result_cache_path',
+        help='Local directory caching per-window predictions between runs, '
+        'so only windows with new data are rerun.')
+
+    argparser.add_argument(
+        '--result_cache_max_age_days',
+        type=float,
+        default=30,
+        help='Evict cached vessels unused for this many days.')
+
+    argparser.add_argument(
+        '--result_cache_max_bytes',
+        type=int,
+        help='Evict least recently used cached vessels beyond this size.')
+
+    argparser.add_argument(
+        '--interval_months',
+        type=int,
+        default=6,
+        help='Spacing between windows for time based models.')
+
+    argparser.add_argument('--start_date', help='Start date for fixed '
+                           'window models.')
+
+    argparser.add_argument('--end_date', help='End date for fixed window '
+                           'models.')
+
+    return argparser.parse_args()
+
+
+def main(args):
+    logging.getLogger().setLevel(logging.INFO)
+
+    def parse_date(x):
+        return None if (x is None) else dateutil.parser.parse(x)
+
+    config = InferenceConfig(args.model_name, args.feature_dimensions,
+                             args.model_checkpoint_path, args.root_feature_path,
+                             args.batch_size, args.interval_months,
+                             parse_date(args.start_date),
+                             parse_date(args.end_date),
+                             args.feature_store_path, args.stitch_width,
+                             args.result_cache_path,
+                             args.result_cache_max_age_days,
+                             args.result_cache_max_bytes,
+                             args.window_checkpoint_path,
+                             args.prefetch_workers)
+    with open(args.mmsi_file) as f:
+        mmsis = [x.strip() for x in f if x.strip()]
+    runner = ShardedInference(config, args.num_workers,
+                              args.shards_per_worker, args.max_retries)
+    paths = runner.run(mmsis, args.output_path, merge=not args.no_merge)
+    logging.info('Wrote %s', ', '.join(paths))
+
+
+if __name__ == '__main__':
+    main(parse_args())
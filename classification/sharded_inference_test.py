@@ -0,0 +1,149 @@
+# Copyright 2017 Google Inc. and Skytruth Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import gzip
+import multiprocessing
+import os
+import sys
+import tensorflow as tf
+from classification.sharded_inference import (InferenceConfig,
+                                              ShardedInference, ShardProgress,
+                                              shard_path, split_shards)
+
+_CONFIG = InferenceConfig(*([None] * len(InferenceConfig._fields)))
+
+
+def _fake_shard(shard, mmsis, path, progress_queue, failures_dir,
+                num_failures):
+    """Writes one line per mmsi, after failing `num_failures` times."""
+    marker = os.path.join(failures_dir, str(shard))
+    failures = 0
+    if os.path.exists(marker):
+        with open(marker) as f:
+            failures = int(f.read())
+    if failures < num_failures:
+        with open(marker, 'w') as f:
+            f.write(str(failures + 1))
+        sys.exit(1)
+    with open(path, 'w') as f:
+        for mmsi in mmsis:
+            f.write('%s\n' % mmsi)
+    progress_queue.put(ShardProgress(shard, len(mmsis), len(mmsis), True))
+
+
+class FakeShardedInference(ShardedInference):
+    def __init__(self, failures_dir, num_failures, *args, **kwargs):
+        super(FakeShardedInference, self).__init__(*args, **kwargs)
+        self.failures_dir = failures_dir
+        self.num_failures = num_failures
+
+    def _start(self, shards, paths, shard, progress_queue):
+        process = multiprocessing.Process(
+            target=_fake_shard,
+            args=(shard, shards[shard], paths[shard], progress_queue,
+                  self.failures_dir, self.num_failures))
+        process.daemon = True
+        process.start()
+        return process
+
+
+class ShardPathTest(tf.test.TestCase):
+    def test_plain(self):
+        self.assertEqual('out/results.json-00002-of-00010',
+                         shard_path('out/results.json', 2, 10))
+
+    def test_keeps_gz_extension(self):
+        self.assertEqual('results.json-00000-of-00003.gz',
+                         shard_path('results.json.gz', 0, 3))
+
+
+class SplitShardsTest(tf.test.TestCase):
+    def test_even(self):
+        self.assertEqual([[0, 1], [2, 3], [4, 5]],
+                         split_shards(list(range(6)), 3))
+
+    def test_uneven(self):
+        shards = split_shards(list(range(7)), 3)
+        self.assertEqual([[0, 1, 2], [3, 4], [5, 6]], shards)
+
+    def test_more_shards_than_mmsis(self):
+        self.assertEqual([[0], [1]], split_shards([0, 1], 5))
+
+    def test_empty(self):
+        self.assertEqual([[]], split_shards([], 4))
+
+
+class ShardedInferenceTest(tf.test.TestCase):
+    def _run(self, num_failures, output_name, max_retries=2, merge=True):
+        temp_dir = self.get_temp_dir()
+        failures_dir = os.path.join(temp_dir, output_name + '_failures')
+        os.makedirs(failures_dir)
+        runner = FakeShardedInference(failures_dir, num_failures, _CONFIG, 2,
+                                      shards_per_worker=2,
+                                      max_retries=max_retries,
+                                      report_interval=0)
+        output_path = os.path.join(temp_dir, output_name)
+        return runner.run(list(range(10)), output_path, merge=merge)
+
+    def test_merge_in_mmsi_order(self):
+        paths = self._run(0, 'merged.json')
+        self.assertEqual(1, len(paths))
+        with open(paths[0]) as f:
+            self.assertEqual([str(x) for x in range(10)], f.read().split())
+        # The shard files are removed once merged.
+        self.assertEqual([], [
+            x for x in os.listdir(self.get_temp_dir())
+            if x.startswith('merged.json-')
+        ])
+
+    def test_no_merge(self):
+        paths = self._run(0, 'unmerged.json', merge=False)
+        self.assertEqual(
+            [shard_path(os.path.join(self.get_temp_dir(), 'unmerged.json'), i,
+                        4) for i in range(4)], paths)
+        lines = []
+        for path in paths:
+            with open(path) as f:
+                lines.extend(f.read().split())
+        self.assertEqual([str(x) for x in range(10)], lines)
+
+    def test_merge_gzip_shards(self):
+        temp_dir = self.get_temp_dir()
+        output_path = os.path.join(temp_dir, 'gzipped.json.gz')
+
+        class GzipShards(ShardedInference):
+            def _run_shards(self, shards, paths):
+                for mmsis, path in zip(shards, paths):
+                    with gzip.open(path, 'wb') as f:
+                        for mmsi in mmsis:
+                            f.write(('%s\n' % mmsi).encode('utf-8'))
+
+        paths = GzipShards(_CONFIG, 3).run(list(range(10)), output_path)
+        self.assertEqual([output_path], paths)
+        with gzip.open(output_path, 'rb') as f:
+            self.assertEqual([str(x) for x in range(10)],
+                             f.read().decode('utf-8').split())
+
+    def test_failed_shards_retried(self):
+        paths = self._run(2, 'retried.json')
+        with open(paths[0]) as f:
+            self.assertEqual([str(x) for x in range(10)], f.read().split())
+
+    def test_gives_up_after_max_retries(self):
+        with self.assertRaises(RuntimeError):
+            self._run(2, 'failed.json', max_retries=1)
+
+
+if __name__ == '__main__':
+    tf.test.main()
@@ -0,0 +1,125 @@
+# Copyright 2017 Google Inc. and Skytruth Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+""" Synthetic vessel feature files and metadata for benchmarks."""
+from __future__ import absolute_import
+import datetime
+import os
+import numpy as np
+import pytz
+import tensorflow as tf
+
+from . import utility
+
+# 2015-01-01T00:00:00Z
+START_TIME = 1420070400
+FIRST_MMSI = 100000001
+# Mean seconds between AIS points.
+MEAN_POINT_INTERVAL = 300.0
+
+
+def synthetic_vessel_features(random_state, num_points, num_features,
+                              start_time=START_TIME):
+    """ Random movement features for one vessel.
+
+    Returns:
+        A float32 [num_points, num_features] array, with increasing
+        timestamps in column 0.
+    """
+    features = random_state.randn(num_points, num_features).astype(np.float32)
+    gaps = random_state.exponential(MEAN_POINT_INTERVAL, size=num_points)
+    features[:, 0] = start_time + np.cumsum(gaps)
+    return features
+
+
+def serialize_vessel(mmsi, features):
+    example = tf.train.SequenceExample()
+    example.context.feature['mmsi'].int64_list.value.append(mmsi)
+    feature_list = example.feature_lists.feature_list['movement_features']
+    for point in features:
+        feature_list.feature.add().float_list.value.extend(point)
+    return example.SerializeToString()
+
+
+def write_synthetic_features(output_path,
+                             num_vessels,
+                             num_features,
+                             mean_points=5000,
+                             min_points=100,
+                             max_points=100000,
+                             seed=0):
+    """ Write `<mmsi>.tfrecord` feature files for synthetic vessels.
+
+    Track lengths are log-normally distributed around `mean_points`, like
+    real AIS tracks: most vessels have few points and a few have very many.
+
+    Args:
+        output_path: directory to write the feature files to.
+        num_vessels: the number of vessels.
+        num_features: the depth of the features, including the timestamp.
+        mean_points: the median number of points per vessel.
+        min_points, max_points: bounds on the number of points per vessel.
+        seed: random seed, so runs are reproducible.
+
+    Returns:
+        A list of `(mmsi, first_timestamp, last_timestamp)` for each vessel.
+    """
+    random_state = np.random.RandomState(seed)
+    if not os.path.exists(output_path):
+        os.makedirs(output_path)
+    lengths = np.clip(
+        random_state.lognormal(np.log(mean_points), 1.0, size=num_vessels),
+        min_points, max_points).astype(int)
+    vessels = []
+    for i, num_points in enumerate(lengths):
+        mmsi = FIRST_MMSI + i
+        features = synthetic_vessel_features(random_state, num_points,
+                                             num_features)
+        path = os.path.join(output_path, '%d.tfrecord' % mmsi)
+        with tf.python_io.TFRecordWriter(path) as writer:
+            writer.write(serialize_vessel(mmsi, features))
+        vessels.append((mmsi, int(features[0, 0]), int(features[-1, 0])))
+    return vessels
+
+
+def synthetic_vessel_metadata(vessels, test_fraction=0.25, seed=0):
+    """ Random labels and fishing ranges for `write_synthetic_features` vessels.
+
+    Returns:
+        A VesselMetadata object, keyed on string mmsis like the metadata files.
+    """
+    random_state = np.random.RandomState(seed)
+    labels = [name for (name, _) in utility.VESSEL_CATEGORIES]
+    metadata = {utility.TRAINING_SPLIT: {}, utility.TEST_SPLIT: {}}
+    fishing_ranges = {}
+    for mmsi, first, last in vessels:
+        split = (utility.TEST_SPLIT if random_state.uniform() < test_fraction
+                 else utility.TRAINING_SPLIT)
+        row = {
+            'label': labels[random_state.randint(len(labels))],
+            'length': str(random_state.uniform(10, 100)),
+            'tonnage': str(random_state.uniform(50, 5000)),
+            'engine_power': str(random_state.uniform(100, 5000)),
+            'crew_size': str(random_state.randint(1, 40)),
+        }
+        metadata[split][str(mmsi)] = (row, 1.0)
+        ranges = []
+        bounds = np.sort(random_state.uniform(first, last, size=8))
+        for start, end in bounds.reshape([-1, 2]):
+            ranges.append(
+                utility.FishingRange(
+                    datetime.datetime.fromtimestamp(start, pytz.utc),
+                    datetime.datetime.fromtimestamp(end, pytz.utc),
+                    float(random_state.randint(2))))
+        fishing_ranges[str(mmsi)] = ranges
+    return utility.VesselMetadata(metadata, fishing_ranges)
@@ -31,6 +31,11 @@ import tensorflow.contrib.metrics as metrics
 MIN_TEST_EXAMPLES = 3200
 MAX_TEST_EXAMPLES = 12800
 
+# Input pipelines for `Trainer`: the queue runner based readers, or
+# tf.contrib.data.
+QUEUE_PIPELINE = 'queue'
+DATASET_PIPELINE = 'dataset'
+
 
 class Trainer:
     """ Handles the mechanics of training and evaluating a vessel behaviour
@@ -38,12 +43,20 @@ class Trainer:
     """
 
     num_parallel_readers = 32
+    num_prefetch_batches = 2
+    queue_capacity = 1000
+    num_slices_per_mmsi = 8
 
     # TODO:  Pass in training verbosity flag
-    def __init__(self, model, base_feature_path, train_scratch_path):
+    def __init__(self, model, base_feature_path, train_scratch_path,
+                 feature_store=None, input_pipeline=QUEUE_PIPELINE):
+        if input_pipeline not in (QUEUE_PIPELINE, DATASET_PIPELINE):
+            raise ValueError('Unknown input pipeline: %s' % input_pipeline)
         self.model = model
+        self.input_pipeline = input_pipeline
         self.training_objectives = model.training_objectives
         self.base_feature_path = base_feature_path
+        self.feature_store = feature_store
         self.train_scratch_path = train_scratch_path
         self.checkpoint_dir = self.train_scratch_path + '/train'
         self.eval_dir = self.train_scratch_path + '/eval'
@@ -71,21 +84,39 @@ class Trainer:
                 4. A tensor of mmsis for the features, of dimesion [batch_size].
 
         """
-        input_files = self.model.build_training_file_list(
-            self.base_feature_path, split)
-        filename_queue = tf.train.input_producer(input_files, shuffle=True)
-        capacity = 1000
+        if self.feature_store is None:
+            inputs = self.model.build_training_file_list(
+                self.base_feature_path, split)
+        else:
+            inputs = self.model.build_training_mmsi_list(split)
+        capacity = self.queue_capacity
         min_size_after_deque = capacity - self.model.batch_size * 4
+        if self.input_pipeline == DATASET_PIPELINE:
+            return self._dataset_feature_data_reader(
+                inputs, min_size_after_deque) + (len(inputs), )
+
+        input_queue = tf.train.input_producer(inputs, shuffle=True)
 
         readers = []
         for _ in range(self.num_parallel_readers):
-            readers.append(
-                utility.random_feature_cropping_file_reader(
-                    self.model.vessel_metadata, filename_queue,
+            if self.feature_store is None:
+                reader = utility.random_feature_cropping_file_reader(
+                    self.model.vessel_metadata, input_queue,
                     self.model.num_feature_dimensions + 1, self.model.
                     max_window_duration_seconds, self.model.window_max_points,
                     self.model.min_viable_timeslice_length,
-                    self.model.use_ranges_for_training))
+                    self.model.use_ranges_for_training,
+                    num_slices_per_mmsi=self.num_slices_per_mmsi)
+            else:
+                reader = utility.random_feature_cropping_store_reader(
+                    self.model.vessel_metadata, input_queue,
+                    self.feature_store,
+                    self.model.max_window_duration_seconds,
+                    self.model.window_max_points,
+                    self.model.min_viable_timeslice_length,
+                    self.model.use_ranges_for_training,
+                    num_slices_per_mmsi=self.num_slices_per_mmsi)
+            readers.append(reader)
 
         (features, timestamps, time_bounds,
          mmsis) = tf.train.shuffle_batch_join(
@@ -99,7 +130,47 @@ class Trainer:
                  self.model.num_feature_dimensions
              ], [self.model.window_max_points], [2], []])
 
-        return features, timestamps, time_bounds, mmsis, len(input_files)
+        return features, timestamps, time_bounds, mmsis, len(inputs)
+
+    def _dataset_feature_data_reader(self, inputs, shuffle_buffer_size):
+        """ As `_feature_data_reader`, using tf.contrib.data.
+
+        Returns:
+            The batched `(features, timestamps, time_bounds, mmsis)` tensors.
+        """
+        dataset = utility.random_feature_cropping_dataset(
+            self.model.vessel_metadata,
+            inputs,
+            self.model.num_feature_dimensions + 1,
+            self.model.max_window_duration_seconds,
+            self.model.window_max_points,
+            self.model.min_viable_timeslice_length,
+            self.model.use_ranges_for_training,
+            store=self.feature_store,
+            num_parallel_calls=self.num_parallel_readers,
+            num_slices_per_mmsi=self.num_slices_per_mmsi)
+        dataset = dataset.shuffle(shuffle_buffer_size).batch(
+            self.model.batch_size)
+        # An identity map with an output buffer prefetches batches, so the
+        # next ones are assembled while the model runs.
+        dataset = dataset.map(
+            lambda *batch: batch,
+            num_threads=1,
+            output_buffer_size=self.num_prefetch_batches)
+
+        features, timestamps, time_bounds, mmsis = (
+            dataset.make_one_shot_iterator().get_next())
+        # The dataset repeats forever, so every batch is full.
+        batch_size = self.model.batch_size
+        features.set_shape([
+            batch_size, 1, self.model.window_max_points,
+            self.model.num_feature_dimensions
+        ])
+        timestamps.set_shape([batch_size, self.model.window_max_points])
+        time_bounds.set_shape([batch_size, 2])
+        mmsis.set_shape([batch_size])
+
+        return features, timestamps, time_bounds, mmsis
 
     def _make_saver(self):
         return tf.train.Saver(
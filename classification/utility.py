@@ -13,6 +13,7 @@
 # limitations under the License.
 
 from collections import defaultdict, namedtuple
+import calendar
 import csv
 import datetime
 import dateutil.parser
@@ -235,6 +236,19 @@ def single_feature_file_reader(filename_queue, num_features):
     reader = tf.TFRecordReader()
     _, serialized_example = reader.read(filename_queue)
 
+    return parse_feature_example(serialized_example, num_features)
+
+
+def parse_feature_example(serialized_example, num_features):
+    """ Parse a serialized vessel SequenceExample.
+
+    Args:
+        serialized_example: a scalar string tensor.
+        num_features: the depth of the features.
+
+    Returns:
+        As for `single_feature_file_reader`.
+    """
     # The serialized example is converted back to actual values.
     context_features, sequence_features = tf.parse_single_sequence_example(
         serialized_example,
@@ -508,7 +522,8 @@ def random_feature_cropping_file_reader(vessel_metadata,
                                         max_time_delta,
                                         window_size,
                                         min_timeslice_size,
-                                        select_ranges=False):
+                                        select_ranges=False,
+                                        num_slices_per_mmsi=8):
     """ Set up a file reader and training feature extractor for the files in a queue.
 
     As a training feature extractor, this pulls sets of random timeslices from the
@@ -523,6 +538,8 @@ def random_feature_cropping_file_reader(vessel_metadata,
         min_timeslice_size: the minimum number of points in a timeslice for the
                             series to be considered meaningful.
         select_ranges: bool; should we choose ranges based on fishing_range_map
+        num_slices_per_mmsi: the number of windows drawn each time a vessel is
+            read.
     Returns:
         A tuple comprising, for the n samples drawn for each vessel:
             1. A tensor of the feature timeslices drawn, of dimension
@@ -536,14 +553,325 @@ def random_feature_cropping_file_reader(vessel_metadata,
 
     movement_features = sequence_features['movement_features']
     int_mmsi = tf.cast(context_features['mmsi'], tf.int64)
-    random_state = np.random.RandomState()
-
-    num_slices_per_mmsi = 8
+    extract = _random_feature_extractor(vessel_metadata, max_time_delta,
+                                        window_size, min_timeslice_size,
+                                        num_slices_per_mmsi)
 
     def replicate_extract(input, int_mmsi):
-        # Extract several random windows from each vessel track
         # TODO: Fix feature generation so it returns strings directly
         mmsi = vessel_metadata.mmsi_map_int2str[int_mmsi]
+        return extract(input, mmsi)
+
+    (features_list, timestamps, time_bounds_list, mmsis) = tf.py_func(
+        replicate_extract, [movement_features, int_mmsi],
+        [tf.float32, tf.int32, tf.int32, tf.string])
+
+    return features_list, timestamps, time_bounds_list, mmsis
+
+
+def random_feature_cropping_store_reader(vessel_metadata,
+                                         mmsi_queue,
+                                         store,
+                                         max_time_delta,
+                                         window_size,
+                                         min_timeslice_size,
+                                         select_ranges=False,
+                                         num_slices_per_mmsi=8):
+    """ As `random_feature_cropping_file_reader`, but reading from a store.
+
+    Args:
+        vessel_metadata: VesselMetadata object
+        mmsi_queue: a queue of the (string) mmsis to read.
+        store: a `feature_store.FeatureStore` holding the vessel features.
+        max_time_delta: the maximum duration of the returned timeseries in seconds.
+        window_size: the number of points in the window
+        min_timeslice_size: the minimum number of points in a timeslice for the
+                            series to be considered meaningful.
+        select_ranges: bool; should we choose ranges based on fishing_range_map
+        num_slices_per_mmsi: the number of windows drawn each time a vessel is
+            read.
+    Returns:
+        As for `random_feature_cropping_file_reader`.
+    """
+    extract = _random_feature_extractor(vessel_metadata, max_time_delta,
+                                        window_size, min_timeslice_size,
+                                        num_slices_per_mmsi)
+
+    def replicate_extract(mmsi):
+        _, sequence_features = store.get(mmsi)
+        return extract(sequence_features['movement_features'], mmsi)
+
+    (features_list, timestamps, time_bounds_list, mmsis) = tf.py_func(
+        replicate_extract, [mmsi_queue.dequeue()],
+        [tf.float32, tf.int32, tf.int32, tf.string])
+
+    return features_list, timestamps, time_bounds_list, mmsis
+
+
+def _tf_searchsorted(sorted_values, values, side='left'):
+    """ As `np.searchsorted`, for a 1d tensor of values.
+
+    Tensorflow has no searchsorted op, so every pair is compared; the cost is
+    linear in the length of `sorted_values`.
+    """
+    compare = tf.less if side == 'left' else tf.less_equal
+    return tf.reduce_sum(
+        tf.cast(
+            compare(sorted_values[tf.newaxis, :], values[:, tf.newaxis]),
+            tf.int32),
+        axis=1)
+
+
+def _tf_uniform_int(low, high):
+    """ Random int32s in [low, high), or low where high <= low."""
+    u = tf.random_uniform(tf.shape(low), dtype=tf.float64)
+    return low + tf.cast(
+        tf.floor(u * tf.cast(tf.maximum(high - low, 0), tf.float64)), tf.int32)
+
+
+def _vessel_range_arrays(vessel_metadata):
+    """ The fishing ranges of each vessel, as arrays for `tf` lookups.
+
+    Returns:
+        int_mmsis: the sorted int mmsis of the vessels.
+        mmsis: the string mmsi of each vessel.
+        offsets: the ranges of vessel i are [offsets[i], offsets[i + 1]).
+        range_starts, range_ends: the ranges, in seconds since the epoch.
+    """
+    epoch = datetime.datetime(1970, 1, 1, tzinfo=pytz.utc)
+    int_mmsis = sorted(vessel_metadata.mmsi_map_int2str)
+    mmsis = [vessel_metadata.mmsi_map_int2str[x] for x in int_mmsis]
+    offsets = [0]
+    range_starts = []
+    range_ends = []
+    for mmsi in mmsis:
+        for x in vessel_metadata.fishing_ranges_map.get(mmsi, []):
+            range_starts.append((x.start_time - epoch).total_seconds())
+            range_ends.append((x.end_time - epoch).total_seconds())
+        offsets.append(len(range_starts))
+    return (np.array(int_mmsis, dtype=np.int64), np.array(mmsis),
+            np.array(offsets, dtype=np.int32),
+            np.array(range_starts, dtype=np.float64),
+            np.array(range_ends, dtype=np.float64))
+
+
+def _tf_fixed_points_bounds(times, count, window_size, range_starts,
+                            range_ends):
+    """ As `np_array_random_fixed_points_extract`, returning the start and
+    end indices of `count` crops.
+
+    Choosing the first usable range of a random permutation is the same as
+    choosing a random usable range, which is done here. Without one a
+    window is drawn from the whole track.
+    """
+    n = tf.shape(times)[0]
+    starts = _tf_searchsorted(times, range_starts, 'left')
+    ends = _tf_searchsorted(times, range_ends, 'right')
+    min_start = tf.maximum(starts - window_size + 1, 0)
+    max_start = tf.minimum(tf.minimum(ends + window_size, n - 1),
+                           n - window_size)
+    usable = tf.logical_and(ends > starts, max_start > min_start)
+    # Usable ranges score in [1, 2) and the whole track 0.5, so each crop
+    # takes a random usable range if there is one.
+    num_ranges = tf.shape(starts)[0]
+    scores = tf.concat([
+        tf.where(
+            tf.tile(usable[tf.newaxis], [count, 1]),
+            1 + tf.random_uniform([count, num_ranges]),
+            -tf.ones([count, num_ranges])), 0.5 * tf.ones([count, 1])
+    ], 1)
+    choice = tf.argmax(scores, axis=1)
+    low = tf.gather(tf.concat([min_start, tf.zeros([1], tf.int32)], 0),
+                    choice)
+    high = tf.gather(
+        tf.concat([max_start, tf.reshape(n - window_size, [1])], 0), choice)
+    start = _tf_uniform_int(low, high)
+    return start, start + tf.minimum(window_size, n)
+
+
+def _tf_fixed_time_bounds(times, count, window_size, max_time_delta,
+                          min_timeslice_size):
+    """ As `np_array_random_fixed_time_extract`, returning the start and end
+    indices of `count` crops."""
+    trials = 128
+    n = tf.shape(times)[0]
+    start_time = times[0]
+    end_time = times[-1]
+    max_time_offset = tf.maximum(end_time - start_time - max_time_delta, 0)
+
+    def too_short(start, end):
+        return end - start < min_timeslice_size
+
+    def trial(i, start, end):
+        time_offset = tf.floor(
+            tf.random_uniform([count], dtype=tf.float64) *
+            (max_time_offset + 1))
+        new_start = _tf_searchsorted(times, start_time + time_offset)
+        new_start = tf.minimum(new_start,
+                               tf.maximum(0, n - min_timeslice_size))
+        crop_end_time = tf.minimum(
+            tf.gather(times, new_start) + max_time_delta, end_time)
+        new_end = tf.minimum(new_start + window_size,
+                             _tf_searchsorted(times, crop_end_time, 'right'))
+        # Only crops that are still too short are retried.
+        retry = too_short(start, end)
+        return (i + 1, tf.where(retry, new_start, start),
+                tf.where(retry, new_end, end))
+
+    def keep_trying(i, start, end):
+        return tf.logical_and(i < trials,
+                              tf.reduce_any(too_short(start, end)))
+
+    _, start, end = tf.while_loop(
+        keep_trying, trial,
+        [0, tf.zeros([count], tf.int32), -tf.ones([count], tf.int32)])
+    return start, end
+
+
+def _tf_random_windows(movement_features, count, window_size, max_time_delta,
+                       min_timeslice_size, range_starts, range_ends):
+    """ As `np_array_extract_n_random_features`, for one track tensor,
+    without the mmsis."""
+    times = tf.cast(movement_features[:, 0], tf.float64)
+    if max_time_delta == 0:
+        start, end = _tf_fixed_points_bounds(times, count, window_size,
+                                             range_starts, range_ends)
+    else:
+        start, end = _tf_fixed_time_bounds(times, count, window_size,
+                                           max_time_delta, min_timeslice_size)
+    # Short crops are repeated to fill the window, as `np_pad_repeat_slice`.
+    indices = start[:, tf.newaxis] + (
+        tf.range(window_size)[tf.newaxis, :] % (end - start)[:, tf.newaxis])
+    features = tf.gather(movement_features, indices)
+    timestamps = tf.cast(features[:, :, 0], tf.int32)
+    time_bounds = tf.cast(
+        tf.stack([features[:, 0, 0], features[:, -1, 0]], axis=1), tf.int32)
+    return features[:, tf.newaxis, :, 1:], timestamps, time_bounds
+
+
+def random_feature_cropping_dataset(vessel_metadata,
+                                    inputs,
+                                    num_features,
+                                    max_time_delta,
+                                    window_size,
+                                    min_timeslice_size,
+                                    select_ranges=False,
+                                    store=None,
+                                    num_parallel_calls=32,
+                                    num_slices_per_mmsi=8):
+    """ A `tf.contrib.data` alternative to the cropping readers.
+
+    Files (or, with a store, mmsis) are read in shuffled order, repeating
+    forever. Reading, parsing and the random window cropping of each vessel
+    all run on `num_parallel_calls` threads, in Tensorflow ops rather than
+    `py_func`s, so they aren't serialized by the GIL. Only reading from a
+    store is Python, and that is a slice of its memory map. Cropping draws
+    windows as `np_array_extract_features` does.
+
+    Feature files must hold a single uncompressed vessel record, as
+    written by the feature pipeline.
+
+    Args:
+        vessel_metadata: VesselMetadata object
+        inputs: a list of feature file paths, or of (string) mmsis if `store`
+            is given.
+        num_features: the depth of the features, including the timestamp.
+        max_time_delta: the maximum duration of the returned timeseries in seconds.
+        window_size: the number of points in the window
+        min_timeslice_size: the minimum number of points in a timeslice for the
+                            series to be considered meaningful.
+        select_ranges: bool; should we choose ranges based on fishing_range_map
+        store: if not None, a `feature_store.FeatureStore` to read from.
+        num_parallel_calls: the number of threads reading and cropping
+            vessels.
+        num_slices_per_mmsi: the number of windows drawn each time a vessel is
+            read.
+    Returns:
+        A `Dataset` of single `(features, timestamps, time_bounds, mmsi)`
+        windows, with the shapes of the elements of the cropping readers.
+    """
+    Dataset = tf.contrib.data.Dataset
+    # Lookups are done against constants, since a one shot iterator can't
+    # hold tables.
+    (int_mmsis, mmsis, offsets, range_starts,
+     range_ends) = _vessel_range_arrays(vessel_metadata)
+    int_mmsis = tf.constant(int_mmsis)
+    mmsis = tf.constant(mmsis)
+    offsets = tf.constant(offsets)
+    range_starts = tf.constant(range_starts)
+    range_ends = tf.constant(range_ends)
+
+    dataset = Dataset.from_tensor_slices(tf.constant(inputs)).shuffle(
+        len(inputs)).repeat()
+
+    def check_found(i, found, mmsi):
+        check = tf.Assert(found, [mmsi], name='check_mmsi_in_metadata')
+        with tf.control_dependencies([check]):
+            return tf.identity(i)
+
+    if store is None:
+
+        def read(path):
+            contents = tf.read_file(path)
+            # Strip the TFRecord framing: an 8 byte length and 4 byte CRC
+            # before the record.
+            length = tf.decode_raw(tf.substr(contents, 0, 8), tf.int64)[0]
+            serialized_example = tf.substr(contents, 12,
+                                           tf.cast(length, tf.int32))
+            context_features, sequence_features = parse_feature_example(
+                serialized_example, num_features)
+            int_mmsi = context_features['mmsi']
+            i = _tf_searchsorted(int_mmsis, tf.reshape(int_mmsi, [1]))[0]
+            i = tf.minimum(i, tf.size(int_mmsis) - 1)
+            return sequence_features['movement_features'], check_found(
+                i, tf.equal(int_mmsis[i], int_mmsi), int_mmsi)
+    else:
+
+        def read_store(mmsi):
+            _, sequence_features = store.get(mmsi)
+            return np.asarray(sequence_features['movement_features'],
+                              dtype=np.float32)
+
+        def read(mmsi):
+            movement_features = tf.py_func(read_store, [mmsi], tf.float32)
+            movement_features.set_shape([None, num_features])
+            matches = tf.equal(mmsis, mmsi)
+            i = tf.cast(tf.argmax(tf.cast(matches, tf.int32), axis=0),
+                        tf.int32)
+            return movement_features, check_found(i, tf.reduce_any(matches),
+                                                  mmsi)
+
+    def crop(input):
+        movement_features, i = read(input)
+        features, timestamps, time_bounds = _tf_random_windows(
+            movement_features, num_slices_per_mmsi, window_size,
+            max_time_delta, min_timeslice_size,
+            range_starts[offsets[i]:offsets[i + 1]],
+            range_ends[offsets[i]:offsets[i + 1]])
+        features.set_shape(
+            [num_slices_per_mmsi, 1, window_size, num_features - 1])
+        timestamps.set_shape([num_slices_per_mmsi, window_size])
+        time_bounds.set_shape([num_slices_per_mmsi, 2])
+        vessel_mmsis = tf.tile(tf.reshape(mmsis[i], [1]),
+                               [num_slices_per_mmsi])
+        return features, timestamps, time_bounds, vessel_mmsis
+
+    dataset = dataset.map(
+        crop,
+        num_threads=num_parallel_calls,
+        output_buffer_size=2 * num_parallel_calls)
+
+    # Each vessel gives several windows; emit them one at a time.
+    return dataset.flat_map(
+        lambda *windows: Dataset.from_tensor_slices(windows))
+
+
+def _random_feature_extractor(vessel_metadata, max_time_delta, window_size,
+                              min_timeslice_size, num_slices_per_mmsi):
+    random_state = np.random.RandomState()
+
+    def extract(input, mmsi):
+        # Extract several random windows from each vessel track
         if mmsi in vessel_metadata.fishing_ranges_map:
             ranges = vessel_metadata.fishing_ranges_map[mmsi]
         else:
@@ -553,11 +881,7 @@ def random_feature_cropping_file_reader(vessel_metadata,
             random_state, input, num_slices_per_mmsi, max_time_delta,
             window_size, min_timeslice_size, mmsi, ranges)
 
-    (features_list, timestamps, time_bounds_list, mmsis) = tf.py_func(
-        replicate_extract, [movement_features, int_mmsi],
-        [tf.float32, tf.int32, tf.int32, tf.string])
-
-    return features_list, timestamps, time_bounds_list, mmsis
+    return extract
 
 
 def np_array_extract_slices_for_time_ranges(
@@ -586,42 +910,26 @@ def np_array_extract_slices_for_time_ranges(
         4. A numpy array with an int64 mmsi for each slice, of dimension [n].
 
     """
-    slices = []
     times = input_series[:, 0]
-    for (start_time, end_time) in time_ranges:
-        start_index = np.searchsorted(times, start_time, side='left')
-        end_index = np.searchsorted(times, end_time, side='left')
-        length = end_index - start_index
-
-        # Slice out the time window.
-        cropped = input_series[start_index:end_index]
-
-        # If this window is too long, pick a random subwindow.
-        if (length > window_size):
-            max_offset = length - window_size
-            start_offset = random_state.uniform(max_offset)
-            cropped = cropped[max_offset:max_offset + window_size]
-
-        if len(cropped) >= min_points_for_classification:
-            output_slice = np_pad_repeat_slice(cropped, window_size)
-
-            time_bounds = np.array([start_time, end_time], dtype=np.int32)
-
-            without_timestamp = output_slice[:, 1:]
-            timeseries = output_slice[:, 0].astype(np.int32)
-            slices.append(
-                (np.stack([without_timestamp]), timeseries, time_bounds, mmsi))
-
-    # if slices == []:
-    #     # Return an appropriately shaped empty numpy array.
-    #     return (np.empty(
-    #         [0, 1, window_size, num_features_inc_timestamp - 1],
-    #         dtype=np.float32), np.empty(
-    #             shape=[0, window_size], dtype=np.int32), np.empty(
-    #                 shape=[0, 2], dtype=np.int32), np.empty(
-    #                     shape=[0], dtype=np.int64))
-
-    return zip(*slices)
+    time_ranges = np.asarray(time_ranges).reshape([-1, 2])
+    bounds = np.searchsorted(
+        times, time_ranges.ravel(), side='left').reshape([-1, 2])
+    # If a window is too long, use its last window_size points; if it is too
+    # short, repeat it to fill window_size points.
+    lengths = np.minimum(bounds[:, 1] - bounds[:, 0], window_size)
+    mask = lengths >= max(min_points_for_classification, 1)
+    used_lengths = lengths[mask]
+    offsets = bounds[mask, 1] - used_lengths
+    indices = offsets[:, np.newaxis] + (
+        np.arange(window_size)[np.newaxis, :] % used_lengths[:, np.newaxis])
+    output_slices = input_series[indices]
+
+    features = output_slices[:, np.newaxis, :, 1:]
+    timeseries = output_slices[:, :, 0].astype(np.int32)
+    time_bounds = time_ranges[mask].astype(np.int32)
+    mmsis = np.repeat(np.asarray(mmsi)[np.newaxis], len(offsets))
+
+    return features, timeseries, time_bounds, mmsis
 
 
 def cropping_all_slice_feature_file_reader(filename_queue, num_features,
@@ -669,25 +977,25 @@ def cropping_all_slice_feature_file_reader(filename_queue, num_features,
 
 def np_array_extract_all_fixed_slices(input_series, num_features, mmsi,
                                       window_size, shift):
-    slices = []
+    """ Extract every fixed length window, stepping back from the end.
+
+    Windows end at len(input_series), len(input_series) - shift, ... and are
+    returned in that order. The features are a single strided view onto
+    `input_series`, so nothing is copied until the windows are batched.
+
+    Returns:
+        A tuple of:
+          1. The features, without timestamps, of dimension
+             [n, 1, window_size, num_features - 1].
+          2. The int32 timestamps of each window, of dimension [n, window_size].
+          3. The int32 time bounds of each window, of dimension [n, 2].
+          4. The mmsi of each window, of dimension [n].
+    """
+    input_series = np.asarray(input_series)
     input_length = len(input_series)
-    for end_index in range(input_length, 0, -shift):
-        start_index = end_index - window_size
-        if start_index < 0:
-            continue
-        cropped = input_series[start_index:end_index]
-        start_time = int(cropped[0][0])
-        end_time = int(cropped[-1][0])
-        time_bounds = np.array([start_time, end_time], dtype=np.int32)
-
-        assert len(cropped) == window_size
-        output_slice = cropped
-        without_timestamp = output_slice[:, 1:]
-        timeseries = output_slice[:, 0].astype(np.int32)
-        slices.append(
-            (np.stack([without_timestamp]), timeseries, time_bounds, mmsi))
-
-    if slices == []:
+    count = max(0, (input_length - window_size) // shift + 1)
+
+    if count == 0:
         # Return an appropriately shaped empty numpy array.
         return (np.empty(
             [0, 1, window_size, input_series.shape[1] - 1], dtype=np.float32),
@@ -696,7 +1004,21 @@ def np_array_extract_all_fixed_slices(input_series, num_features, mmsi,
                         shape=[0, 2], dtype=np.int32), np.empty(
                             shape=[0], dtype=np.int64))
 
-    return zip(*slices)
+    # The earliest window starts here; later windows are `shift` points on.
+    first_start = input_length - window_size - (count - 1) * shift
+    row_stride, column_stride = input_series.strides
+    windows = np.lib.stride_tricks.as_strided(
+        input_series[first_start:],
+        shape=[count, window_size, input_series.shape[1]],
+        strides=[shift * row_stride, row_stride, column_stride])[::-1]
+
+    features = windows[:, np.newaxis, :, 1:]
+    timestamps = windows[:, :, 0].astype(np.int32)
+    time_bounds = np.stack([windows[:, 0, 0], windows[:, -1, 0]],
+                           axis=1).astype(np.int32)
+    mmsis = np.repeat(np.asarray(mmsi)[np.newaxis], count)
+
+    return features, timestamps, time_bounds, mmsis
 
 
 
@@ -771,6 +1093,77 @@ def int_or_hash(x):
     except:
         return hash(x)
 
+class FishingRangeIndex(object):
+    """ Fishing ranges compiled into sorted arrays for batch label lookup.
+
+    Each vessel's ranges are flattened into a piecewise-constant labelling:
+    the sorted boundary times of its ranges and the label that applies from
+    each boundary until the next (-1 where no range applies, later ranges
+    overriding earlier ones, as `FishingRange` lists are read in order).
+    The per-vessel arrays are concatenated, keyed on
+    `vessel_index * _VESSEL_STRIDE + timestamp`, so a whole batch is
+    labelled with a single `np.searchsorted`.
+    """
+    _VESSEL_STRIDE = 1 << 34
+    _TIME_OFFSET = 1 << 33
+
+    def __init__(self, fishing_ranges_map):
+        self.vessel_index = {}
+        keys = []
+        values = []
+        for i, (mmsi, ranges) in enumerate(fishing_ranges_map.items()):
+            self.vessel_index[mmsi] = i
+            starts = np.array(
+                [calendar.timegm(r.start_time.utctimetuple()) for r in ranges],
+                dtype=np.int64)
+            # Ranges are inclusive, so the label changes after the end time.
+            ends = np.array(
+                [calendar.timegm(r.end_time.utctimetuple()) + 1
+                 for r in ranges],
+                dtype=np.int64)
+            boundaries = np.unique(np.concatenate([starts, ends]))
+            labels = np.empty(len(boundaries), dtype=np.float32)
+            labels.fill(-1.0)
+            first = np.searchsorted(boundaries, starts)
+            last = np.searchsorted(boundaries, ends)
+            for b, e, r in zip(first, last, ranges):
+                labels[b:e] = r.is_fishing
+            base = i * self._VESSEL_STRIDE + self._TIME_OFFSET
+            # A leading entry covers times before this vessel's first range.
+            keys.append(np.array([i * self._VESSEL_STRIDE], dtype=np.int64))
+            keys.append(base + boundaries)
+            values.append(np.array([-1.0], dtype=np.float32))
+            values.append(labels)
+        self.keys = np.concatenate(keys or [np.zeros([0], dtype=np.int64)])
+        self.values = np.concatenate(
+            values or [np.zeros([0], dtype=np.float32)])
+
+    def dense_labels(self, mmsis, timestamps):
+        """ Per-point fishing labels for a batch.
+
+        Args:
+            mmsis: [batch] vessel identifiers, as keys of the ranges map.
+            timestamps: [batch, width] timestamps in seconds since the epoch.
+
+        Returns:
+            float32 [batch, width] labels: the `is_fishing` value of the range
+            covering each point, or -1 if there is none.
+        """
+        timestamps = np.asarray(timestamps, dtype=np.int64)
+        indices = np.array(
+            [self.vessel_index.get(mmsi, -1) for mmsi in mmsis],
+            dtype=np.int64)
+        labels = np.empty(timestamps.shape, dtype=np.float32)
+        labels.fill(-1.0)
+        known = indices >= 0
+        if known.any():
+            queries = (indices[known, np.newaxis] * self._VESSEL_STRIDE +
+                       self._TIME_OFFSET + timestamps[known])
+            positions = np.searchsorted(self.keys, queries, side='right') - 1
+            labels[known] = self.values[positions]
+        return labels
+
+
 class VesselMetadata(object):
     def __init__(self,
                  metadata_dict,
@@ -779,11 +1172,18 @@ class VesselMetadata(object):
         self.metadata_by_split = metadata_dict
         self.metadata_by_mmsi = {}
         self.fishing_ranges_map = fishing_ranges_map
+        self.fishing_range_index = FishingRangeIndex(fishing_ranges_map)
         self.fishing_range_training_upweight = fishing_range_training_upweight
         for split, vessels in metadata_dict.iteritems():
             for mmsi, data in vessels.iteritems():
                 self.metadata_by_mmsi[mmsi] = data
         self.mmsi_map_int2str = {int_or_hash(k) : k for k in self.metadata_by_mmsi}
+        # Row 0 of the label arrays is reserved for unknown vessels.
+        self.mmsi_rows = {mmsi: i + 1
+                          for (i, mmsi) in enumerate(
+                              sorted(self.metadata_by_mmsi))}
+        self._multihot_labels = None
+        self._row_lookups = {}
 
 
         intersection_mmsis = set(self.metadata_by_mmsi.keys()).intersection(
@@ -803,6 +1203,59 @@ class VesselMetadata(object):
     def vessel_label(self, label_name, mmsi):
         return self.metadata_by_mmsi[mmsi][0][label_name]
 
+    def mmsi_row_lookup(self, mmsis):
+        """ Map a tensor of mmsis to rows of the precomputed label arrays.
+
+        Args:
+            mmsis: a tensor of mmsis, either strings or integers.
+
+        Returns:
+            An int64 tensor of the same shape holding each vessel's row in
+            `mmsi_rows`, or 0 for vessels without metadata.
+        """
+        if isinstance(mmsis, tf.Tensor) and mmsis in self._row_lookups:
+            # Objectives share one lookup for the same input tensor.
+            return self._row_lookups[mmsis]
+        key = mmsis
+        mmsis = tf.convert_to_tensor(mmsis)
+        if mmsis.dtype != tf.string:
+            mmsis = tf.as_string(mmsis)
+        keys = sorted(self.mmsi_rows, key=self.mmsi_rows.get)
+        table = tf.contrib.lookup.HashTable(
+            tf.contrib.lookup.KeyValueTensorInitializer(
+                tf.constant([str(k) for k in keys], dtype=tf.string),
+                tf.constant([self.mmsi_rows[k] for k in keys],
+                            dtype=tf.int64)),
+            default_value=0)
+        rows = table.lookup(mmsis)
+        if isinstance(key, tf.Tensor):
+            self._row_lookups[key] = rows
+        return rows
+
+    @property
+    def multihot_labels(self):
+        """ An int32 [len(mmsi_rows) + 1, num classes] array of the multihot
+        encoded 'label' of each vessel, indexed by `mmsi_rows`. Built on first
+        use, since not every model has vessel class labels.
+        """
+        if self._multihot_labels is None:
+            class_indices = {k[0]: i
+                             for (i, k) in enumerate(VESSEL_CATEGORIES)}
+            encoded = np.zeros(
+                [len(self.mmsi_rows) + 1, len(VESSEL_CLASS_DETAILED_NAMES)],
+                dtype=np.int32)
+            for mmsi, row in self.mmsi_rows.iteritems():
+                lbl_str = self.metadata_by_mmsi[mmsi][0].get('label',
+                                                             '').strip()
+                if lbl_str:
+                    for lbl in lbl_str.split('|'):
+                        # Use '|' rather than '+' since classes might not be
+                        # disjoint
+                        encoded[row] |= multihot_lookup_table[class_indices[
+                            lbl]]
+            self._multihot_labels = encoded
+        return self._multihot_labels
+
     def mmsis_for_split(self, split):
         assert split in [TRAINING_SPLIT, TEST_SPLIT]
         # Check to make sure we don't have leakage
@@ -84,6 +84,154 @@ class PythonFixedTimeExtractTest(tf.test.TestCase):
             self.assertAllEqual(res, expected_result)
 
 
+class PythonSlicesForTimeRangesTest(tf.test.TestCase):
+    def test_slices_for_time_ranges(self):
+        input_data = np.array([[10., 1.], [20., 2.], [30., 3.], [40., 4.],
+                               [50., 5.], [60., 6.], [70., 7.]],
+                              dtype=np.float32)
+        # Padded, cropped to the last points, and dropped as too short.
+        time_ranges = [(10, 35), (15, 80), (60, 65)]
+
+        features, timestamps, time_bounds, mmsis = (
+            utility.np_array_extract_slices_for_time_ranges(
+                None, input_data, 2, 123, time_ranges, 4, 2))
+
+        self.assertAllEqual(features, [[[[1.], [2.], [3.], [1.]]],
+                                       [[[4.], [5.], [6.], [7.]]]])
+        self.assertAllEqual(timestamps,
+                            [[10, 20, 30, 10], [40, 50, 60, 70]])
+        self.assertAllEqual(time_bounds, [[10, 35], [15, 80]])
+        self.assertAllEqual(mmsis, [123, 123])
+
+    def test_no_usable_time_ranges(self):
+        input_data = np.array([[10., 1.], [20., 2.]], dtype=np.float32)
+
+        features, timestamps, time_bounds, mmsis = (
+            utility.np_array_extract_slices_for_time_ranges(
+                None, input_data, 2, 123, [(100, 200)], 4, 1))
+
+        self.assertEqual(features.shape, (0, 1, 4, 1))
+        self.assertEqual(timestamps.shape, (0, 4))
+        self.assertEqual(time_bounds.shape, (0, 2))
+        self.assertEqual(mmsis.shape, (0, ))
+
+
+class PythonAllFixedSlicesTest(tf.test.TestCase):
+    def test_all_fixed_slices(self):
+        input_data = np.array([[10., 1.], [20., 2.], [30., 3.], [40., 4.],
+                               [50., 5.], [60., 6.], [70., 7.]],
+                              dtype=np.float32)
+
+        features, timestamps, time_bounds, mmsis = (
+            utility.np_array_extract_all_fixed_slices(input_data, 2, 123, 3,
+                                                      2))
+
+        self.assertAllEqual(features, [[[[5.], [6.], [7.]]],
+                                       [[[3.], [4.], [5.]]],
+                                       [[[1.], [2.], [3.]]]])
+        self.assertAllEqual(timestamps,
+                            [[50, 60, 70], [30, 40, 50], [10, 20, 30]])
+        self.assertAllEqual(time_bounds, [[50, 70], [30, 50], [10, 30]])
+        self.assertAllEqual(mmsis, [123, 123, 123])
+        self.assertEqual(timestamps.dtype, np.int32)
+        self.assertEqual(time_bounds.dtype, np.int32)
+
+    def test_all_fixed_slices_too_short(self):
+        input_data = np.array([[10., 1.], [20., 2.]], dtype=np.float32)
+
+        features, timestamps, time_bounds, mmsis = (
+            utility.np_array_extract_all_fixed_slices(input_data, 2, 123, 3,
+                                                      2))
+
+        self.assertEqual(features.shape, (0, 1, 3, 1))
+        self.assertEqual(timestamps.shape, (0, 3))
+        self.assertEqual(time_bounds.shape, (0, 2))
+        self.assertEqual(mmsis.shape, (0, ))
+
+
+class TensorflowRandomWindowsTest(tf.test.TestCase):
+    def _track(self, length):
+        times = np.arange(length, dtype=np.float32) + 1000
+        return np.stack([times, np.arange(length, dtype=np.float32) * 2],
+                        axis=1)
+
+    def _windows(self, track, count, window_size, max_time_delta=0,
+                 min_timeslice_size=1, ranges=()):
+        with self.test_session() as sess:
+            range_starts = tf.constant([x for (x, _) in ranges], tf.float64)
+            range_ends = tf.constant([x for (_, x) in ranges], tf.float64)
+            # Evaluated together, so all outputs come from the same crops.
+            return sess.run(utility._tf_random_windows(
+                tf.constant(track), count, window_size, max_time_delta,
+                min_timeslice_size, range_starts, range_ends))
+
+    def test_searchsorted(self):
+        sorted_values = np.array([1., 2., 2., 5.])
+        values = np.array([0., 2., 3., 6.])
+        with self.test_session():
+            for side in ['left', 'right']:
+                self.assertAllEqual(
+                    np.searchsorted(sorted_values, values, side=side),
+                    utility._tf_searchsorted(
+                        tf.constant(sorted_values), tf.constant(values),
+                        side).eval())
+
+    def test_short_track_repeated(self):
+        track = self._track(5)
+        features, timestamps, time_bounds = self._windows(track, 3, 8)
+        expected = utility.np_pad_repeat_slice(track, 8)
+        for i in range(3):
+            self.assertAllEqual(expected[:, 1:], features[i, 0])
+            self.assertAllEqual(expected[:, 0], timestamps[i])
+            self.assertAllEqual([1000, 1002], time_bounds[i])
+
+    def test_fixed_points_near_range(self):
+        track = self._track(100)
+        features, timestamps, _ = self._windows(
+            track, 50, 10, ranges=[(1040., 1045.)])
+        starts = timestamps[:, 0] - 1000
+        # As np_array_random_fixed_points_extract, starts are from
+        # range start - window_size + 1 up to range end + window_size.
+        self.assertTrue((starts >= 31).all(), starts)
+        self.assertTrue((starts < 56).all(), starts)
+        for start, window in zip(starts, features):
+            self.assertAllEqual(track[start:start + 10, 1:], window[0])
+
+    def test_fixed_time_within_delta(self):
+        track = self._track(100)
+        _, timestamps, _ = self._windows(
+            track, 50, 30, max_time_delta=20, min_timeslice_size=5)
+        for window in timestamps:
+            self.assertLessEqual(window.max() - window.min(), 20)
+            self.assertGreaterEqual(len(set(window)), 5)
+
+
+class FishingRangeIndexTest(tf.test.TestCase):
+    def test_dense_labels(self):
+        def dt(ts):
+            return datetime.utcfromtimestamp(ts)
+
+        ranges = {
+            '100001': [
+                utility.FishingRange(dt(10), dt(20), 1.0),
+                # Overlaps the previous range, and so overrides it.
+                utility.FishingRange(dt(15), dt(30), 0.0),
+            ],
+            '100002': [utility.FishingRange(dt(5), dt(5), 1.0)],
+        }
+        index = utility.FishingRangeIndex(ranges)
+        timestamps = np.array([[0, 10, 14, 15, 30, 31],
+                               [4, 5, 6, 10, 20, 30],
+                               [10, 15, 20, 25, 30, 35]], np.int32)
+
+        labels = index.dense_labels(['100001', '100002', '100003'],
+                                    timestamps)
+
+        self.assertAllEqual(
+            np.array([[-1, 1, 1, 0, 0, -1], [-1, 1, -1, -1, -1, -1],
+                      [-1, -1, -1, -1, -1, -1]], np.float32), labels)
+
+
 class VesselMetadataFileReaderTest(tf.test.TestCase):
     raw_lines = [
         'mmsi,label,length,split\n',
@@ -215,5 +363,28 @@ class MultihotLabelConsistencyTest(tf.test.TestCase):
             sorted(names), sorted(utility.VESSEL_CLASS_DETAILED_NAMES))
 
 
+class VesselMetadataLabelsTest(tf.test.TestCase):
+    def test_multihot_label_lookup(self):
+        (name_a, _), (name_b, _) = utility.VESSEL_CATEGORIES[:2]
+        vmd = utility.VesselMetadata({
+            'Training': {
+                '100001': ({'label': name_a}, 1.0),
+                '100002': ({'label': '%s|%s' % (name_a, name_b)}, 1.0),
+                '100003': ({'label': ''}, 1.0),
+            }
+        }, {})
+        table = utility.multihot_lookup_table
+        with self.test_session() as sess:
+            rows = vmd.mmsi_row_lookup(
+                tf.constant([100002, 100001, 100003, 999999], tf.int64))
+            labels = tf.gather(tf.constant(vmd.multihot_labels), rows)
+            sess.run(tf.tables_initializer())
+            result = labels.eval()
+        self.assertAllEqual(table[0] | table[1], result[0])
+        self.assertAllEqual(table[0], result[1])
+        self.assertAllEqual(np.zeros_like(table[0]), result[2])
+        self.assertAllEqual(np.zeros_like(table[0]), result[3])
+
+
 if __name__ == '__main__':
     tf.test.main()
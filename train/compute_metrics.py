@@ -28,6 +28,10 @@ from __future__ import absolute_import
 from __future__ import print_function
 import os
 import csv
+import glob
+import heapq
+import json
+import multiprocessing
 import subprocess
 import numpy as np
 import dateutil.parser
@@ -37,6 +41,7 @@ from collections import namedtuple, defaultdict
 import sys
 import yattag
 import newlinejson as nlj
+from classification import result_columns
 from classification import utility
 from classification.utility import VESSEL_CLASS_DETAILED_NAMES, VESSEL_CATEGORIES, TEST_SPLIT, schema, atomic
 import gzip
@@ -135,6 +140,9 @@ class InferenceResults(object):
 
     @property
     def indexed_scores(self):
+        if isinstance(self.scores, np.ndarray) and self.scores.ndim == 2:
+            # Already dense, in label_list order.
+            return self.scores
         if self._indexed_scores is None:
             logging.debug('create index_scores')
             iscores = np.zeros([len(self.mmsi), len(self.label_list)])
@@ -496,11 +504,19 @@ fishing_category_map = {
 }
 
 
+def concatenate_by_mmsi(by_mmsi):
+    """Concatenate the per mmsi arrays of `by_mmsi`, which may be empty."""
+    values = list(by_mmsi.values())
+    if not values:
+        return np.zeros([0])
+    return np.concatenate(values)
+
+
 def ydump_fishing_localisation(doc, results):
     doc, tag, text, line = doc.ttl()
 
-    y_true = np.concatenate(results.true_fishing_by_mmsi.values())
-    y_pred = np.concatenate(results.pred_fishing_by_mmsi.values())
+    y_true = concatenate_by_mmsi(results.true_fishing_by_mmsi)
+    y_pred = concatenate_by_mmsi(results.pred_fishing_by_mmsi)
 
     header = ['Gear Type (mmsi:true/total)', 'Precision', 'Recall', 'Accuracy', 'F1-Score']
     rows = []
@@ -535,8 +551,8 @@ def ydump_fishing_localisation(doc, results):
 
     rows.append(['', '', '', '', ''])
 
-    y_true = np.concatenate(results.true_fishing_by_mmsi.values())
-    y_pred = np.concatenate(results.pred_fishing_by_mmsi.values())
+    y_true = concatenate_by_mmsi(results.true_fishing_by_mmsi)
+    y_pred = concatenate_by_mmsi(results.pred_fishing_by_mmsi)
 
     rows.append(['Overall',
                  precision_score(y_true, y_pred),
@@ -718,26 +734,152 @@ def confusion_matrix(results):
     return ConfusionMatrix(cm_raw, cm_normalized)
 
 
-def load_inferred(inference_path, extractors, whitelist):
+def _strip_mmsi(row):
+    # Mmsis are usually strings, which may be padded.
+    if hasattr(row['mmsi'], 'strip'):
+        row['mmsi'] = row['mmsi'].strip()
+
+
+def load_inferred(inference_paths, extractors, whitelist):
     """Load inferred data and generate comparison data
 
     """
+    for inference_path in inference_paths:
+        with gzip.GzipFile(inference_path) as f:
+        # with open(inference_path) as f:
+            with nlj.open(f, json_lib='ujson') as src:
+                for row in src:
+                    _strip_mmsi(row)
+                    if whitelist is not None and row['mmsi'] not in whitelist:
+                        continue
+                    # Parsing dates is expensive and all extractors use dates, so parse them
+                    # once up front
+                    row['start_time'] = _parse(row['start_time'])
+                    #dateutil.parser.parse(row['start_time'])
+                    for ext in extractors:
+                        ext.extract(row)
+    for ext in extractors:
+        ext.finalize()
+
+
+def convert_columns(inference_path, cache_path=None):
+    """Convert inference results to `result_columns`, if not already done.
+
+    `inference_path` may be a columns directory itself, such as the
+    sidecar written by `ResultWriter(..., columns=True)`. Otherwise the
+    newline-JSON is converted once and cached in `cache_path` (by default
+    `<inference_path>.columns`), unless the cache is newer than the
+    inference results and in the current format. Mmsis are stripped of
+    whitespace, as `load_inferred` does.
+
+    Returns:
+        The columns directory.
+    """
+    if os.path.exists(os.path.join(inference_path,
+                                   result_columns.MANIFEST_FILE)):
+        with open(os.path.join(inference_path,
+                               result_columns.MANIFEST_FILE)) as f:
+            version = json.load(f).get('version')
+        if version != result_columns.FORMAT_VERSION:
+            raise ValueError('%s holds columns in an old format; rerun '
+                             'inference or load the JSON results' %
+                             inference_path)
+        return inference_path
+    if cache_path is None:
+        cache_path = inference_path + '.columns'
+    manifest_path = os.path.join(cache_path, result_columns.MANIFEST_FILE)
+    if (os.path.exists(manifest_path) and
+            os.path.getmtime(manifest_path) >= os.path.getmtime(inference_path)):
+        with open(manifest_path) as f:
+            version = json.load(f).get('version')
+        if version == result_columns.FORMAT_VERSION:
+            logging.info('Using cached columns in %s', cache_path)
+            return cache_path
+    logging.info('Converting %s to columns in %s', inference_path, cache_path)
+    if os.path.exists(manifest_path):
+        os.unlink(manifest_path)
+    builder = result_columns.ColumnBuilder()
     with gzip.GzipFile(inference_path) as f:
-    # with open(inference_path) as f:
         with nlj.open(f, json_lib='ujson') as src:
             for row in src:
-                if whitelist is not None and row['mmsi'] not in whitelist:
-                    continue
-                # Parsing dates is expensive and all extractors use dates, so parse them
-                # once up front
-                row['start_time'] = _parse(row['start_time'])
-                #dateutil.parser.parse(row['start_time'])
-                for ext in extractors:
-                    ext.extract(row)
+                _strip_mmsi(row)
+                builder.append(row)
+    builder.save(cache_path)
+    return cache_path
+
+
+def _convert_columns(paths):
+    return convert_columns(*paths)
+
+
+def load_columns(inference_paths, cache_path=None, num_workers=1):
+    """Load inference result shards as `result_columns`.
+
+    Shards are converted by `convert_columns` in `num_workers` processes.
+    With several shards, `cache_path` is a directory holding the cache of
+    each.
+
+    Returns:
+        A list of `(manifest, arrays)`, one per shard, memory mapped.
+    """
+    if cache_path is None or len(inference_paths) == 1:
+        cache_paths = [cache_path] * len(inference_paths)
+    else:
+        cache_paths = [
+            os.path.join(cache_path, os.path.basename(x) + '.columns')
+            for x in inference_paths
+        ]
+    work = list(zip(inference_paths, cache_paths))
+    if num_workers > 1 and len(work) > 1:
+        pool = multiprocessing.Pool(min(num_workers, len(work)))
+        try:
+            columns_paths = pool.map(_convert_columns, work)
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        columns_paths = [_convert_columns(x) for x in work]
+    return [result_columns.load_columns(x) for x in columns_paths]
+
+
+def epoch_to_datetimes(seconds):
+    """Object array of UTC datetimes for an array of epoch seconds."""
+    unique, inverse = np.unique(seconds, return_inverse=True)
+    dts = np.empty([len(unique)], dtype=object)
+    dts[:] = [datetime.datetime.utcfromtimestamp(x).replace(tzinfo=pytz.utc)
+              for x in unique.tolist()]
+    return dts[inverse]
+
+
+def load_inferred_columns(columns, extractors, whitelist):
+    """As `load_inferred`, but from `load_columns` shards.
+
+    Extractors accumulate each shard's rows as arrays, which are
+    concatenated when they're finalized.
+    """
+    for manifest, arrays in columns:
+        codes, inverse = np.unique(arrays['mmsi'], return_inverse=True)
+        codes = [x if isinstance(x, str) else x.decode('utf-8')
+                 for x in codes.tolist()]
+        mmsis = np.array(codes)[inverse]
+        if whitelist is None:
+            keep = np.ones([len(mmsis)], dtype=bool)
+        else:
+            keep = np.array([x in whitelist for x in codes],
+                            dtype=bool)[inverse]
+        for ext in extractors:
+            ext.extract_columns(manifest, arrays, mmsis, keep)
     for ext in extractors:
         ext.finalize()
 
 
+def _field_rows(manifest, arrays, field, keep):
+    """Rows holding `field`, and which of the field's entries to keep."""
+    rows = np.asarray(arrays[field + '.rows'])
+    mask = keep[rows]
+    return rows[mask], mask
+
+
 class ClassificationExtractor(InferenceResults):
     # Conceptually an InferenceResult
     # TODO: fix to make true subclass or return true inference result at finalization time or something.
@@ -758,6 +900,9 @@ class ClassificationExtractor(InferenceResults):
         self.scores = []
         #
         self.all_labels = set(label_map.values())
+        # Dense [rows, len(VESSEL_CLASS_DETAILED_NAMES)] scores of rows from
+        # `extract_columns`.
+        self._score_chunks = []
 
     def extract(self, row):
         mmsi = row['mmsi'].strip()
@@ -788,13 +933,47 @@ class ClassificationExtractor(InferenceResults):
             self.inferred_labels.append(inferred)
             self.scores.append(label_scores)
 
+    def extract_columns(self, manifest, arrays, mmsis, keep):
+        if self.field not in manifest['fields']:
+            return
+        rows, mask = _field_rows(manifest, arrays, self.field, keep)
+        classes = manifest['fields'][self.field]['classes']
+        self.all_labels |= set(classes)
+        scores = np.zeros([len(rows), len(VESSEL_CLASS_DETAILED_NAMES)],
+                          dtype=np.float32)
+        scores[:, [VESSEL_CLASS_DETAILED_NAMES.index(x) for x in classes]] = (
+            np.asarray(arrays[self.field + '.scores'])[mask])
+        mmsi = mmsis[rows]
+        labels = [self.label_map.get(x) for x in mmsi]
+        inferred = np.array(classes)[np.asarray(
+            arrays[self.field + '.max_label'])[mask]]
+        self.all_mmsi.extend(mmsi)
+        self.all_start_dates.extend(
+            epoch_to_datetimes(arrays['start_time'][rows]))
+        self.all_true_labels.extend(labels)
+        self.all_inferred_labels.extend(inferred)
+        self._score_chunks.append(scores)
+
     def finalize(self):
+        self.label_list = sorted(
+            self.all_labels, key=VESSEL_CLASS_DETAILED_NAMES.index)
+        if self._score_chunks:
+            # Rows came from columns; the known rows are picked out here.
+            known = np.array([x is not None for x in self.all_true_labels],
+                             dtype=bool)
+            columns = [VESSEL_CLASS_DETAILED_NAMES.index(x)
+                       for x in self.label_list]
+            self.all_scores = np.concatenate(self._score_chunks)[:, columns]
+            self._score_chunks = []
+            self.mmsi = np.array(self.all_mmsi)[known]
+            self.start_dates = np.array(self.all_start_dates)[known]
+            self.true_labels = np.array(self.all_true_labels)[known]
+            self.inferred_labels = np.array(self.all_inferred_labels)[known]
+            self.scores = self.all_scores[known]
         self.inferred_labels = np.array(self.inferred_labels)
         self.true_labels = np.array(self.true_labels)
         self.start_dates = np.array(self.start_dates)
         self.scores = np.array(self.scores)
-        self.label_list = sorted(
-            self.all_labels, key=VESSEL_CLASS_DETAILED_NAMES.index)
         self.mmsi = np.array(self.mmsi)
         for lbl in self.label_list:
             true_count = (self.true_labels == lbl).sum()
@@ -828,6 +1007,20 @@ class AttributeExtractor(object):
         self.true_labels.append(self.label_map.get(mmsi, 'Unknown'))
         self.inferred_attrs.append(row[self.key]['value'])
 
+    def extract_columns(self, manifest, arrays, mmsis, keep):
+        if self.key not in manifest['fields']:
+            return
+        rows, mask = _field_rows(manifest, arrays, self.key, keep)
+        mmsi = mmsis[rows]
+        self.mmsi.extend(mmsi)
+        self.start_dates.extend(epoch_to_datetimes(arrays['start_time'][rows]))
+        self.true_attrs.extend(
+            float(self.attr_map[x]) if (x in self.attr_map) else np.nan
+            for x in mmsi)
+        self.true_labels.extend(self.label_map.get(x, 'Unknown') for x in mmsi)
+        self.inferred_attrs.extend(
+            np.asarray(arrays[self.key + '.value'])[mask])
+
     def finalize(self):
         self.inferred_attrs = np.array(self.inferred_attrs)
         self.true_attrs = np.array(self.true_attrs)
@@ -854,6 +1047,23 @@ class FishingRangeExtractor(object):
         self.coverage_by_mmsi[mmsi].append(
             (_parse(row['start_time']), _parse(row['end_time'])))
 
+    def extract_columns(self, manifest, arrays, mmsis, keep):
+        field = 'fishing_localisation'
+        if field not in manifest['fields']:
+            return
+        rows, _ = _field_rows(manifest, arrays, field, keep)
+        for mmsi, s, e in zip(mmsis[rows],
+                              epoch_to_datetimes(arrays['start_time'][rows]),
+                              epoch_to_datetimes(arrays['end_time'][rows])):
+            self.coverage_by_mmsi[mmsi].append((s, e))
+        range_row = np.asarray(arrays[field + '.range_row'])
+        mask = keep[range_row] & (np.asarray(arrays[field + '.range_value']) != 0)
+        for mmsi, s, e in zip(
+                mmsis[range_row[mask]],
+                epoch_to_datetimes(arrays[field + '.range_start'][mask]),
+                epoch_to_datetimes(arrays[field + '.range_end'][mask])):
+            self.ranges_by_mmsi[mmsi].append((s, e))
+
     def finalize(self):
         pass
 
@@ -871,64 +1081,85 @@ def assemble_composite(results, mapping):
     Returns:
         InferenceResults instance
 
-    Classes are remapped according to mapping.
+    Classes are remapped according to mapping. The composite scores are
+    a dense array with a column per composite label.
 
     """
 
     label_list = [lbl for (lbl, base_labels) in mapping]
-    inferred_scores = []
-    inferred_labels = []
-    true_labels = []
-    start_dates = []
 
     inverse_mapping = {}
-    for new_label, base_labels in mapping:
-        for lbl in base_labels:
+    base_labels = []
+    for new_label, labels in mapping:
+        for lbl in labels:
             inverse_mapping[lbl] = new_label
-    base_label_map = {x: i for (i, x) in enumerate(results.label_list)}
-
-    for i, mmsi in enumerate(results.all_mmsi):
-        scores = {}
-        for (new_label, base_labels) in mapping:
-            scores[new_label] = 0
-            for lbl in base_labels:
-                scores[new_label] += results.all_scores[i][lbl]
-        inferred_scores.append(scores)
-        inferred_labels.append(max(scores, key=scores.__getitem__))
-        old_label = results.all_true_labels[i]
-        new_label = None if (old_label is None) else inverse_mapping[old_label]
-        true_labels.append(new_label)
-        start_dates.append(results.all_start_dates[i])
-
-    def trim(seq):
-        return np.array([x for (i, x) in enumerate(seq) if true_labels[i]])
+            if lbl not in base_labels:
+                base_labels.append(lbl)
+
+    # 0/1 matrix summing base scores into composite scores.
+    composite_matrix = np.zeros([len(base_labels), len(label_list)])
+    for j, (new_label, labels) in enumerate(mapping):
+        for lbl in labels:
+            composite_matrix[base_labels.index(lbl), j] = 1
 
+    all_scores = results.all_scores
+    if isinstance(all_scores, np.ndarray) and all_scores.ndim == 2:
+        base_label_map = {x: i for (i, x) in enumerate(results.label_list)}
+        base_scores = all_scores[:, [base_label_map[x] for x in base_labels]]
+    else:
+        base_scores = np.array(
+            [[row[x] for x in base_labels] for row in all_scores],
+            dtype=float).reshape([-1, len(base_labels)])
+    scores = base_scores.dot(composite_matrix)
+    inferred_labels = np.array(label_list)[scores.argmax(axis=1)]
+
+    # Map each distinct true label once; '' stands for unknown.
+    old_labels = np.array(['' if (x is None) else x
+                           for x in results.all_true_labels], dtype=object)
+    unique_labels, inverse = np.unique(old_labels, return_inverse=True)
+    true_labels = np.array([None if (x == '') else inverse_mapping[x]
+                            for x in unique_labels.tolist()],
+                           dtype=object)[inverse]
+    known = (old_labels != '')
+
+    all_mmsi = np.array(results.all_mmsi)
+    start_dates = np.array(results.all_start_dates)
+
+    # Scores stay dense, in label_list order, as `indexed_scores` expects.
     return InferenceResults(
-        trim(results.all_mmsi), trim(inferred_labels), trim(true_labels),
-        trim(start_dates), trim(inferred_scores), label_list,
-        np.array(results.all_mmsi), np.array(inferred_labels),
-        np.array(true_labels), np.array(start_dates),
-        np.array(inferred_scores))
+        all_mmsi[known], inferred_labels[known],
+        np.array(true_labels[known].tolist()), start_dates[known],
+        scores[known], label_list, all_mmsi, inferred_labels,
+        true_labels, start_dates, scores)
 
 
-def get_local_inference_path(args):
-    """Return a local path to inference data.
+def get_local_inference_paths(args):
+    """Return local paths to the inference data shards.
 
-    Data is downloaded to a temp directory if on GCS. 
+    `args.inference_path` may be a glob matching several shards. Data is
+    downloaded to a temp directory if on GCS.
 
     NOTE: if a correctly named local file is already present, new data
           will not be downloaded.
     """
     if args.inference_path.startswith('gs'):
-        inference_path = os.path.join(temp_dir,
-                                      os.path.basename(args.inference_path))
-        if not os.path.exists(inference_path):
-            subprocess.check_call(
-                ['gsutil', 'cp', args.inference_path, inference_path])
+        remote_paths = subprocess.check_output(
+            ['gsutil', 'ls', args.inference_path]).decode('utf-8').split()
+        inference_paths = [os.path.join(temp_dir, os.path.basename(x))
+                           for x in remote_paths]
+        missing = [remote for (remote, local)
+                   in zip(remote_paths, inference_paths)
+                   if not os.path.exists(local)]
+        if missing:
+            if not os.path.exists(temp_dir):
+                os.makedirs(temp_dir)
+            subprocess.check_call(['gsutil', '-m', 'cp'] + missing + [temp_dir])
     else:
-        inference_path = args.inference_path
+        inference_paths = sorted(glob.glob(args.inference_path))
+    if not inference_paths:
+        raise IOError('No inference results match %s' % args.inference_path)
     #
-    return inference_path
+    return inference_paths
 
 
 def load_true_fishing_ranges_by_mmsi(fishing_range_path,
@@ -955,6 +1186,52 @@ def datetime_to_minute(dt):
     return int(timestamp // 60)
 
 
+def fill_minutes(minutes, ranges, start_min):
+    """Set `minutes[m]` to `value` for each `(value, start, end)` range.
+
+    `m` is minutes since `start_min`. Ranges are inclusive of both ends,
+    clipped to `minutes`, and later ranges overwrite earlier ones.
+    """
+    for (value, s, e) in ranges:
+        lo = max(datetime_to_minute(s) - start_min, 0)
+        hi = datetime_to_minute(e) - start_min + 1
+        if lo < hi:
+            minutes[lo:hi] = value
+
+
+def paint_intervals(ranges):
+    """Flatten overlapping `(value, start, end)` minute ranges.
+
+    As `fill_minutes`, later ranges overwrite earlier ones, but ranges are
+    half open and the result is a sorted list of disjoint `(start, end,
+    value)` intervals, adjacent equal values merged, rather than a
+    per-minute array.
+    """
+    bounds = sorted(set([lo for (_, lo, hi) in ranges if lo < hi] +
+                        [hi for (_, lo, hi) in ranges if lo < hi]))
+    starts = sorted(range(len(ranges)), key=lambda i: ranges[i][1])
+    # Ranges covering the current interval, latest first.
+    active = []
+    j = 0
+    intervals = []
+    for lo, hi in zip(bounds[:-1], bounds[1:]):
+        while j < len(starts) and ranges[starts[j]][1] <= lo:
+            value, _, end = ranges[starts[j]]
+            if end > lo:
+                heapq.heappush(active, (-starts[j], end, value))
+            j += 1
+        while active and active[0][1] <= lo:
+            heapq.heappop(active)
+        if not active:
+            continue
+        value = active[0][2]
+        if intervals and intervals[-1][1] == lo and intervals[-1][2] == value:
+            intervals[-1] = (intervals[-1][0], hi, value)
+        else:
+            intervals.append((lo, hi, value))
+    return intervals
+
+
 def compare_fishing_localisation(extracted_ranges, fishing_range_path,
                                  label_map, split_map):
 
@@ -992,29 +1269,19 @@ def compare_fishing_localisation(extracted_ranges, fishing_range_path,
 
         # Fill in minutes[:, 0] with known true / false values
         logging.debug('filling 0s')
-        for (is_fishing, s, e) in true_ranges:
-            s_min = datetime_to_minute(s)
-            e_min = datetime_to_minute(e)
-            for m in range(s_min - start_min, e_min - start_min + 1):
-                minutes[m, 0] = is_fishing
+        fill_minutes(minutes[:, 0], true_ranges, start_min)
 
         # fill in minutes[:, 1] with 0 (default) in areas with coverage
         logging.debug('filling 1s')
-        for (s, e) in pred_coverage_by_mmsi[mmsi]:
-            s_min = datetime_to_minute(s)
-            e_min = datetime_to_minute(e)
-            for m in range(s_min - start_min, e_min - start_min + 1):
-                if 0 <= m < len(minutes):
-                    minutes[m, 1] = 0
+        fill_minutes(minutes[:, 1],
+                     [(0, s, e) for (s, e) in pred_coverage_by_mmsi[mmsi]],
+                     start_min)
 
         # fill in minutes[:, 1] with 1 where fishing is predicted
         logging.debug('filling in predicted values')
-        for (s, e) in pred_ranges_by_mmsi[mmsi]:
-            s_min = datetime_to_minute(s)
-            e_min = datetime_to_minute(e)
-            for m in range(s_min - start_min, e_min - start_min + 1):
-                if 0 <= m < len(minutes):
-                    minutes[m, 1] = 1
+        fill_minutes(minutes[:, 1],
+                     [(1, s, e) for (s, e) in pred_ranges_by_mmsi[mmsi]],
+                     start_min)
 
         mask = ((minutes[:, 0] != -1) & (minutes[:, 1] != -1))
 
@@ -1040,10 +1307,13 @@ def compute_fishing_range_agreement(
     pred_coverage_by_mmsi = {k: extracted_ranges.coverage_by_mmsi[k]
                              for k in true_ranges_by_mmsi}
 
-    human_agreement = []
-    human_pairs = []
-    agreement = []
-    counts = []
+    human_agreement = 0.0
+    human_pairs = 0.0
+    agreement = 0.0
+    counts = 0.0
+
+    def to_minutes(value, s, e):
+        return (value, datetime_to_minute(s), datetime_to_minute(e) + 1)
 
     for mmsi in sorted(true_ranges_by_mmsi.keys()):
         logging.debug('processing %s', mmsi)
@@ -1053,78 +1323,47 @@ def compute_fishing_range_agreement(
         if not true_ranges:
             continue
 
-        # Determine minutes from start to finish of this mmsi, create an array to
-        # hold results and fill with -1 (unknown)
+        # Human (n_trues, n_total) and predicted values over disjoint minute
+        # intervals; minutes outside them are unknown.
         logging.debug('processing %s true ranges', len(true_ranges))
-        logging.debug('finding overall range')
-        _, start, end = true_ranges[0]
-        for (_, s, e) in true_ranges[1:]:
-            start = min(start, s)
-            end = max(end, e)
-        start_min = datetime_to_minute(start)
-        end_min = datetime_to_minute(end)
-        minutes = np.empty([end_min - start_min + 1, 3], dtype=float)
-        minutes.fill(-1)
-
-        # Fill in minutes[:, :2] with human trues and ranges
-        logging.debug('filling in predicted values')
+        human_ranges = []
         for (encoded, s, e) in true_ranges:
-            s_min = datetime_to_minute(s)
-            e_min = datetime_to_minute(e)
             # decode agreement (TODO: fix this ridiculous approach)
             n_trues = np.round((1000 * encoded) // 1)
             n_total = np.round(((1000 * encoded) % 1) * 1000)
-            for m in range(s_min - start_min, e_min - start_min + 1):
-                minutes[m, 0] = n_trues
-                minutes[m, 1] = n_total
+            human_ranges.append(to_minutes((n_trues, n_total), s, e))
+        human = paint_intervals(human_ranges)
+        predicted = paint_intervals(
+            [to_minutes(0, s, e) for (s, e) in pred_coverage_by_mmsi[mmsi]] +
+            [to_minutes(1, s, e) for (s, e) in pred_ranges_by_mmsi[mmsi]])
+
+        # Sweep both, weighting each overlap by its length in minutes.
+        i = j = 0
+        while i < len(human) and j < len(predicted):
+            h_lo, h_hi, (a, n) = human[i]
+            p_lo, p_hi, f = predicted[j]
+            minutes = min(h_hi, p_hi) - max(h_lo, p_lo)
+            if minutes > 0:
+                b = n - a
+                matches = f * a + (1 - f) * b
+                assert matches <= n
+                agreement += minutes * matches
+                counts += minutes * n
+                human_agreement += minutes * (a * (a - 1) + b * (b - 1))
+                human_pairs += minutes * n * (n - 1)
+            if h_hi < p_hi:
+                i += 1
+            else:
+                j += 1
 
-        # fill in minutes[:, 2] with 0 (default) in areas with coverage
-        logging.debug('filling 0s')
-        for (s, e) in pred_coverage_by_mmsi[mmsi]:
-            s_min = datetime_to_minute(s)
-            e_min = datetime_to_minute(e)
-            for m in range(s_min - start_min, e_min - start_min + 1):
-                if 0 <= m < len(minutes):
-                    minutes[m, 2] = 0
-
-        # fill in minutes[:, 2] with 1 where fishing is predicted
-        logging.debug('filling 1s')
-        for (s, e) in pred_ranges_by_mmsi[mmsi]:
-            s_min = datetime_to_minute(s)
-            e_min = datetime_to_minute(e)
-            for m in range(s_min - start_min, e_min - start_min + 1):
-                if 0 <= m < len(minutes):
-                    minutes[m, 2] = 1
-
-        mask = ((minutes[:, 0] != -1) & (minutes[:, 2] != -1))
-
-        if mask.sum():
-            minutes = minutes[mask]
-            n = minutes[:, 1]
-            a = minutes[:, 0]
-            b = n - a
-            f = minutes[:, 2]
-
-            matches = f * a + (1 - f) * b
-            cnts = minutes[:, 1]
-            assert np.alltrue(matches <= n)
-            agreement.append(matches)
-            counts.append(n)
-            human_agreement.append(a * (a - 1) + b * (b - 1))
-            human_pairs.append(n * (n - 1))
-
-    agreement = np.concatenate(agreement, axis=0)
-    counts = np.concatenate(counts, axis=0)
-    human_agreement = np.concatenate(human_agreement)
-    human_pairs = np.concatenate(human_pairs)
     logging.info('Model agreement with humans over predicted ranges: %s',
-                 agreement.sum() / counts.sum())
+                 agreement / counts)
     logging.info('Human agreement over predicted ranges: %s',
-                 human_agreement.sum() / human_pairs.sum())
+                 human_agreement / human_pairs)
 
 
 def compute_results(args):
-    inference_path = get_local_inference_path(args)
+    inference_paths = get_local_inference_paths(args)
 
     logging.info('Loading label maps')
     maps = defaultdict(dict)
@@ -1182,7 +1421,13 @@ def compute_results(args):
         whitelist = set([x for x in maps['split'] if maps['split'][x] == TEST_SPLIT]) 
     else:
         whitelist = None
-    load_inferred(inference_path, results.values(), whitelist)
+    if args.no_column_cache:
+        load_inferred(inference_paths, results.values(), whitelist)
+    else:
+        load_inferred_columns(
+            load_columns(inference_paths, args.column_cache_path,
+                         args.num_workers),
+            results.values(), whitelist)
 
     if not args.skip_class_metrics:
         # Sanity check attribute values after loading
@@ -1215,13 +1460,75 @@ def compute_results(args):
     return results
 
 
-def dump_html(args, results):
+def overall_metrics(args, results):
+    """Headline metrics for `results`, keyed by name, for comparing runs."""
+    metrics = []
+    if not args.skip_class_metrics:
+        for key, heading in CLASSIFICATION_METRICS:
+            if results[key]:
+                consolidated = consolidate_across_dates(results[key])
+                metrics.append(('{} accuracy'.format(heading),
+                                accuracy_score(consolidated.true_labels,
+                                               consolidated.inferred_labels)))
+    if not args.skip_attribute_metrics and results['length']:
+        for key in ['length', 'tonnage', 'engine_power', 'crew_size']:
+            consolidated = consolidate_attribute_across_dates(results[key])
+            mask = (~np.isnan(consolidated.true_attrs) &
+                    ~np.isnan(consolidated.inferred_attrs))
+            metrics.append(('{} abs error'.format(key), abs(
+                consolidated.true_attrs[mask] -
+                consolidated.inferred_attrs[mask]).mean()))
+    if not args.skip_localisation_metrics:
+        y_true = concatenate_by_mmsi(
+            results['localisation'].true_fishing_by_mmsi)
+        y_pred = concatenate_by_mmsi(
+            results['localisation'].pred_fishing_by_mmsi)
+        if len(y_true):
+            metrics.append(('Localisation accuracy',
+                            accuracy_score(y_true, y_pred)))
+            metrics.append(('Localisation F1', f1_score(y_true, y_pred)))
+    return metrics
+
+
+def ydump_baseline_comparison(doc, args, results, baseline_results):
+    """dump the change in headline metrics from a baseline run
+
+    Args:
+        doc: yatag Doc instance
+        results: results of `compute_results`
+        baseline_results: results of `compute_results` for the baseline
+
+    """
+    doc, tag, text, line = doc.ttl()
+
+    baseline = dict(overall_metrics(args, baseline_results))
+    rows = []
+    for name, value in overall_metrics(args, results):
+        if name not in baseline:
+            logging.warning('%s not in baseline results', name)
+            continue
+        rows.append((name, '{:.4f}'.format(baseline[name]),
+                     '{:.4f}'.format(value),
+                     '{:+.4f}'.format(value - baseline[name])))
+        logging.info('%s: %s (baseline %s)', name, value, baseline[name])
+
+    with tag('div', klass='unbreakable'):
+        ydump_table(doc, ['Metric', 'Baseline', 'Value', 'Change'], rows)
+
+
+def dump_html(args, results, baseline_results=None):
 
     doc = yattag.Doc()
 
     with doc.tag('style', type='text/css'):
         doc.asis(css)
 
+    if baseline_results is not None:
+        logging.info('Dumping change from baseline')
+        doc.line('h2', 'Change from Baseline')
+        ydump_baseline_comparison(doc, args, results, baseline_results)
+        doc.stag('hr')
+
     if not args.skip_class_metrics:
         for key, heading in CLASSIFICATION_METRICS:
             if results[key]:
@@ -1308,7 +1615,9 @@ if __name__ == '__main__':
     parser = argparse.ArgumentParser(
         description='Test inference results and output metrics.\n')
     parser.add_argument(
-        '--inference-path', help='path to inference results', required=True)
+        '--inference-path',
+        help='path to inference results; may be a glob matching several shards',
+        required=True)
     parser.add_argument(
         '--label-path', help='path to test data', required=True)
     parser.add_argument('--fishing-ranges', help='path to fishing range data')
@@ -1332,12 +1641,37 @@ if __name__ == '__main__':
         help='dump csv file mapping mmmsi to inferred attributes')
     parser.add_argument('--agreement-ranges-path')
     parser.add_argument('--test-only', action='store_true')
+    parser.add_argument(
+        '--column-cache-path',
+        help='where to cache the inference results as memory mappable '
+        'columns (default: <inference path>.columns); a directory of per '
+        'shard caches if there are several shards')
+    parser.add_argument(
+        '--no-column-cache', action='store_true',
+        help='parse the newline-JSON inference results directly')
+    parser.add_argument(
+        '--num-workers', type=int, default=multiprocessing.cpu_count(),
+        help='processes converting inference shards to columns')
+    parser.add_argument(
+        '--baseline-inference-path',
+        help='path to inference results to report changes in metrics from, '
+        'e.g. those of the float model a quantized one was made from')
 
     args = parser.parse_args()
 
     results = compute_results(args)
 
-    dump_html(args, results)
+    if args.baseline_inference_path:
+        baseline_args = argparse.Namespace(**vars(args))
+        baseline_args.inference_path = args.baseline_inference_path
+        baseline_args.agreement_ranges_path = None
+        baseline_args.column_cache_path = None
+        logging.info('Computing baseline results')
+        baseline_results = compute_results(baseline_args)
+    else:
+        baseline_results = None
+
+    dump_html(args, results, baseline_results)
 
     dump_years = [int(x) for x in args.dump_years.split(',')] if (args.dump_years != "ALL_ONLY") else []
 
@@ -13,12 +13,16 @@
 # limitations under the License.
 
 from __future__ import division, print_function
+import argparse
 import os
 import csv
+import gzip
+import json
 import numpy as np
 import tensorflow as tf
 import compute_metrics
 import datetime
+import pytz
 
 
 class BasicMetricTests(tf.test.TestCase):
@@ -91,7 +95,9 @@ class AssembleComposite(tf.test.TestCase):
         new = compute_metrics.assemble_composite(self.results, self.mapping)
         self.assertAllEqual(new.all_inferred_labels, ['G'])
         self.assertAllEqual(new.all_true_labels, ['G'])
-        self.assertAllEqual(new.all_scores, [{'F': 0.4, 'G': 0.6}])
+        self.assertEqual(['F', 'G'], new.label_list)
+        self.assertAllClose(new.all_scores, [[0.4, 0.6]])
+        self.assertAllClose(new.indexed_scores, [[0.4, 0.6]])
 
 
 class Consolidate(tf.test.TestCase):
@@ -117,5 +123,208 @@ class Consolidate(tf.test.TestCase):
         print(new.all_scores)
 
 
+class FillMinutes(tf.test.TestCase):
+
+    def test_overlapping_and_clipped(self):
+        t0 = datetime.datetime(2015, 1, 1, tzinfo=pytz.utc)
+
+        def minute(m):
+            return t0 + datetime.timedelta(minutes=m)
+
+        start_min = compute_metrics.datetime_to_minute(t0)
+        minutes = np.empty([10], dtype=int)
+        minutes.fill(-1)
+        compute_metrics.fill_minutes(minutes, [
+            (0, minute(-5), minute(3)),
+            (1, minute(2), minute(4)),
+            (0, minute(8), minute(20)),
+            (1, minute(6), minute(5)),
+        ], start_min)
+        self.assertAllEqual(minutes, [0, 0, 1, 1, 1, -1, -1, -1, 0, 0])
+
+
+class PaintIntervals(tf.test.TestCase):
+
+    def test_later_ranges_overwrite(self):
+        intervals = compute_metrics.paint_intervals([
+            ('a', 0, 10),
+            ('b', 5, 8),
+            ('c', 12, 15),
+            ('d', 14, 14),
+            ('e', 9, 13),
+        ])
+        self.assertEqual(intervals, [(0, 5, 'a'), (5, 8, 'b'), (8, 9, 'a'),
+                                     (9, 13, 'e'), (13, 15, 'c')])
+
+
+class OverallMetrics(tf.test.TestCase):
+    args = argparse.Namespace(skip_class_metrics=True,
+                              skip_attribute_metrics=True,
+                              skip_localisation_metrics=False)
+
+    def _results(self, true_by_mmsi, pred_by_mmsi):
+        return {'localisation': compute_metrics.LocalisationResults(
+            true_by_mmsi, pred_by_mmsi, {})}
+
+    def test_localisation(self):
+        results = self._results(
+            {'1': np.array([1, 0]), '2': np.array([1, 1])},
+            {'1': np.array([1, 1]), '2': np.array([1, 1])})
+        metrics = dict(compute_metrics.overall_metrics(self.args, results))
+        self.assertAllClose(0.75, metrics['Localisation accuracy'])
+        self.assertAllClose(6 / 7., metrics['Localisation F1'])
+
+    def test_empty_localisation(self):
+        for true_by_mmsi, pred_by_mmsi in [({}, {}), ({'1': np.zeros([0])},
+                                                      {'1': np.zeros([0])})]:
+            results = self._results(true_by_mmsi, pred_by_mmsi)
+            self.assertEqual(
+                [], compute_metrics.overall_metrics(self.args, results))
+
+
+class LoadColumns(tf.test.TestCase):
+
+    def _write_results(self, path, rows=range(20), mmsi_format='%d'):
+        labels = ['trawlers', 'tug', 'cargo']
+        with gzip.GzipFile(path, 'w') as f:
+            for i in rows:
+                scores = {x: 0.1 for x in labels}
+                scores[labels[i % 3]] = 0.8
+                start = datetime.datetime(2015, 1 + i % 12, 1)
+                row = {
+                    'mmsi': mmsi_format % (100 + i % 7),
+                    'start_time': start.isoformat(),
+                    'end_time': (start + datetime.timedelta(days=30)).isoformat(),
+                    'Multiclass': {'max_label': labels[i % 3],
+                                   'label_scores': scores},
+                    'length': {'value': i * 1.5},
+                }
+                f.write((json.dumps(row) + '\n').encode('utf-8'))
+
+    def _extractors(self, mmsi_format='%d'):
+        label_map = {mmsi_format % 100: 'trawlers', mmsi_format % 101: 'tug',
+                     mmsi_format % 103: 'cargo'}
+        return [
+            compute_metrics.ClassificationExtractor('Multiclass', label_map),
+            compute_metrics.AttributeExtractor(
+                'length', {mmsi_format % 100: '30'}, label_map),
+        ]
+
+    def _assert_same(self, expected, actual):
+        self.assertEqual(list(expected[0].mmsi), list(actual[0].mmsi))
+        self.assertEqual(list(expected[0].start_dates),
+                         list(actual[0].start_dates))
+        self.assertEqual(expected[0].label_list, actual[0].label_list)
+        self.assertEqual(list(expected[0].inferred_labels),
+                         list(actual[0].inferred_labels))
+        self.assertAllClose(expected[0].indexed_scores,
+                            actual[0].indexed_scores)
+        self.assertEqual(list(expected[1].mmsi), list(actual[1].mmsi))
+        self.assertAllClose(expected[1].inferred_attrs,
+                            actual[1].inferred_attrs)
+
+    def test_matches_json(self):
+        path = os.path.join(self.get_temp_dir(), 'results.json.gz')
+        self._write_results(path)
+        whitelist = set(['100', '101', '102', '103', '104'])
+        expected = self._extractors()
+        compute_metrics.load_inferred([path], expected, whitelist)
+        for _ in range(2):  # Convert, then load the cached columns.
+            actual = self._extractors()
+            compute_metrics.load_inferred_columns(
+                compute_metrics.load_columns([path]), actual, whitelist)
+            self._assert_same(expected, actual)
+
+    def test_non_numeric_mmsi(self):
+        path = os.path.join(self.get_temp_dir(), 'named.json.gz')
+        self._write_results(path, mmsi_format='vessel-%d')
+        whitelist = set(['vessel-100', 'vessel-101', 'vessel-103'])
+        expected = self._extractors('vessel-%d')
+        compute_metrics.load_inferred([path], expected, whitelist)
+        actual = self._extractors('vessel-%d')
+        compute_metrics.load_inferred_columns(
+            compute_metrics.load_columns([path]), actual, whitelist)
+        self._assert_same(expected, actual)
+        self.assertEqual(set(['vessel-100', 'vessel-101', 'vessel-103']),
+                         set(actual[0].mmsi))
+
+    def test_ties_and_padded_mmsis(self):
+        path = os.path.join(self.get_temp_dir(), 'ties.json.gz')
+        start = datetime.datetime(2015, 1, 1)
+        rows = [
+            # Tied scores, where argmax would pick trawlers.
+            (' 100 ', 'tug', {'trawlers': 0.45, 'tug': 0.45, 'cargo': 0.1}),
+            ('101\n', 'tug', {'trawlers': 0.2, 'tug': 0.7, 'cargo': 0.1}),
+            ('102', 'cargo', {'trawlers': 0.3, 'tug': 0.3, 'cargo': 0.4}),
+        ]
+        with gzip.GzipFile(path, 'w') as f:
+            for mmsi, max_label, scores in rows:
+                row = {
+                    'mmsi': mmsi,
+                    'start_time': start.isoformat(),
+                    'end_time': (start + datetime.timedelta(days=30)).isoformat(),
+                    'Multiclass': {'max_label': max_label,
+                                   'label_scores': scores},
+                    'length': {'value': 12.5},
+                }
+                f.write((json.dumps(row) + '\n').encode('utf-8'))
+        expected = self._extractors()
+        compute_metrics.load_inferred([path], expected, None)
+        actual = self._extractors()
+        compute_metrics.load_inferred_columns(
+            compute_metrics.load_columns([path]), actual, None)
+        self.assertEqual(['tug', 'tug'], list(expected[0].inferred_labels))
+        for name in ['mmsi', 'all_mmsi', 'start_dates', 'all_start_dates',
+                     'true_labels', 'all_true_labels', 'inferred_labels',
+                     'all_inferred_labels', 'label_list']:
+            self.assertEqual(list(getattr(expected[0], name)),
+                             list(getattr(actual[0], name)), name)
+        self.assertAllClose(expected[0].indexed_scores,
+                            actual[0].indexed_scores)
+        for name in ['mmsi', 'true_labels', 'start_dates']:
+            self.assertEqual(list(getattr(expected[1], name)),
+                             list(getattr(actual[1], name)), name)
+        self.assertAllClose(expected[1].true_attrs, actual[1].true_attrs)
+        self.assertAllClose(expected[1].inferred_attrs,
+                            actual[1].inferred_attrs)
+
+    def test_old_format_columns(self):
+        path = os.path.join(self.get_temp_dir(), 'old.json.gz')
+        self._write_results(path)
+        columns_path = compute_metrics.convert_columns(path)
+        manifest_path = os.path.join(columns_path, 'manifest.json')
+
+        def write_old_manifest():
+            with open(manifest_path) as f:
+                manifest = json.load(f)
+            del manifest['version']
+            with open(manifest_path, 'w') as f:
+                json.dump(manifest, f)
+
+        # An old cache is converted again.
+        write_old_manifest()
+        compute_metrics.convert_columns(path)
+        with open(manifest_path) as f:
+            self.assertIn('version', json.load(f))
+        # Old columns can't be read directly.
+        write_old_manifest()
+        with self.assertRaises(ValueError):
+            compute_metrics.convert_columns(columns_path)
+
+    def test_shards(self):
+        paths = [os.path.join(self.get_temp_dir(), 'shard-%d.json.gz' % i)
+                 for i in range(3)]
+        for i, path in enumerate(paths):
+            self._write_results(path, range(i, 20, 3))
+        expected = self._extractors()
+        compute_metrics.load_inferred(paths, expected, None)
+        actual = self._extractors()
+        compute_metrics.load_inferred_columns(
+            compute_metrics.load_columns(
+                paths, os.path.join(self.get_temp_dir(), 'shard-columns'),
+                num_workers=2), actual, None)
+        self._assert_same(expected, actual)
+
+
 if __name__ == '__main__':
     tf.test.main()